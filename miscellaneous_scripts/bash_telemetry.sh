@@ -1,12 +1,19 @@
 # telemetry.sh
 #!/bin/bash
 if [ -f /usr/local/bin/deep_learning_container.py ] && [[ -z "${OPT_OUT_TRACKING}" || "${OPT_OUT_TRACKING,,}" != "true" ]]; then
-    (
-        python /usr/local/bin/deep_learning_container.py \
-            --framework "${FRAMEWORK}" \
-            --framework-version "${FRAMEWORK_VERSION}" \
-            --container-type "${CONTAINER_TYPE}" \
-            &>/dev/null &
-    )
+    # same once per container marker as sitecustomize.py, keyed by the mount namespace of the
+    # container. noclobber makes the redirect fail if it exists
+    _dlc_telemetry_namespace=$(readlink /proc/self/ns/mnt 2>/dev/null)
+    _dlc_telemetry_marker=/tmp/.dlc-telemetry-${_dlc_telemetry_namespace//[^0-9]/}
+    [ -d /dev/shm ] && _dlc_telemetry_marker=/dev/shm/.dlc-telemetry-${_dlc_telemetry_namespace//[^0-9]/}
+    if [ "${TEST_MODE}" == "1" ] || (set -o noclobber; : > "${_dlc_telemetry_marker}") 2>/dev/null; then
+        (
+            OPT_OUT_TRACKING=true python /usr/local/bin/deep_learning_container.py \
+                --framework "${FRAMEWORK}" \
+                --framework-version "${FRAMEWORK_VERSION}" \
+                --container-type "${CONTAINER_TYPE}" \
+                &>/dev/null &
+        )
+    fi
+    unset _dlc_telemetry_marker _dlc_telemetry_namespace
 fi
-
@@ -4,11 +4,24 @@ try:
     if os.path.exists("/usr/local/bin/deep_learning_container.py") and (
         os.getenv("OPT_OUT_TRACKING") is None or os.getenv("OPT_OUT_TRACKING", "").lower() != "true"
     ):
-        import threading
+        # Every interpreter of the container runs this hook, only the one that creates the marker
+        # reports. /dev/shm is shared with the host and other containers under --ipc=host, so the
+        # marker is keyed by the mount namespace of the container, which is new on every start.
+        try:
+            namespace = os.readlink("/proc/self/ns/mnt")[len("mnt:[") : -1]
+        except OSError:
+            namespace = ""
+        marker = os.path.join(
+            "/dev/shm" if os.path.isdir("/dev/shm") else "/tmp", ".dlc-telemetry-" + namespace
+        )
+        if os.getenv("TEST_MODE") != "1":
+            os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
 
-        cmd = "python /usr/local/bin/deep_learning_container.py --framework {FRAMEWORK} --framework-version {FRAMEWORK_VERSION} --container-type {CONTAINER_TYPE} &>/dev/null"
-        x = threading.Thread(target=lambda: os.system(cmd))
-        x.setDaemon(True)
-        x.start()
+        import subprocess
+
+        # the shell returns right away and leaves the report to a process of its own, which opts
+        # out itself so that its interpreter does not start another report
+        cmd = "OPT_OUT_TRACKING=true python /usr/local/bin/deep_learning_container.py --framework {FRAMEWORK} --framework-version {FRAMEWORK_VERSION} --container-type {CONTAINER_TYPE} >/dev/null 2>&1 &"
+        subprocess.call(cmd, shell=True, stdin=subprocess.DEVNULL)
 except Exception:
     pass
@@ -12,9 +12,11 @@
 # language governing permissions and limitations under the License.
 from __future__ import absolute_import
 
+import io
 import os
 import textwrap
 
+import numpy as np
 import torch, torcheia
 from sagemaker_inference import (
     content_types,
@@ -97,7 +99,7 @@ class DefaultPytorchInferenceHandler(default_inference_handler.DefaultInferenceH
         return output
 
     def default_output_fn(self, prediction, accept):
-        """A default output_fn for PyTorch. Serializes predictions from predict_fn to JSON, CSV or NPY format.
+        """A default output_fn for PyTorch. Serializes predictions from predict_fn to JSON, CSV, NPY or NPZ format.
 
         Args:
             prediction: a prediction result from predict_fn
@@ -105,14 +107,32 @@ class DefaultPytorchInferenceHandler(default_inference_handler.DefaultInferenceH
 
         Returns: output data serialized
         """
+        array = None
         if type(prediction) == torch.Tensor:
-            prediction = prediction.detach().cpu().numpy().tolist()
+            # shares the memory of a cpu tensor
+            array = prediction.detach().cpu().numpy()
 
         for content_type in utils.parse_accept(accept):
+            if content_type in (content_types.NPY, content_types.NPZ):
+                # written straight from the array buffer, without a round trip through lists
+                if array is None:
+                    array = np.asarray(prediction)
+                return _encode_array(array, content_type)
             if content_type in encoder.SUPPORTED_CONTENT_TYPES:
+                if array is not None:
+                    prediction = array.tolist()
                 encoded_prediction = encoder.encode(prediction, content_type)
                 if content_type == content_types.CSV:
                     encoded_prediction = encoded_prediction.encode("utf-8")
                 return encoded_prediction
 
         raise errors.UnsupportedFormatError(accept)
+
+
+def _encode_array(array, content_type):
+    buffer = io.BytesIO()
+    if content_type == content_types.NPY:
+        np.lib.format.write_array(buffer, array, allow_pickle=False)
+    else:
+        np.savez(buffer, array)
+    return buffer.getvalue()
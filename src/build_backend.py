@@ -0,0 +1,275 @@
+"""
+Copyright 2019-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You
+may not use this file except in compliance with the License. A copy of
+the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is
+distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+ANY KIND, either express or implied. See the License for the specific
+language governing permissions and limitations under the License.
+"""
+
+import logging
+import re
+import shutil
+import subprocess
+import threading
+
+import constants
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+DOCKER_BACKEND = "docker"
+BUILDX_BACKEND = "buildx"
+
+# Builder with the docker-container driver, the docker driver can not export a build cache
+BUILDX_BUILDER = "dlc-builder"
+# Builder of the docker daemon, it can use images that only exist in the local daemon
+DEFAULT_BUILDX_BUILDER = "default"
+
+# Lines of the plain progress output of buildx, e.g.
+#   #5 [stage-1 2/3] RUN pip install torch
+#   #5 CACHED
+#   #5 DONE 12.3s
+#   #5 ERROR: process "/bin/sh -c pip install torch" did not complete successfully: exit code: 1
+STEP_PATTERN = re.compile(r"^#(\d+) (\[.*)$")
+CACHED_PATTERN = re.compile(r"^#(\d+) CACHED$")
+DONE_PATTERN = re.compile(r"^#(\d+) DONE ([\d.]+)s$")
+ERROR_PATTERN = re.compile(r"^#(\d+) ERROR: (.*)$")
+
+
+class DockerApiBackend:
+    """
+    Builds images with the classic builder through the low level Docker API client of the image
+    """
+
+    name = DOCKER_BACKEND
+
+    def build(self, image, fileobj, custom_context=False):
+        """
+        :param image: <DockerImage> image to build
+        :param fileobj: readable file object of the context tar, or of the Dockerfile
+        :param custom_context: <bool> fileobj is a context tar
+        :return: iterator of the decoded JSON lines of the build, as returned by APIClient.build
+        """
+        return image.client.build(
+            fileobj=fileobj,
+            path=image.dockerfile,
+            custom_context=custom_context,
+            rm=True,
+            decode=True,
+            tag=image.ecr_url,
+            buildargs=image.build_args,
+            labels=image.labels,
+            target=image.target,
+        )
+
+
+class BuildxProgress:
+    """
+    Steps of a buildx build, parsed from its plain progress output
+    """
+
+    def __init__(self):
+        self.steps = {}
+        self.cached = set()
+        self.durations = {}
+        self.errors = []
+
+    def add(self, line):
+        match = STEP_PATTERN.match(line)
+        if match:
+            self.steps.setdefault(match.group(1), match.group(2))
+            return
+        match = CACHED_PATTERN.match(line)
+        if match:
+            self.cached.add(match.group(1))
+            return
+        match = DONE_PATTERN.match(line)
+        if match:
+            self.durations[match.group(1)] = float(match.group(2))
+            return
+        match = ERROR_PATTERN.match(line)
+        if match:
+            self.errors.append(f"{self.steps.get(match.group(1), '')} {match.group(2)}".strip())
+
+    def stats(self):
+        """
+        :return: <dict> number of Dockerfile steps, cached steps and the slowest steps
+        """
+        steps = [step for step in self.steps if not self.steps[step].startswith("[internal]")]
+        slowest = sorted(
+            (step for step in steps if step in self.durations),
+            key=lambda step: self.durations[step],
+            reverse=True,
+        )[:3]
+        return {
+            "build_steps": len(steps),
+            "cached_steps": len([step for step in steps if step in self.cached]),
+            "slowest_steps": [f"{self.steps[step]} {self.durations[step]}s" for step in slowest],
+        }
+
+
+class BuildxBackend:
+    """
+    Builds images with BuildKit through docker buildx, which runs independent stages in parallel,
+    supports RUN --mount=type=cache and imports and exports the build cache. The cache is a local
+    directory (cache_dir) or a registry reference (cache_ref) with one tag per image.
+    """
+
+    name = BUILDX_BACKEND
+
+    _builder_lock = threading.Lock()
+    _builder_ready = False
+
+    def __init__(self, cache_dir=None, cache_ref=None, builder=BUILDX_BUILDER):
+        """
+        :param cache_dir: <str> directory of a local build cache
+        :param cache_ref: <str> repository URI of a registry build cache
+        :param builder: <str> name of the docker-container builder that exports the cache
+        """
+        self.cache_dir = cache_dir
+        self.cache_ref = cache_ref
+        self.builder = builder
+
+    def _ensure_builder(self):
+        with BuildxBackend._builder_lock:
+            if BuildxBackend._builder_ready:
+                return
+            inspect = subprocess.run(
+                ["docker", "buildx", "inspect", self.builder], capture_output=True
+            )
+            if inspect.returncode != 0:
+                subprocess.run(
+                    [
+                        "docker",
+                        "buildx",
+                        "create",
+                        "--name",
+                        self.builder,
+                        "--driver",
+                        "docker-container",
+                    ],
+                    check=True,
+                    capture_output=True,
+                )
+            BuildxBackend._builder_ready = True
+
+    @staticmethod
+    def uses_local_images(image):
+        """
+        Images built on images of this job need the builder of the docker daemon, the builder of
+        the docker-container driver only sees images in registries
+        """
+        return any(build_arg in image.build_args for build_arg in constants.IMAGE_BUILD_ARGS)
+
+    def cache_options(self, image, export=True):
+        """
+        :param image: <DockerImage>
+        :param export: <bool> add the options that export the cache
+        :return: <list> --cache-from and --cache-to options
+        """
+        options = []
+        if self.cache_dir:
+            cache = f"{self.cache_dir}/{image.name}-{image.stage}"
+            options += ["--cache-from", f"type=local,src={cache}"]
+            if export:
+                options += ["--cache-to", f"type=local,dest={cache},mode=max"]
+        elif self.cache_ref:
+            cache = f"{self.cache_ref}:buildcache-{image.name}-{image.stage}"
+            options += ["--cache-from", f"type=registry,ref={cache}"]
+            if export:
+                options += [
+                    "--cache-to",
+                    f"type=registry,ref={cache},mode=max,image-manifest=true,oci-mediatypes=true",
+                ]
+        return options
+
+    def command(self, image):
+        """
+        :param image: <DockerImage>
+        :return: <list> docker buildx build command that reads the context tar from stdin
+        """
+        local_images = self.uses_local_images(image)
+        command = [
+            "docker",
+            "buildx",
+            "build",
+            "--builder",
+            DEFAULT_BUILDX_BUILDER if local_images else self.builder,
+            "--progress=plain",
+            "--load",
+            "--tag",
+            image.ecr_url,
+        ]
+        for name, value in sorted(image.build_args.items()):
+            command += ["--build-arg", f"{name}={value}"]
+        for name, value in sorted(image.labels.items()):
+            command += ["--label", f"{name}={value}"]
+        if image.target:
+            command += ["--target", image.target]
+        # The builder of the docker daemon can import but not export a cache
+        command += self.cache_options(image, export=not local_images)
+        return command + ["-"]
+
+    def build(self, image, fileobj, custom_context=True):
+        """
+        :param image: <DockerImage> image to build, its summary gets the step counts of the build
+        :param fileobj: readable file object of the context tar, written to the stdin of buildx
+        :param custom_context: <bool> must be True, buildx reads the context tar from stdin
+        :return: iterator of build lines in the format of APIClient.build
+        """
+        if not custom_context:
+            raise ValueError("buildx builds need a context tar, custom_context must be True")
+        command = self.command(image)
+        if self.builder in command:
+            self._ensure_builder()
+        LOGGER.info(f"Running {' '.join(command)}")
+        process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+
+        def write_context():
+            try:
+                shutil.copyfileobj(fileobj, process.stdin)
+            except BrokenPipeError:
+                # buildx exited early, its output has the reason
+                pass
+            finally:
+                process.stdin.close()
+
+        writer = threading.Thread(target=write_context, daemon=True)
+        writer.start()
+
+        progress = BuildxProgress()
+        for raw_line in process.stdout:
+            line = raw_line.decode("utf-8", errors="replace").rstrip("\n")
+            progress.add(line)
+            yield {"stream": f"{line}\n"}
+        returncode = process.wait()
+        writer.join()
+
+        image.summary["build_backend"] = self.name
+        image.summary.update(progress.stats())
+        if returncode != 0:
+            reason = "; ".join(progress.errors) or f"docker buildx build exited with {returncode}"
+            yield {"error": reason}
+
+
+def create_build_backend(name, cache_dir=None, cache_ref=None):
+    """
+    :param name: <str> DOCKER_BACKEND or BUILDX_BACKEND
+    :param cache_dir: <str> directory of a local build cache, buildx only
+    :param cache_ref: <str> repository URI of a registry build cache, buildx only
+    :return: build backend
+    """
+    if name in (None, "", DOCKER_BACKEND):
+        return DockerApiBackend()
+    if name == BUILDX_BACKEND:
+        return BuildxBackend(cache_dir=cache_dir, cache_ref=cache_ref)
+    raise ValueError(f"Unknown build backend {name}, expected {DOCKER_BACKEND} or {BUILDX_BACKEND}")
@@ -0,0 +1,334 @@
+"""
+Copyright 2019-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You
+may not use this file except in compliance with the License. A copy of
+the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is
+distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+ANY KIND, either express or implied. See the License for the specific
+language governing permissions and limitations under the License.
+"""
+
+import concurrent.futures
+import logging
+import time
+import traceback
+
+from datetime import datetime
+
+import constants
+
+from output import OutputFormatter
+
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+FORMATTER = OutputFormatter(constants.PADDING)
+
+# Kinds of tasks, each kind runs in a pool of its own
+BUILD = "build"
+PUSH = "push"
+
+# States of a task
+PENDING = "Pending"
+RUNNING = "Running"
+SUCCEEDED = "Succeeded"
+FAILED = "Failed"
+SKIPPED = "Skipped"
+
+
+class Task:
+    """
+    A unit of work of the DagScheduler, e.g. the build or the push of one image
+    """
+
+    def __init__(self, name, kind, function, dependencies=(), on_failure=None):
+        """
+        :param name: <str> unique name of the task
+        :param kind: <str> BUILD or PUSH, selects the pool the task runs in
+        :param function: callable without arguments, returns a status code of constants
+        :param dependencies: <list> Tasks that have to succeed before this task starts
+        :param on_failure: callable(<str> reason), called when the task raises or is skipped
+        """
+        self.name = name
+        self.kind = kind
+        self.function = function
+        self.dependencies = list(dependencies)
+        self.dependents = []
+        self.on_failure = on_failure
+        self.state = PENDING
+        self.status = None
+        self.reason = None
+        self.ready_time = None
+        self.start_time = None
+        self.end_time = None
+
+    @property
+    def duration(self):
+        if self.start_time is None or self.end_time is None:
+            return 0.0
+        return self.end_time - self.start_time
+
+    @property
+    def queued(self):
+        """
+        Time the task waited for a free worker after its dependencies finished
+        """
+        if self.ready_time is None or self.start_time is None:
+            return 0.0
+        return self.start_time - self.ready_time
+
+
+class DagScheduler:
+    """
+    Runs tasks as soon as all of their dependencies succeeded, instead of in phases that wait for
+    the slowest task of the previous phase. Builds and pushes have separate concurrency limits.
+    A task that fails skips the tasks that depend on it, and only those.
+    """
+
+    def __init__(
+        self, build_workers=10, push_workers=constants.MAX_WORKER_COUNT_FOR_PUSHING_IMAGES
+    ):
+        self.workers = {BUILD: build_workers, PUSH: push_workers}
+        self.tasks = {}
+        self.start_time = None
+        self.end_time = None
+
+    def add_task(self, name, kind, function, dependencies=(), on_failure=None):
+        """
+        Adds a task to the graph. Dependencies have to be added before the tasks depending on them,
+        which keeps the graph acyclic.
+
+        :param name: <str> unique name of the task
+        :param kind: <str> BUILD or PUSH
+        :param function: callable without arguments, returns a status code of constants
+        :param dependencies: <list> Tasks returned by add_task
+        :param on_failure: callable(<str> reason), called when the task raises or is skipped
+        :return: <Task> the task added
+        """
+        if name in self.tasks:
+            raise ValueError(f"Task {name} already exists")
+        if kind not in self.workers:
+            raise ValueError(f"Unknown task kind {kind}, expected one of {list(self.workers)}")
+        for dependency in dependencies:
+            if self.tasks.get(dependency.name) is not dependency:
+                raise ValueError(f"Dependency {dependency.name} of {name} is not a known task")
+        task = Task(name, kind, function, dependencies, on_failure)
+        for dependency in task.dependencies:
+            dependency.dependents.append(task)
+        self.tasks[name] = task
+        return task
+
+    def _execute(self, task):
+        task.start_time = time.time()
+        try:
+            return task.function()
+        finally:
+            task.end_time = time.time()
+
+    def _finish(self, task, future):
+        try:
+            task.status = future.result()
+        except Exception as e:
+            task.status = constants.FAIL
+            task.reason = f"{task.name} raised {type(e).__name__}: {e}"
+            LOGGER.error("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+            # A failed status was already recorded by the task itself, an exception was not
+            if task.on_failure:
+                task.on_failure(task.reason)
+        if task.status == constants.FAIL:
+            task.state = FAILED
+            task.reason = task.reason or f"{task.name} failed"
+        else:
+            task.state = SUCCEEDED
+        FORMATTER.print(f"{task.name}{'.' * 10}{task.state} after {task.duration:.1f}s")
+
+    def _skip(self, task, failed_dependency):
+        task.state = SKIPPED
+        task.reason = f"Skipped because {failed_dependency.name} did not succeed"
+        if task.on_failure:
+            task.on_failure(task.reason)
+        FORMATTER.print(f"{task.name}{'.' * 10}{task.state}")
+        for dependent in task.dependents:
+            if dependent.state == PENDING:
+                self._skip(dependent, task)
+
+    def run(self):
+        """
+        Runs every task and returns once all of them succeeded, failed or were skipped.
+
+        :return: <bool> True if every task succeeded
+        """
+        self.start_time = time.time()
+        executors = {
+            kind: concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+            for kind, workers in self.workers.items()
+        }
+        running = {}
+
+        def submit_ready(tasks):
+            for task in tasks:
+                if task.state != PENDING:
+                    continue
+                if all(dependency.state == SUCCEEDED for dependency in task.dependencies):
+                    task.state = RUNNING
+                    task.ready_time = time.time()
+                    running[executors[task.kind].submit(self._execute, task)] = task
+
+        try:
+            submit_ready(self.tasks.values())
+            while running:
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    task = running.pop(future)
+                    self._finish(task, future)
+                    if task.state == SUCCEEDED:
+                        submit_ready(task.dependents)
+                    else:
+                        for dependent in task.dependents:
+                            if dependent.state == PENDING:
+                                self._skip(dependent, task)
+        finally:
+            for executor in executors.values():
+                executor.shutdown(wait=True)
+        self.end_time = time.time()
+        return all(task.state == SUCCEEDED for task in self.tasks.values())
+
+    def critical_path(self):
+        """
+        The chain of tasks that determined the total run time: the task that finished last, the
+        dependency that finished last before it started, and so on.
+
+        :return: <list> Tasks, first to last
+        """
+        finished = [task for task in self.tasks.values() if task.end_time is not None]
+        if not finished:
+            return []
+        path = [max(finished, key=lambda task: task.end_time)]
+        while True:
+            dependencies = [task for task in path[-1].dependencies if task.end_time is not None]
+            if not dependencies:
+                break
+            path.append(max(dependencies, key=lambda task: task.end_time))
+        return list(reversed(path))
+
+    def report(self):
+        """
+        Prints the timing of every task and the critical path.
+        """
+        if self.start_time is None:
+            return
+        FORMATTER.title("Task Timing")
+        rows = []
+        for task in sorted(
+            self.tasks.values(), key=lambda task: (task.start_time is None, task.start_time or 0)
+        ):
+            if task.start_time is None:
+                rows.append((task.name, task.state))
+                continue
+            rows.append(
+                (
+                    task.name,
+                    f"{task.state}, started at +{task.start_time - self.start_time:.1f}s, "
+                    f"ran {task.duration:.1f}s, waited {task.queued:.1f}s for a {task.kind} worker",
+                )
+            )
+        FORMATTER.table(rows)
+
+        FORMATTER.title("Critical Path")
+        path = self.critical_path()
+        FORMATTER.table(
+            (task.name, f"ran {task.duration:.1f}s, waited {task.queued:.1f}s") for task in path
+        )
+        total = self.end_time - self.start_time
+        busy = sum(task.duration for task in path)
+        FORMATTER.print(
+            f"Total {total:.1f}s, critical path {busy:.1f}s running and "
+            f"{sum(task.queued for task in path):.1f}s waiting for workers"
+        )
+
+
+def _mark_image_failed(image):
+    def on_failure(reason):
+        image.log.append([reason])
+        image.build_status = constants.FAIL
+        image.summary["status"] = constants.STATUS_MESSAGE[image.build_status]
+        image.summary.setdefault("start_time", datetime.now())
+        image.summary["end_time"] = datetime.now()
+
+    return on_failure
+
+
+def schedule_images(scheduler, pre_push_images, before_push=None):
+    """
+    Adds the tasks of a list of pre-push images to a scheduler. Every image gets a chain of
+    pre-push build, common stage build, push and retag. The pre-push build of a child image depends
+    on the pre-push build of the image it uses as base image, if that image is in the list.
+
+    :param scheduler: <DagScheduler>
+    :param pre_push_images: <list> of <DockerImage>, pre-push stage images
+    :param before_push: callable(<DockerImage>), called before an image is pushed
+    :return: <list> of <DockerImage> images that are pushed
+    """
+    build_tasks = {}
+    images_to_push = []
+    # Parents first, so that their build tasks exist when their children are added
+    ordered_images = [image for image in pre_push_images if not image.is_child_image] + [
+        image for image in pre_push_images if image.is_child_image
+    ]
+    for image in ordered_images:
+        dependencies = []
+        if image.is_child_image and image.base_image_uri in build_tasks:
+            dependencies.append(build_tasks[image.base_image_uri])
+        build_task = scheduler.add_task(
+            f"{image.name}-{image.stage}-build",
+            BUILD,
+            image.build,
+            dependencies,
+            on_failure=_mark_image_failed(image),
+        )
+        build_tasks[image.ecr_url] = build_task
+
+        final_image, final_task = image, build_task
+        common_stage_image = image.corresponding_common_stage_image
+        if common_stage_image is not None:
+            final_image = common_stage_image
+            final_task = scheduler.add_task(
+                f"{common_stage_image.name}-{common_stage_image.stage}-build",
+                BUILD,
+                common_stage_image.build,
+                [build_task],
+                on_failure=_mark_image_failed(common_stage_image),
+            )
+
+        if not (final_image.to_push and final_image.to_build):
+            continue
+        images_to_push.append(final_image)
+
+        def push(final_image=final_image):
+            if before_push:
+                before_push(final_image)
+            return final_image.push_image()
+
+        push_task = scheduler.add_task(
+            f"{final_image.name}-{final_image.stage}-push",
+            PUSH,
+            push,
+            [final_task],
+            on_failure=_mark_image_failed(final_image),
+        )
+        scheduler.add_task(
+            f"{final_image.name}-{final_image.stage}-retag",
+            PUSH,
+            final_image.push_image_with_additional_tags,
+            [push_task],
+            on_failure=_mark_image_failed(final_image),
+        )
+    return images_to_push
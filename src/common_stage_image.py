@@ -16,8 +16,11 @@ language governing permissions and limitations under the License.
 from codebuild_environment import get_cloned_folder_path
 from context import Context
 from image import DockerImage
+from image_reuse import get_build_seconds
 from utils import generate_safety_report_for_image
 
+import constants
+import hashlib
 import os
 
 
@@ -38,6 +41,10 @@ class CommonStageImage(DockerImage):
         """
         # Call the update_pre_build_configuration steps from the parent class
         super(CommonStageImage, self).update_pre_build_configuration()
+        # Keep the build time of the pre-push image, a build that reuses this image saves it
+        pre_push_build_seconds = get_build_seconds(self.build_args["PRE_PUSH_IMAGE"])
+        if pre_push_build_seconds is not None:
+            self.labels[constants.BUILD_SECONDS_LABEL] = str(pre_push_build_seconds)
         # Generate safety scan report for the first stage image and add the file to artifacts
         pre_push_stage_image_uri = self.build_args["PRE_PUSH_IMAGE"]
         processed_image_uri = (
@@ -58,6 +65,22 @@ class CommonStageImage(DockerImage):
             storage_file_path, tarfile_name=tarfile_name_for_context
         )
 
+    def input_fingerprint_inputs(self):
+        """
+        The context of a CommonStageImage is created from the safety report of its pre-push image
+        during the build, it is represented by Dockerfile.common and the pre-push image instead.
+        """
+        inputs = super(CommonStageImage, self).input_fingerprint_inputs()
+        with open(self._common_stage_dockerfile(), "rb") as dockerfile:
+            inputs["context"] = hashlib.sha256(dockerfile.read()).hexdigest()
+        return inputs
+
+    @staticmethod
+    def _common_stage_dockerfile():
+        return os.path.join(
+            os.sep, get_cloned_folder_path(), "miscellaneous_dockerfiles", "Dockerfile.common"
+        )
+
     def generate_common_stage_context(self, safety_report_path, tarfile_name="common-stage-file"):
         """
         For CommonStageImage, build context is built once the safety report is generated. This is because
@@ -65,18 +88,10 @@ class CommonStageImage(DockerImage):
         """
         artifacts = {
             "safety_report": {"source": safety_report_path, "target": "safety_report.json"},
-            "dockerfile": {
-                "source": os.path.join(
-                    os.sep,
-                    get_cloned_folder_path(),
-                    "miscellaneous_dockerfiles",
-                    "Dockerfile.common",
-                ),
-                "target": "Dockerfile",
-            },
+            "dockerfile": {"source": self._common_stage_dockerfile(), "target": "Dockerfile"},
         }
 
         artifact_root = os.path.join(os.sep, get_cloned_folder_path(), "src")
         return Context(
-            artifacts, context_path=f"build/{tarfile_name}.tar.gz", artifact_root=artifact_root
+            artifacts, context_path=f"build/{tarfile_name}.tar", artifact_root=artifact_root
         )
@@ -52,6 +52,14 @@ def is_build_enabled():
     return parse_dlc_developer_configs("build", "do_build")
 
 
+def is_image_reuse_enabled():
+    return parse_dlc_developer_configs("build", "reuse_unchanged_images")
+
+
+def get_build_backend():
+    return parse_dlc_developer_configs("build", "build_backend")
+
+
 def is_autopatch_build_enabled(buildspec_path=None):
     from buildspec import Buildspec
 
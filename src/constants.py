@@ -100,6 +100,13 @@ ALL_TESTS = ["sagemaker", "ec2", "eks", "ecs"]
 API_CLIENT_TIMEOUT = 600
 MAX_WORKER_COUNT_FOR_PUSHING_IMAGES = 3
 
+# Labels and tag prefix used to find images that were built from identical inputs
+INPUT_FINGERPRINT_LABEL = "com.amazonaws.ml.dlc.input-fingerprint"
+BUILD_SECONDS_LABEL = "com.amazonaws.ml.dlc.build-seconds"
+INPUT_FINGERPRINT_TAG_PREFIX = "input-"
+# Build args that name images built in the same job
+IMAGE_BUILD_ARGS = ("BASE_IMAGE", "PRE_PUSH_IMAGE")
+
 PATCHING_INFO_PATH_WITHIN_DLC = "/opt/aws/dlc/patching-info"
 
 ## TODO: Make this account specific: pr-creation-data-helper-<12_digit_account_id>
@@ -13,8 +13,116 @@ ANY KIND, either express or implied. See the License for the specific
 language governing permissions and limitations under the License.
 """
 
+import gzip
+import hashlib
+import io
 import os
+import stat
 import tarfile
+import threading
+import time
+
+# Every entry of a context gets the same mtime and owner, so that the same artifacts always
+# produce the same tar and the same digest
+CONTEXT_MTIME = 0
+
+# Memory all context tars of a run may take together. Every image's context is created up
+# front and kept until the image is built, a context that does not fit into what is left of the
+# budget is written to its context_path
+MAX_IN_MEMORY_CONTEXT_BYTES = 512 * 1024 * 1024
+
+# Compression levels of the optional compressions, the daemon decompresses them again
+COMPRESSION_LEVELS = {"gz": 1}
+
+# Contexts of this run by their manifest, identical artifact sets share one tar
+_CONTEXTS = {}
+_CONTEXTS_LOCK = threading.Lock()
+# Bytes of the context tars of this run that are held in memory
+_in_memory_bytes = 0
+_MEMORY_LOCK = threading.Lock()
+
+
+def _reserve_memory(size):
+    """
+    Takes size bytes of the in-memory budget, False if they do not fit
+    """
+    global _in_memory_bytes
+    with _MEMORY_LOCK:
+        if _in_memory_bytes + size > MAX_IN_MEMORY_CONTEXT_BYTES:
+            return False
+        _in_memory_bytes += size
+        return True
+
+
+def _free_memory(size):
+    global _in_memory_bytes
+    with _MEMORY_LOCK:
+        _in_memory_bytes -= size
+
+
+class _ContextWriter:
+    """
+    File-like sink of the tar, it hashes and counts what is written and moves the data from
+    memory to spill_path once it does not fit into the in-memory budget of the run
+    """
+
+    def __init__(self, spill_path):
+        self.spill_path = spill_path
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.buffer = io.BytesIO()
+        self.file = None
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        if self.file is None and not _reserve_memory(len(data)):
+            self.file = open(self.spill_path, "wb")
+            self.file.write(self.buffer.getbuffer())
+            _free_memory(self.buffer.tell())
+            self.buffer = None
+        if self.file is not None:
+            self.file.write(data)
+        else:
+            self.buffer.write(data)
+        return len(data)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+    def discard(self):
+        """
+        Returns the memory of a tar that was not built completely to the budget
+        """
+        if self.buffer is not None:
+            _free_memory(self.buffer.tell())
+            self.buffer = None
+
+
+class _ContextTar:
+    """
+    A tar built by one or more Contexts with identical artifacts
+    """
+
+    def __init__(self, digest, size, data=None, path=None):
+        self.digest = digest
+        self.size = size
+        self.data = data
+        self.path = path
+        self.references = 0
+
+    def open(self):
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        return open(self.path, "rb")
+
+    def release(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+        if self.data is not None:
+            _free_memory(len(self.data))
+        self.data = None
 
 
 class Context:
@@ -23,55 +131,175 @@ class Context:
     preparing, managing and removing the docker build context
     """
 
-    def __init__(self, artifacts=None, context_path="context.tar.gz", artifact_root="./"):
+    def __init__(
+        self, artifacts=None, context_path="context.tar.gz", artifact_root="./", compression=None
+    ):
         """
         The constructor for the Context class
 
         Parameters:
             artifacts: array of (source, destination) tuples
-            context_path: path for the resulting tar.gz file
+            context_path: path the context is written to if it is too large to be kept in memory
             artifact_root: root directory for all artifacts
+            compression: None for an uncompressed tar, "gz" for a fast gzip compression
 
         Returns:
             None
 
         """
+        if compression is not None and compression not in COMPRESSION_LEVELS:
+            raise ValueError(
+                f"Unknown compression {compression}, expected one of {list(COMPRESSION_LEVELS)}"
+            )
         self.artifacts = {}
         self.context_path = context_path
         self.artifact_root = artifact_root
+        self.compression = compression
+        self.stats = {}
+        self._tar = None
+        self._manifest = None
 
         # Check if the context path is just a filename,
         # or includes a directory. If path includes a
         # directory, create directory if it does not exist
         directory = os.path.dirname(context_path)
         if directory != "" and not os.path.isdir(directory):
-            os.mkdir(directory)
+            os.makedirs(directory, exist_ok=True)
 
         if artifacts is not None:
             self.add(artifacts)
 
+    @property
+    def digest(self):
+        """
+        sha256 of the context tar, identical artifacts have identical digests
+        """
+        return self._tar.digest if self._tar else None
+
+    def _entries(self):
+        """
+        Returns the sorted (arcname, path, lstat) of every file, directory and link in the context
+        """
+        entries = {}
+        for artifact in self.artifacts.values():
+            if "source" not in artifact or "target" not in artifact:
+                continue
+            source = os.path.join(self.artifact_root, artifact["source"])
+            target = os.path.normpath(artifact["target"])
+            entries[target] = (source, os.lstat(source))
+            if not stat.S_ISDIR(entries[target][1].st_mode):
+                continue
+            for root, dirs, files in os.walk(source):
+                for name in dirs + files:
+                    path = os.path.join(root, name)
+                    arcname = os.path.join(target, os.path.relpath(path, source))
+                    entries[arcname] = (path, os.lstat(path))
+        return [(arcname, path, st) for arcname, (path, st) in sorted(entries.items())]
+
+    def _write_tar(self, entries, fileobj):
+        with tarfile.open(fileobj=fileobj, mode="w|") as tar:
+            for arcname, path, _ in entries:
+                info = tar.gettarinfo(path, arcname=arcname)
+                info.mtime = CONTEXT_MTIME
+                info.uid = info.gid = 0
+                info.uname = info.gname = ""
+                if info.isreg():
+                    with open(path, "rb") as f:
+                        tar.addfile(info, f)
+                else:
+                    tar.addfile(info)
+
+    def _build(self, entries):
+        writer = _ContextWriter(self.context_path)
+        try:
+            if self.compression == "gz":
+                with gzip.GzipFile(
+                    filename="",
+                    fileobj=writer,
+                    mode="wb",
+                    compresslevel=COMPRESSION_LEVELS["gz"],
+                    mtime=CONTEXT_MTIME,
+                ) as compressed:
+                    self._write_tar(entries, compressed)
+            else:
+                self._write_tar(entries, writer)
+        except BaseException:
+            writer.discard()
+            raise
+        finally:
+            writer.close()
+        if writer.file is not None:
+            return _ContextTar(writer.sha256.hexdigest(), writer.size, path=self.context_path)
+        return _ContextTar(writer.sha256.hexdigest(), writer.size, data=writer.buffer.getvalue())
+
     def add(self, artifacts):
         """
-        Adds artifacts to the build context
+        Adds artifacts to the build context. The tar is written once per set of artifacts in a
+        run, a context with the same artifacts as an earlier one reuses its tar.
+
         Parameters:
             artifacts: array of (source, destination) tuples
         """
         self.artifacts.update(artifacts)
 
         # TODO: Use glob to expand
-        # TODO: Add logic to untar and retar
-        with tarfile.open(self.context_path, "w:gz") as tar:
-            for artifact_name in artifacts:
-                artifact = artifacts[artifact_name]
-                if "source" not in artifact or "target" not in artifact:
-                    continue
-                source = os.path.join(self.artifact_root, artifact["source"])
-                target = artifact["target"]
-                tar.add(source, arcname=target)
+        start = time.time()
+        entries = self._entries()
+        manifest = (self.compression,) + tuple(
+            (arcname, os.path.abspath(path), st.st_mode, st.st_size, st.st_mtime_ns)
+            for arcname, path, st in entries
+        )
+        with _CONTEXTS_LOCK:
+            context_tar = _CONTEXTS.get(manifest)
+            reused = context_tar is not None
+            if reused:
+                context_tar.references += 1
+        if not reused:
+            # Built outside of the lock, contexts of different images are built concurrently
+            built = self._build(entries)
+            with _CONTEXTS_LOCK:
+                context_tar = _CONTEXTS.setdefault(manifest, built)
+                context_tar.references += 1
+            if context_tar is not built:
+                if built.path == context_tar.path:
+                    # Both were written to the same file, it holds the shared tar
+                    built.path = None
+                built.release()
+        self._release()
+        self._tar, self._manifest = context_tar, manifest
+
+        self.stats = {
+            "context_digest": context_tar.digest,
+            "context_size": context_tar.size,
+            "context_build_time": round(time.time() - start, 3),
+            "context_reused": reused,
+        }
+
+    def open(self):
+        """
+        Opens the context tar for reading, the data is read from memory unless the tar did not
+        fit into MAX_IN_MEMORY_CONTEXT_BYTES
+
+        Returns:
+            binary file object
+        """
+        if self._tar is None:
+            raise ValueError(f"Context {self.context_path} has no artifacts")
+        return self._tar.open()
+
+    def _release(self):
+        if self._tar is None:
+            return
+        with _CONTEXTS_LOCK:
+            self._tar.references -= 1
+            if self._tar.references == 0:
+                _CONTEXTS.pop(self._manifest, None)
+                self._tar.release()
+        self._tar = self._manifest = None
 
     def remove(self):
         """
-        Removes the context tar file
+        Releases the context tar, it is removed once no other context uses it
 
         Parameters:
             None
@@ -79,4 +307,4 @@ class Context:
         Returns:
             None
         """
-        os.remove(self.context_path)
+        self._release()
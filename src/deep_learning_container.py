@@ -23,6 +23,8 @@ import botocore.session
 import requests
 
 TIMEOUT_SECS = 5
+# instance id and region of the instance, valid as long as the host boot id in it matches
+INSTANCE_METADATA_CACHE = os.path.join(os.sep, "tmp", ".dlc-instance-metadata.json")
 REGION_MAPPING = {
     "ap-northeast-1": "ddce303c",
     "ap-northeast-2": "528c8d92",
@@ -192,6 +194,46 @@ def _retrieve_instance_region(token=None):
     return region
 
 
+def _retrieve_boot_id():
+    try:
+        with open("/proc/sys/kernel/random/boot_id", "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _read_instance_metadata_cache():
+    """
+    Return the cached (instance_id, region), (None, None) if there is no cache for this boot
+    """
+    try:
+        with open(INSTANCE_METADATA_CACHE, "r") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None, None
+
+    boot_id = _retrieve_boot_id()
+    if not boot_id or cache.get("boot_id") != boot_id:
+        return None, None
+    return cache.get("instance_id"), cache.get("region")
+
+
+def _write_instance_metadata_cache(instance_id, region):
+    """
+    Cache instance_id and region so that later runs skip the instance metadata service
+    """
+    boot_id = _retrieve_boot_id()
+    if not boot_id:
+        return
+    tmp_path = f"{INSTANCE_METADATA_CACHE}.{os.getpid()}"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump({"boot_id": boot_id, "instance_id": instance_id, "region": region}, f)
+        os.replace(tmp_path, INSTANCE_METADATA_CACHE)
+    except OSError as e:
+        logging.error(f"Failed to cache instance metadata: {e}")
+
+
 def _retrieve_device():
     return (
         "gpu"
@@ -364,15 +406,17 @@ def main():
     logging.basicConfig(level=logging.ERROR)
 
     token = None
-    instance_id = None
-    region = None
-    token = get_imdsv2_token()
-    if token:
-        instance_id = _retrieve_instance_id(token)
-        region = _retrieve_instance_region(token)
-    else:
-        instance_id = _retrieve_instance_id()
-        region = _retrieve_instance_region()
+    instance_id, region = _read_instance_metadata_cache()
+    if not instance_id or not region:
+        token = get_imdsv2_token()
+        if token:
+            instance_id = _retrieve_instance_id(token)
+            region = _retrieve_instance_region(token)
+        else:
+            instance_id = _retrieve_instance_id()
+            region = _retrieve_instance_region()
+        if instance_id and region:
+            _write_instance_metadata_cache(instance_id, region)
 
     bucket_process = multiprocessing.Process(target=query_bucket, args=(instance_id, region))
     tag_process = multiprocessing.Process(target=tag_instance, args=(instance_id, region))
@@ -18,9 +18,14 @@ from datetime import datetime
 from docker import APIClient
 from docker import DockerClient
 
+from build_backend import DockerApiBackend
+
 import constants
+import image_reuse
 import logging
 import json
+import os
+import time
 
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.INFO)
@@ -43,6 +48,7 @@ class DockerImage:
         to_push=True,
         additional_tags=[],
         target=None,
+        client=None,
     ):
         # Meta-data about the image should go to info.
         # All keys in info are accessible as attributes
@@ -70,10 +76,20 @@ class DockerImage:
 
         self.to_build = to_build
         self.build_status = None
-        self.client = APIClient(base_url=constants.DOCKER_URL, timeout=constants.API_CLIENT_TIMEOUT)
+        # Low level Docker API client, a client of the Docker daemon at constants.DOCKER_URL if None
+        self.client = client or APIClient(
+            base_url=constants.DOCKER_URL, timeout=constants.API_CLIENT_TIMEOUT
+        )
         self.log = []
         self._corresponding_common_stage_image = None
         self.target = target
+        # Images built from the same inputs are reused instead of rebuilt if enabled. registry is
+        # an optional client with find and add_tags methods, e.g. image_reuse.EcrImageRegistry
+        self.reuse_existing_images = False
+        self.registry = None
+        # Backend with a build(image, fileobj, custom_context) method, e.g.
+        # build_backend.BuildxBackend, the Docker API client of the image builds it by default
+        self.build_backend = DockerApiBackend()
 
     def __getattr__(self, name):
         return self.info[name]
@@ -170,13 +186,30 @@ class DockerImage:
             self.summary["status"] = constants.STATUS_MESSAGE[self.build_status]
             return self.build_status
 
-        # Conduct some preprocessing before building the image
-        self.update_pre_build_configuration()
+        fingerprint = self.input_fingerprint()
+        image_reuse.record_fingerprint(self.ecr_url, fingerprint)
+        self.summary["input_fingerprint"] = fingerprint
+        if self.to_push and self.reuse_existing_images:
+            # Lets later builds find the pushed image by its fingerprint
+            self.additional_tags = [image_reuse.fingerprint_tag(fingerprint)] + self.additional_tags
+
+        if self.reuse_existing_images and self.reuse_existing_image(fingerprint):
+            if self.context:
+                self.context.remove()
+        else:
+            # Conduct some preprocessing before building the image
+            self.update_pre_build_configuration()
+            self.labels[constants.INPUT_FINGERPRINT_LABEL] = fingerprint
+
+            # Record how long packaging the context took and how large it is
+            self.summary.update(self.context.stats)
 
-        # Start building the image
-        with open(self.context.context_path, "rb") as context_file:
-            self.docker_build(fileobj=context_file, custom_context=True)
-            self.context.remove()
+            # Start building the image, the context is streamed to the daemon from memory
+            build_start = time.time()
+            with self.context.open() as context_file:
+                self.docker_build(fileobj=context_file, custom_context=True)
+                self.context.remove()
+            image_reuse.record_build_seconds(self.ecr_url, round(time.time() - build_start))
 
         if self.build_status != constants.SUCCESS:
             LOGGER.info(f"Exiting with image build status {self.build_status} without image check.")
@@ -193,9 +226,118 @@ class DockerImage:
         # This return is necessary. Otherwise FORMATTER fails while displaying the status.
         return self.build_status
 
+    def _fingerprint_build_args(self):
+        build_args = dict(self.info.get("extra_build_args") or {})
+        if self.info.get("base_image_uri"):
+            build_args["BASE_IMAGE"] = self.info["base_image_uri"]
+        return build_args
+
+    def base_image_digests(self):
+        """
+        Resolves the images the Dockerfile is built FROM to their digest in the registry. Images
+        built in this job are left out, they are represented by their own fingerprint.
+
+        :return: dict, digest by image, None for images that could not be resolved
+        """
+        if not os.path.isfile(self.dockerfile):
+            return {}
+        with open(self.dockerfile, encoding="utf-8") as dockerfile:
+            images = image_reuse.base_images(dockerfile.read(), self._fingerprint_build_args())
+        return {
+            image: image_reuse.resolve_digest(self.client, image)
+            for image in images
+            if image_reuse.get_fingerprint(image) is None
+        }
+
+    def input_fingerprint_inputs(self):
+        """
+        Returns the inputs that determine the content of the image. Images built in this job that
+        are passed as build args are represented by their own fingerprint, not by their tag.
+        Images that may be reused also depend on the digests of their external base images, so
+        that a base image republished under the same tag is not hidden by a reused image.
+
+        :return: dict, JSON serializable inputs
+        """
+        build_args = self._fingerprint_build_args()
+        for build_arg in constants.IMAGE_BUILD_ARGS:
+            if build_arg in build_args:
+                build_args[build_arg] = (
+                    image_reuse.get_fingerprint(build_args[build_arg]) or build_args[build_arg]
+                )
+        inputs = {
+            "context": self.context.digest if self.context else None,
+            "build_args": build_args,
+            "labels": self.info.get("labels") or {},
+            "target": self.target,
+        }
+        if self.reuse_existing_images:
+            inputs["base_images"] = self.base_image_digests()
+        return inputs
+
+    def input_fingerprint(self):
+        """
+        :return: str, fingerprint of the inputs of the image
+        """
+        return image_reuse.compute_fingerprint(self.input_fingerprint_inputs())
+
+    def reuse_existing_image(self, fingerprint):
+        """
+        Looks for an image built from the same inputs, in the local daemon first and then in the
+        registry, and tags it as this image instead of building it.
+
+        :param fingerprint: str, input fingerprint of this image
+        :return: bool, True if an image was reused
+        """
+        unresolved = [image for image, digest in self.base_image_digests().items() if not digest]
+        if unresolved:
+            LOGGER.info(f"Building {self.ecr_url}, the digests of {unresolved} are unknown")
+            return False
+
+        start = time.time()
+        images = self.client.images(
+            filters={"label": f"{constants.INPUT_FINGERPRINT_LABEL}={fingerprint}"}
+        )
+        source = images[0]["Id"] if images else None
+
+        if source is None and self.registry is not None:
+            fingerprints = [fingerprint]
+            if self.corresponding_common_stage_image is not None:
+                # Only the common stage image of this image is pushed, it contains this image
+                fingerprints.append(self.corresponding_common_stage_image.input_fingerprint())
+            for candidate in fingerprints:
+                source = self.registry.find(self.repository, image_reuse.fingerprint_tag(candidate))
+                if source is not None:
+                    break
+            if source is not None:
+                for line in self.client.pull(source, stream=True, decode=True):
+                    if line.get("error") is not None:
+                        LOGGER.warning(f"Could not pull {source}, building instead: {line}")
+                        return False
+
+        if source is None:
+            return False
+        if not self.client.tag(source, self.repository, self.tag):
+            LOGGER.warning(f"Could not tag {source} as {self.ecr_url}, building instead")
+            return False
+
+        # Pushed common stage images carry the build time of their pre-push image
+        labels = self.client.inspect_image(source)["Config"].get("Labels") or {}
+        build_seconds = labels.get(constants.BUILD_SECONDS_LABEL)
+        if build_seconds is not None and self.stage == constants.PRE_PUSH_STAGE:
+            build_seconds = int(build_seconds)
+            image_reuse.record_build_seconds(self.ecr_url, build_seconds)
+            self.summary["build_time_saved"] = build_seconds
+        self.summary["reused_image"] = source
+        self.summary["reuse_time"] = round(time.time() - start, 3)
+        self.log.append([f"Reused {source} built from the same inputs as {self.ecr_url}"])
+        LOGGER.info(f"Reused {source} built from the same inputs as {self.ecr_url}")
+        self.build_status = constants.SUCCESS
+        return True
+
     def docker_build(self, fileobj=None, custom_context=False):
         """
-        Uses low level Docker API Client to actually start the process of building the image.
+        Starts the process of building the image with the build backend of the image, the low
+        level Docker API Client unless another backend is set.
 
         :param fileobj: FileObject, a readable file-like object pointing to the context tarfile.
         :param custom_context: bool
@@ -206,17 +348,8 @@ class DockerImage:
 
         line_counter = 0
         line_interval = 50
-        for line in self.client.build(
-            fileobj=fileobj,
-            path=self.dockerfile,
-            custom_context=custom_context,
-            rm=True,
-            decode=True,
-            tag=self.ecr_url,
-            buildargs=self.build_args,
-            labels=self.labels,
-            target=self.target,
-        ):
+        build_lines = self.build_backend.build(self, fileobj, custom_context=custom_context)
+        for line in build_lines:
             # print the log line during build for every line_interval lines for debugging
             if line_counter % line_interval == 0:
                 LOGGER.debug(line)
@@ -331,7 +464,13 @@ class DockerImage:
         :return: int, states if the Push was successful or not
         """
         self.log.append([f"Started Tagging for {self.ecr_url}"])
-        for additional_tag in self.additional_tags:
+        start = time.time()
+        additional_tags = self.additional_tags
+        if self.registry is not None and additional_tags:
+            # Tags left over by the registry are pushed through docker
+            additional_tags = self.tag_in_registry(additional_tags)
+
+        for additional_tag in additional_tags:
             response = [f"Tagging {self.ecr_url} as {self.repository}:{additional_tag}"]
             tagging_successful = self.client.tag(self.ecr_url, self.repository, additional_tag)
             if not tagging_successful:
@@ -353,7 +492,35 @@ class DockerImage:
 
         self.summary["status"] = constants.STATUS_MESSAGE[self.build_status]
         self.summary["end_time"] = datetime.now()
+        self.summary["retag_time"] = round(time.time() - start, 3)
         self.log.append([f"Completed Tagging for {self.ecr_url}"])
+        LOGGER.info(
+            f"Retagged {self.ecr_url} with {len(self.additional_tags)} tags in "
+            f"{self.summary['retag_time']}s, {len(additional_tags)} of them pushed through docker"
+        )
 
         LOGGER.info(f"DOCKER TAG and PUSH LOGS: \n {self.get_tail_logs_in_pretty_format(5)}")
         return self.build_status
+
+    def tag_in_registry(self, additional_tags):
+        """
+        Attaches additional tags to the pushed image by copying its manifest in the registry,
+        without pushing the image again.
+
+        :param additional_tags: list[str], tags to attach
+        :return: list[str], tags that could not be attached
+        """
+        try:
+            failed_tags = self.registry.add_tags(self.repository, self.tag, additional_tags)
+        except Exception as e:
+            LOGGER.warning(f"Could not tag {self.ecr_url} in the registry: {e}")
+            return list(additional_tags)
+
+        response = []
+        for additional_tag in additional_tags:
+            if additional_tag in failed_tags:
+                continue
+            response.append(f"Tagged {self.ecr_url} as {self.repository}:{additional_tag}")
+            self.summary.setdefault("pushed_uris", []).append(f"{self.repository}:{additional_tag}")
+        self.log.append(response)
+        return list(failed_tags)
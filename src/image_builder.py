@@ -13,7 +13,6 @@ ANY KIND, either express or implied. See the License for the specific
 language governing permissions and limitations under the License.
 """
 
-import concurrent.futures
 import datetime
 import os
 import re
@@ -27,12 +26,20 @@ import itertools
 import patch_helper
 
 from codebuild_environment import get_codebuild_project_name, get_cloned_folder_path
-from config import is_build_enabled, is_autopatch_build_enabled
+from config import (
+    is_build_enabled,
+    is_autopatch_build_enabled,
+    is_image_reuse_enabled,
+    get_build_backend,
+)
 from context import Context
 from metrics import Metrics
 from image import DockerImage
+from image_reuse import EcrImageRegistry
 from common_stage_image import CommonStageImage
 from buildspec import Buildspec
+from build_scheduler import DagScheduler, schedule_images
+from build_backend import create_build_backend
 from output import OutputFormatter
 from utils import get_dummy_boto_client
 
@@ -291,7 +298,7 @@ def image_builder(buildspec, image_types=[], device_types=[]):
             }
         )
 
-        context = Context(ARTIFACTS, f"build/{image_name}.tar.gz", image_config["root"])
+        context = Context(ARTIFACTS, f"build/{image_name}.tar", image_config["root"])
 
         if "labels" in image_config:
             labels.update(image_config.get("labels"))
@@ -379,6 +386,19 @@ def image_builder(buildspec, image_types=[], device_types=[]):
             additional_tags=additional_image_tags,
             target=target,
         )
+        # The image config takes precedence over the buildspec and dlc_developer_config.toml. With
+        # buildx the layer cache is kept in BUILDX_CACHE_DIR if set, else in the image repository
+        # of PR builds. Other builds push to release repositories, which must not get cache tags
+        backend_name = (
+            image_config.get("build_backend")
+            or BUILDSPEC.get("build_backend")
+            or get_build_backend()
+        )
+        pre_push_stage_image_object.build_backend = create_build_backend(
+            backend_name,
+            cache_dir=os.getenv("BUILDX_CACHE_DIR"),
+            cache_ref=image_repo_uri if build_context == "PR" else None,
+        )
 
         ##### Create Common stage docker object #####
         # If for a pre_push stage image we create a common stage image, then we do not push the pre_push stage image
@@ -401,16 +421,23 @@ def image_builder(buildspec, image_types=[], device_types=[]):
 
     FORMATTER.banner("DLC")
 
-    # Parent images do not inherit from any containers built in this job
-    # Child images use one of the parent images as their base image
-    parent_images = [image for image in PRE_PUSH_STAGE_IMAGES if not image.is_child_image]
-    child_images = [image for image in PRE_PUSH_STAGE_IMAGES if image.is_child_image]
     ALL_IMAGES = PRE_PUSH_STAGE_IMAGES + COMMON_STAGE_IMAGES
     IMAGES_TO_PUSH = [image for image in ALL_IMAGES if image.to_push and image.to_build]
 
-    pushed_images = []
-    pushed_images += process_images(parent_images, "Parent/Independent", buildspec_path=buildspec)
-    pushed_images += process_images(child_images, "Child/Dependent", buildspec_path=buildspec)
+    # Additional tags are attached in the registry, without pushing the image once per tag.
+    # Images of a PR whose inputs did not change since an earlier build are retagged, releases
+    # and autopatch builds always rebuild to pick up updated packages
+    registry = EcrImageRegistry(BUILDSPEC["region"])
+    reuse_existing_images = (
+        build_context == "PR"
+        and is_image_reuse_enabled()
+        and not is_autopatch_build_enabled(buildspec_path=buildspec)
+    )
+    for image in ALL_IMAGES:
+        image.registry = registry
+        image.reuse_existing_images = reuse_existing_images
+
+    pushed_images = process_images(PRE_PUSH_STAGE_IMAGES, buildspec_path=buildspec)
 
     assert all(
         image in pushed_images for image in IMAGES_TO_PUSH
@@ -420,6 +447,8 @@ def image_builder(buildspec, image_types=[], device_types=[]):
     FORMATTER.banner("Summary")
     show_build_info(ALL_IMAGES)
 
+    show_reuse_info(ALL_IMAGES)
+
     FORMATTER.banner("Errors")
     is_any_build_failed, is_any_build_failed_size_limit = show_build_errors(ALL_IMAGES)
 
@@ -448,45 +477,38 @@ def image_builder(buildspec, image_types=[], device_types=[]):
         )
 
 
-def process_images(pre_push_image_list, pre_push_image_type="Pre-push", buildspec_path=""):
+def process_images(pre_push_image_list, buildspec_path=""):
     """
-    Handles all the tasks related to a particular type of Pre Push images. It takes in the list of
-    pre push images and then builds it. After the pre-push images have been built, it extracts the
-    corresponding common stage images for the pre-push images and builds those common stage images.
-    After the common stage images have been built, it finds outs the docker images that need to be
-    pushed and pushes them accordingly.
+    Handles all the tasks related to the Pre Push images. Every pre-push image has a chain of
+    tasks: its build, the build of its common stage image, the push and the retagging of the image
+    that is pushed. Each task starts as soon as the tasks it depends on have succeeded, rather than
+    waiting for the same step of every other image, so a slow build only delays its own chain.
 
-    Note that the common stage images should always be built after the pre-push images of a
-    particular kind. This is because the Common stage images use are built on respective
-    Standard and Example images.
+    Note that the common stage images are always built after their pre-push images, because they
+    are built on them. Child images are built after the pre-push image they use as base image.
+    A failure skips the tasks that depend on the failed task and leaves every other chain running.
 
     :param pre_push_image_list: list[DockerImage], list of pre-push images
-    :param pre_push_image_type: str, used to display the message on the logs
+    :param buildspec_path: str, path of the buildspec, used to check if autopatch is enabled
     :return: list[DockerImage], images that were supposed to be pushed.
     """
-    FORMATTER.banner(f"{pre_push_image_type} Build")
-    build_images(pre_push_image_list)
-
-    FORMATTER.banner(f"{pre_push_image_type} Common Build")
-    common_stage_image_list = [
-        image.corresponding_common_stage_image
-        for image in pre_push_image_list
-        if image.corresponding_common_stage_image is not None
-    ]
-    build_images(common_stage_image_list, make_dummy_boto_client=True)
-
-    FORMATTER.banner(f"{pre_push_image_type} Push Images")
-    all_images = pre_push_image_list + common_stage_image_list
-    images_to_push = [image for image in all_images if image.to_push and image.to_build]
-
-    if is_autopatch_build_enabled(buildspec_path=buildspec_path):
-        for image in images_to_push:
+    FORMATTER.banner("Build and Push")
+    upload_autopatch_history = is_autopatch_build_enabled(buildspec_path=buildspec_path)
+
+    def before_push(image):
+        if upload_autopatch_history:
             patch_helper.retrive_autopatched_image_history_and_upload_to_s3(image_uri=image.ecr_url)
 
-    push_images(images_to_push)
+    scheduler = DagScheduler(
+        build_workers=10, push_workers=constants.MAX_WORKER_COUNT_FOR_PUSHING_IMAGES
+    )
+    images_to_push = schedule_images(scheduler, pre_push_image_list, before_push=before_push)
 
-    FORMATTER.banner(f"{pre_push_image_type} Retagging")
-    retag_and_push_images(images_to_push)
+    #### TODO: Remove this entire if block when get_dummy_boto_client is removed ####
+    if any(image.corresponding_common_stage_image for image in pre_push_image_list):
+        get_dummy_boto_client()
+    scheduler.run()
+    scheduler.report()
     return images_to_push
 
 
@@ -514,6 +536,7 @@ def generate_common_stage_image_object(pre_push_stage_image_object, image_tag):
         stage=constants.COMMON_STAGE,
         additional_tags=pre_push_stage_image_object.additional_tags,
     )
+    common_stage_image_object.build_backend = pre_push_stage_image_object.build_backend
     pre_push_stage_image_object.to_push = False
     pre_push_stage_image_object.corresponding_common_stage_image = common_stage_image_object
     return common_stage_image_object
@@ -544,6 +567,32 @@ def show_build_info(images):
         FORMATTER.print_lines(image.log[-1][-2:])
 
 
+def show_reuse_info(images):
+    """
+    Displays the images that were reused instead of built, and the build time that saved.
+
+    :param images: list[DockerImage]
+    """
+    reused_images = [image for image in images if image.summary.get("reused_image")]
+    if not reused_images:
+        return
+    FORMATTER.title("Reused Images")
+    rows = []
+    saved_seconds = 0
+    for image in reused_images:
+        build_time_saved = image.summary.get("build_time_saved")
+        saved_seconds += build_time_saved or 0
+        saved = f"{build_time_saved}s" if build_time_saved is not None else "unknown"
+        rows.append(
+            (f"{image.name}-{image.stage}", f"{image.summary['reused_image']}, saved {saved}")
+        )
+    FORMATTER.table(rows)
+    FORMATTER.print(
+        f"Reused {len(reused_images)} of {len(images)} images, saving at least {saved_seconds}s "
+        f"of build time"
+    )
+
+
 def show_build_errors(images):
     """
     Iterates through each image to check if there is any image that has a failed status. In case
@@ -601,58 +650,6 @@ def upload_metrics(images, BUILDSPEC, is_any_build_failed, is_any_build_failed_s
     FORMATTER.print("Metrics Uploaded")
 
 
-def build_images(images, make_dummy_boto_client=False):
-    """
-    Takes a list of images and executes their build process concurrently.
-
-    :param images: list[DockerImage]
-    :param make_dummy_boto_client: bool, specifies if a dummy client should be declared or not.
-
-    TODO: The parameter make_dummy_boto_client should be removed when get_dummy_boto_client method is removed.
-    """
-    THREADS = {}
-    # In the context of the ThreadPoolExecutor each instance of image.build submitted
-    # to it is executed concurrently in a separate thread.
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        #### TODO: Remove this entire if block when get_dummy_boto_client is removed ####
-        if make_dummy_boto_client:
-            get_dummy_boto_client()
-        for image in images:
-            THREADS[image.name] = executor.submit(image.build)
-    # the FORMATTER.progress(THREADS) function call also waits until all threads have completed
-    FORMATTER.progress(THREADS)
-
-
-def push_images(images):
-    """
-    Takes a list of images and PUSHES them to ECR concurrently.
-
-    :param images: list[DockerImage]
-    """
-    THREADS = {}
-    with concurrent.futures.ThreadPoolExecutor(
-        max_workers=constants.MAX_WORKER_COUNT_FOR_PUSHING_IMAGES
-    ) as executor:
-        for image in images:
-            THREADS[image.name] = executor.submit(image.push_image)
-    FORMATTER.progress(THREADS)
-
-
-def retag_and_push_images(images):
-    """
-    Takes a list of images, retags them and pushes to the repository
-
-    :param images: list[DockerImage]
-    """
-    THREADS = {}
-    with concurrent.futures.ThreadPoolExecutor(
-        max_workers=constants.MAX_WORKER_COUNT_FOR_PUSHING_IMAGES
-    ) as executor:
-        for image in images:
-            THREADS[image.name] = executor.submit(image.push_image_with_additional_tags)
-    FORMATTER.progress(THREADS)
-
-
 def tag_image_with_pr_number(image_tag):
     pr_number = os.getenv("PR_NUMBER")
     return f"{image_tag}-pr-{pr_number}"
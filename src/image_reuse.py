@@ -0,0 +1,240 @@
+"""
+Copyright 2019-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License"). You
+may not use this file except in compliance with the License. A copy of
+the License is located at
+
+    http://aws.amazon.com/apache2.0/
+
+or in the "license" file accompanying this file. This file is
+distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+ANY KIND, either express or implied. See the License for the specific
+language governing permissions and limitations under the License.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import logging
+import re
+import threading
+
+import boto3
+
+from botocore.exceptions import ClientError
+from docker.errors import APIError
+
+import constants
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+# Manifest types the registry is asked for when an image is retagged, the manifest is copied as is
+MANIFEST_MEDIA_TYPES = [
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.oci.image.index.v1+json",
+]
+MAX_WORKER_COUNT_FOR_TAGGING = 8
+
+# Instructions of a Dockerfile that determine its base images, e.g.
+#   ARG BASE_IMAGE=nvidia/cuda:12.1.1-base-ubuntu22.04
+#   FROM --platform=linux/amd64 ${BASE_IMAGE} AS base
+ARG_PATTERN = re.compile(r"^\s*ARG\s+(\w+)(?:=(\S*))?", re.IGNORECASE)
+FROM_PATTERN = re.compile(r"^\s*FROM\s+(?:--\S+\s+)*(\S+)(?:\s+AS\s+(\S+))?", re.IGNORECASE)
+VARIABLE_PATTERN = re.compile(r"\$\{(\w+)(?::-([^}]*))?\}|\$(\w+)")
+
+# Fingerprints and build times of the images of this job by image URI, images built on top of
+# them use them in their own fingerprint
+_BUILDS = {}
+_BUILDS_LOCK = threading.Lock()
+
+# Registry digests of the base images of this job by image reference, None if not resolved
+_BASE_IMAGE_DIGESTS = {}
+
+
+def compute_fingerprint(inputs):
+    """
+    Computes a deterministic fingerprint of the inputs of an image build
+
+    :param inputs: <dict> JSON serializable inputs of the build
+    :return: <str> sha256 hex digest
+    """
+    serialized = json.dumps(inputs, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def fingerprint_tag(fingerprint):
+    """
+    :param fingerprint: <str> input fingerprint
+    :return: <str> tag pushed with an image, so that it can be found by its fingerprint
+    """
+    return f"{constants.INPUT_FINGERPRINT_TAG_PREFIX}{fingerprint}"
+
+
+def record_fingerprint(image_uri, fingerprint):
+    with _BUILDS_LOCK:
+        _BUILDS.setdefault(image_uri, {})["fingerprint"] = fingerprint
+
+
+def record_build_seconds(image_uri, build_seconds):
+    with _BUILDS_LOCK:
+        _BUILDS.setdefault(image_uri, {})["build_seconds"] = build_seconds
+
+
+def get_fingerprint(image_uri):
+    with _BUILDS_LOCK:
+        return _BUILDS.get(image_uri, {}).get("fingerprint")
+
+
+def get_build_seconds(image_uri):
+    with _BUILDS_LOCK:
+        return _BUILDS.get(image_uri, {}).get("build_seconds")
+
+
+def base_images(dockerfile, build_args):
+    """
+    :param dockerfile: <str> content of a Dockerfile
+    :param build_args: <dict> build args of the image, they replace the defaults of its ARGs
+    :return: <list> images the stages of the Dockerfile are built FROM, without scratch and the
+        stages of the Dockerfile itself
+    """
+    args = {}
+    stages = set()
+    images = []
+
+    def substitute(match):
+        name = match.group(1) or match.group(3)
+        return args.get(name) or match.group(2) or ""
+
+    for line in dockerfile.splitlines():
+        match = ARG_PATTERN.match(line)
+        if match and not stages and not images:
+            # Only ARGs before the first FROM can be used in FROM instructions
+            name, default = match.group(1), (match.group(2) or "").strip("\"'")
+            args[name] = str(build_args.get(name, default))
+            continue
+        match = FROM_PATTERN.match(line)
+        if match is None:
+            continue
+        image = VARIABLE_PATTERN.sub(substitute, match.group(1))
+        if image.lower() != "scratch" and image not in stages and image not in images:
+            images.append(image)
+        if match.group(2):
+            stages.add(match.group(2))
+    return images
+
+
+def resolve_digest(client, image):
+    """
+    Resolves a tag to the digest of the image it currently points to in its registry, once per
+    image in a run
+
+    :param client: Docker API client
+    :param image: <str> image reference
+    :return: <str> digest of the image, None if it could not be resolved
+    """
+    with _BUILDS_LOCK:
+        if image in _BASE_IMAGE_DIGESTS:
+            return _BASE_IMAGE_DIGESTS[image]
+    try:
+        digest = client.inspect_distribution(image)["Descriptor"]["digest"]
+    except APIError as e:
+        LOGGER.warning(f"Could not resolve the digest of {image}: {e}")
+        digest = None
+    with _BUILDS_LOCK:
+        return _BASE_IMAGE_DIGESTS.setdefault(image, digest)
+
+
+class EcrImageRegistry:
+    """
+    Finds images in ECR by their fingerprint tag and tags pushed images. Any client with the same
+    find and add_tags methods can be used instead, e.g. a fake one in tests.
+    """
+
+    def __init__(self, region, ecr_client=None):
+        """
+        :param region: <str> region of the repositories, the client is created in the calling
+            thread because creating boto3 clients is not thread safe
+        :param ecr_client: optional client with the interface of the boto3 ECR client
+        """
+        self.ecr_client = ecr_client or boto3.client("ecr", region_name=region)
+
+    @staticmethod
+    def _split_repository(repository):
+        registry, repository_name = repository.split("/", 1)
+        return registry.split(".")[0], repository_name
+
+    def find(self, repository, tag):
+        """
+        :param repository: <str> repository URI, <account>.dkr.ecr.<region>.amazonaws.com/<name>
+        :param tag: <str> tag of the image
+        :return: <str> URI of the image, None if the repository has no image with that tag
+        """
+        registry_id, repository_name = self._split_repository(repository)
+        try:
+            self.ecr_client.describe_images(
+                registryId=registry_id,
+                repositoryName=repository_name,
+                imageIds=[{"imageTag": tag}],
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in (
+                "ImageNotFoundException",
+                "RepositoryNotFoundException",
+            ):
+                # A lookup that fails only costs a build
+                LOGGER.warning(f"Could not look up {repository}:{tag}: {e}")
+            return None
+        return f"{repository}:{tag}"
+
+    def add_tags(self, repository, tag, additional_tags):
+        """
+        Attaches additional tags to a pushed image with put_image calls that reuse its manifest,
+        all tags at once. The layers are neither uploaded nor checked again.
+
+        :param repository: <str> repository URI
+        :param tag: <str> tag of the pushed image
+        :param additional_tags: <list> tags to attach
+        :return: <list> tags that could not be attached
+        """
+        registry_id, repository_name = self._split_repository(repository)
+        response = self.ecr_client.batch_get_image(
+            registryId=registry_id,
+            repositoryName=repository_name,
+            imageIds=[{"imageTag": tag}],
+            acceptedMediaTypes=MANIFEST_MEDIA_TYPES,
+        )
+        if not response.get("images"):
+            LOGGER.warning(f"{repository}:{tag} not found: {response.get('failures')}")
+            return list(additional_tags)
+        image = response["images"][0]
+
+        def put_tag(additional_tag):
+            try:
+                self.ecr_client.put_image(
+                    registryId=registry_id,
+                    repositoryName=repository_name,
+                    imageManifest=image["imageManifest"],
+                    imageManifestMediaType=image["imageManifestMediaType"],
+                    imageTag=additional_tag,
+                )
+            except ClientError as e:
+                # The tag already points to this manifest
+                if e.response["Error"]["Code"] == "ImageAlreadyExistsException":
+                    return True
+                LOGGER.warning(f"Could not tag {repository}:{tag} as {additional_tag}: {e}")
+                return False
+            return True
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, min(MAX_WORKER_COUNT_FOR_TAGGING, len(additional_tags)))
+        ) as executor:
+            results = executor.map(put_tag, additional_tags)
+            return [
+                additional_tag
+                for additional_tag, tagged in zip(additional_tags, results)
+                if not tagged
+            ]
@@ -327,7 +327,7 @@ def conduct_autopatch_build_setup(pre_push_image_object: DockerImage, download_p
     }
     context = Context(
         autopatch_artifacts,
-        f"build/{image_name}.tar.gz",
+        f"build/{image_name}.tar",
         os.path.join(os.sep, get_cloned_folder_path(), "src"),
     )
     pre_push_image_object.info = info
@@ -0,0 +1,351 @@
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Unpacks the StabilityAI model cache before TorchServe starts.
+
+The cache is one of
+- a directory, linked into the cache path file by file, there is nothing to extract and the
+  weights are memory mapped from where SageMaker put them
+- an uncompressed tar, its files are copied in parallel straight from their offsets in the tar
+- a gzip (.gz, .tgz) or zstd (.zst) compressed tar, decompressed by pigz or zstd in a process of
+  its own when they are installed, while a thread pool writes the files
+
+Every file is written next to its final path and renamed when it is complete, then recorded in
+a progress file. An interrupted extraction skips the recorded files when it starts again.
+"""
+import gzip
+import logging
+import os
+import shutil
+import subprocess
+import tarfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+PROGRESS_FILE = ".model-cache-progress"
+PARTIAL_SUFFIX = ".partial"
+CHUNK_SIZE = 8 * 1024 * 1024
+LOG_INTERVAL_SECONDS = 10
+DEFAULT_WORKERS = max(4, min(16, os.cpu_count() or 1))
+
+ExtractionStats = namedtuple("ExtractionStats", "files, skipped_files, bytes, seconds")
+
+
+def _target_path(target_dir, name):
+    target_dir = os.path.abspath(target_dir)
+    path = os.path.normpath(os.path.join(target_dir, name))
+    if os.path.commonpath([path, target_dir]) != target_dir:
+        raise ValueError("{} is outside of {}".format(name, target_dir))
+    return path
+
+
+class _Progress:
+    """Names of the files that were completely written, kept in PROGRESS_FILE.
+
+    The first line identifies the cache file, the progress of a different cache is discarded.
+    """
+
+    def __init__(self, target_dir, cache_file):
+        self._path = os.path.join(target_dir, PROGRESS_FILE)
+        cache_stat = os.stat(cache_file)
+        identity = "{} {} {}".format(cache_file, cache_stat.st_size, cache_stat.st_mtime_ns)
+        self.completed = set()
+        try:
+            with open(self._path, encoding="utf8") as f:
+                lines = f.read().splitlines()
+            if lines and lines[0] == identity:
+                self.completed.update(lines[1:])
+        except OSError:
+            pass
+
+        self._lock = threading.Lock()
+        self._file = open(self._path, "w", encoding="utf8")
+        self._file.write("\n".join([identity] + sorted(self.completed)) + "\n")
+        self._file.flush()
+
+    def add(self, name):
+        with self._lock:
+            self._file.write(name + "\n")
+            self._file.flush()
+
+    def remove(self):
+        self._file.close()
+        os.remove(self._path)
+
+
+class _Throughput:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._last_log = self._start
+        self.files = 0
+        self.skipped_files = 0
+        self.bytes = 0
+
+    def add(self, size, files=0):
+        with self._lock:
+            self.bytes += size
+            self.files += files
+            now = time.time()
+            if now - self._last_log >= LOG_INTERVAL_SECONDS:
+                self._last_log = now
+                self._log("extracting model cache", now)
+
+    def _log(self, message, now):
+        seconds = now - self._start
+        log.info(
+            "{}: {} files, {:.1f} MB in {:.1f}s, {:.1f} MB/s".format(
+                message,
+                self.files,
+                self.bytes / 1024 / 1024,
+                seconds,
+                self.bytes / 1024 / 1024 / max(seconds, 1e-6),
+            )
+        )
+
+    def finish(self, message):
+        now = time.time()
+        self._log(message, now)
+        return ExtractionStats(self.files, self.skipped_files, self.bytes, now - self._start)
+
+
+def _finish_file(member, partial_path, path, progress, throughput):
+    os.chmod(partial_path, member.mode & 0o7777)
+    os.utime(partial_path, (member.mtime, member.mtime))
+    os.replace(partial_path, path)
+    progress.add(member.name)
+    throughput.add(0, files=1)
+
+
+def _make_link(target_dir, member):
+    path = _target_path(target_dir, member.name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.lexists(path):
+        os.remove(path)
+    if member.issym():
+        os.symlink(member.linkname, path)
+    else:
+        os.link(_target_path(target_dir, member.linkname), path)
+
+
+def _copy_range(cache_file, member, path, progress, throughput):
+    partial_path = path + PARTIAL_SUFFIX
+    with open(cache_file, "rb") as src, open(partial_path, "wb") as dst:
+        offset, remaining = member.offset_data, member.size
+        while remaining:
+            try:
+                # copied by the kernel, without passing through this process
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining, offset)
+            except OSError:
+                # file systems and kernels that do not support it
+                copied = dst.write(os.pread(src.fileno(), min(remaining, CHUNK_SIZE), offset))
+            if not copied:
+                raise EOFError("{} ends within {}".format(cache_file, member.name))
+            offset += copied
+            remaining -= copied
+            throughput.add(copied)
+    _finish_file(member, partial_path, path, progress, throughput)
+
+
+def _extract_uncompressed(cache_file, target_dir, progress, throughput, workers):
+    # r: only reads the member headers, the file data is seeked over
+    with tarfile.open(cache_file, "r:") as tar:
+        members = tar.getmembers()
+
+    links = []
+    with ThreadPoolExecutor(workers) as executor:
+        futures = []
+        for member in members:
+            path = _target_path(target_dir, member.name)
+            if member.isdir():
+                os.makedirs(path, exist_ok=True)
+            elif member.issym() or member.islnk():
+                links.append(member)
+            elif member.isreg():
+                if member.name in progress.completed:
+                    throughput.skipped_files += 1
+                    continue
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                futures.append(
+                    executor.submit(_copy_range, cache_file, member, path, progress, throughput)
+                )
+        for future in futures:
+            future.result()
+
+    for member in links:
+        _make_link(target_dir, member)
+
+
+class _StreamedFile:
+    """A file of a compressed tar, written by the pool chunk by chunk with pwrite."""
+
+    def __init__(self, member, path):
+        self.member = member
+        self.path = path
+        self.partial_path = path + PARTIAL_SUFFIX
+        self.fd = os.open(self.partial_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        self._lock = threading.Lock()
+        # the reader holds one reference until it submitted the last chunk
+        self._pending = 1
+
+    def acquire(self):
+        with self._lock:
+            self._pending += 1
+
+    def release(self, progress, throughput):
+        with self._lock:
+            self._pending -= 1
+            done = self._pending == 0
+        if done:
+            os.close(self.fd)
+            _finish_file(self.member, self.partial_path, self.path, progress, throughput)
+
+
+def _decompressor(cache_file):
+    """Returns (file object of the decompressed tar, decompression process or None)."""
+    if cache_file.endswith((".gz", ".tgz")):
+        command = ["pigz", "-dc", cache_file] if shutil.which("pigz") else None
+    elif cache_file.endswith(".zst"):
+        command = ["zstd", "-dc", "-T0", cache_file] if shutil.which("zstd") else None
+        if command is None:
+            import zstandard
+
+            return zstandard.ZstdDecompressor().stream_reader(open(cache_file, "rb")), None
+    else:
+        raise ValueError("unknown compression of {}".format(cache_file))
+
+    if command is None:
+        # zlib releases the GIL while it inflates, the writes still overlap with it
+        return gzip.open(cache_file, "rb"), None
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=CHUNK_SIZE)
+    return process.stdout, process
+
+
+def _extract_compressed(cache_file, target_dir, progress, throughput, workers):
+    stream, process = _decompressor(cache_file)
+    # bounds the decompressed chunks waiting for a writer
+    slots = threading.BoundedSemaphore(workers * 2)
+    errors = []
+
+    def write(streamed_file, chunk, offset):
+        try:
+            if not errors:
+                os.pwrite(streamed_file.fd, chunk, offset)
+                throughput.add(len(chunk))
+                streamed_file.release(progress, throughput)
+        except Exception as e:  # pylint: disable=broad-except
+            errors.append(e)
+        finally:
+            slots.release()
+
+    links = []
+    try:
+        with ThreadPoolExecutor(workers) as executor, tarfile.open(
+            fileobj=stream, mode="r|"
+        ) as tar:
+            for member in tar:
+                if errors:
+                    break
+                path = _target_path(target_dir, member.name)
+                if member.isdir():
+                    os.makedirs(path, exist_ok=True)
+                    continue
+                if member.issym() or member.islnk():
+                    links.append(member)
+                    continue
+                if not member.isreg():
+                    continue
+                if member.name in progress.completed:
+                    # the stream can not seek, the data is still read but not written
+                    throughput.skipped_files += 1
+                    continue
+
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                streamed_file = _StreamedFile(member, path)
+                data = tar.extractfile(member)
+                offset = 0
+                while True:
+                    chunk = data.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    slots.acquire()
+                    streamed_file.acquire()
+                    executor.submit(write, streamed_file, chunk, offset)
+                    offset += len(chunk)
+                streamed_file.release(progress, throughput)
+    finally:
+        stream.close()
+        if process:
+            process.wait()
+
+    if errors:
+        raise errors[0]
+    if process and process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+    for member in links:
+        _make_link(target_dir, member)
+
+
+def _link_tree(cache_dir, target_dir, throughput):
+    for root, dirs, files in os.walk(cache_dir):
+        relative = os.path.relpath(root, cache_dir)
+        target_root = os.path.normpath(os.path.join(target_dir, relative))
+        os.makedirs(target_root, exist_ok=True)
+        # directories that do not exist yet are linked as a whole
+        for name in list(dirs):
+            if not os.path.lexists(os.path.join(target_root, name)):
+                os.symlink(os.path.join(root, name), os.path.join(target_root, name))
+                dirs.remove(name)
+                throughput.files += 1
+        for name in files:
+            if not os.path.lexists(os.path.join(target_root, name)):
+                os.symlink(os.path.join(root, name), os.path.join(target_root, name))
+                throughput.files += 1
+
+
+def unpack(cache_file, target_dir, status_file, workers=DEFAULT_WORKERS):
+    """Makes the model cache available in target_dir and creates status_file when it is.
+
+    :param cache_file: directory, tar, or gzip or zstd compressed tar
+    :param target_dir: directory the files are extracted or linked to
+    :param status_file: created once every file is in place
+    :param workers: threads that write the files of a tar
+    :return: ExtractionStats
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    throughput = _Throughput()
+    if os.path.isdir(cache_file):
+        _link_tree(cache_file, target_dir, throughput)
+        stats = throughput.finish("linked model cache")
+    else:
+        progress = _Progress(target_dir, cache_file)
+        if progress.completed:
+            log.info(
+                "resuming the extraction of {}, {} files are already extracted".format(
+                    cache_file, len(progress.completed)
+                )
+            )
+        if cache_file.endswith((".gz", ".tgz", ".zst")):
+            extract = _extract_compressed
+        else:
+            extract = _extract_uncompressed
+        extract(cache_file, target_dir, progress, throughput, workers)
+        stats = throughput.finish("extracted model cache")
+        progress.remove()
+
+    with open(status_file, "w"):
+        pass
+    return stats
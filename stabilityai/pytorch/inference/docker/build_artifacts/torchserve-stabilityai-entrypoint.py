@@ -12,33 +12,31 @@
 # language governing permissions and limitations under the License.
 from __future__ import absolute_import
 
+import logging
 import os
-from pathlib import Path
 import shlex
 import subprocess
 import sys
 
 from sagemaker_inference import environment
 
+import model_cache
+
 SAI_MODEL_CACHE_FILE = os.path.join(
     environment.model_dir, os.getenv("SAI_MODEL_CACHE_FILE", "stabilityai-model-cache.tar")
 )
 SAI_MODEL_CACHE_PATH = os.getenv("SAI_MODEL_CACHE_PATH", "/tmp/cache")
 SAI_MODEL_CACHE_STATUS_FILE = os.path.join(SAI_MODEL_CACHE_PATH, ".model-cache-unpacked")
+# threads that write the files of the cache
+SAI_MODEL_CACHE_WORKERS = int(os.getenv("SAI_MODEL_CACHE_WORKERS", model_cache.DEFAULT_WORKERS))
 if os.path.exists(SAI_MODEL_CACHE_FILE) and not os.path.exists(SAI_MODEL_CACHE_STATUS_FILE):
-    os.makedirs(SAI_MODEL_CACHE_PATH, exist_ok=True)
-    subprocess.check_call(
-        [
-            "tar",
-            "x",
-            "-f",
-            SAI_MODEL_CACHE_FILE,
-            "-C",
-            SAI_MODEL_CACHE_PATH,
-            "-z" if SAI_MODEL_CACHE_FILE.endswith(".gz") else "",
-        ]
+    logging.basicConfig(level=logging.INFO)
+    model_cache.unpack(
+        SAI_MODEL_CACHE_FILE,
+        SAI_MODEL_CACHE_PATH,
+        SAI_MODEL_CACHE_STATUS_FILE,
+        workers=SAI_MODEL_CACHE_WORKERS,
     )
-    Path(SAI_MODEL_CACHE_STATUS_FILE).touch()
 
 if sys.argv[1] == "serve":
     from sagemaker_pytorch_serving_container import serving
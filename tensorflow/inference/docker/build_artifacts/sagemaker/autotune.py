@@ -0,0 +1,188 @@
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Derives gunicorn, TFS instance and TensorFlow thread pool settings from the container's
+CPU, NUMA, memory and GPU resources, for SAGEMAKER_TFS_AUTOTUNE=true."""
+import glob
+import logging
+import math
+import os
+import re
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+# memory a gunicorn worker needs on top of the handlers it imports, workers get at most
+# GUNICORN_MEMORY_SHARE of the container memory
+GUNICORN_WORKER_MEMORY_MB = 512
+GUNICORN_MEMORY_SHARE = 0.25
+MAX_GUNICORN_WORKERS = 16
+# a TFS instance holds the model and its TensorFlow runtime, 2x the SavedModel size is a floor
+TFS_MEMORY_PER_MODEL_MB_FACTOR = 2
+MEMORY_HEADROOM = 0.8
+
+Topology = namedtuple("Topology", "cpus, cpu_quota, numa_nodes, memory_mb, gpus")
+TuningPlan = namedtuple(
+    "TuningPlan",
+    "tfs_instance_count, gunicorn_workers, intra_op_parallelism, inter_op_parallelism, "
+    "tfs_cpu_sets, decisions",
+)
+
+
+def parse_cpu_list(cpu_list):
+    """Parses a kernel cpu list such as "0-3,8-11" into a sorted list of cpu ids."""
+    cpus = set()
+    for part in cpu_list.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def _read(path):
+    try:
+        with open(path, encoding="utf8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_quota():
+    """Returns the cgroup CPU limit in cores, None if there is none."""
+    cpu_max = _read("/sys/fs/cgroup/cpu.max")  # cgroup v2, "<quota> <period>" or "max <period>"
+    if cpu_max:
+        quota, period = cpu_max.split()
+        return None if quota == "max" else int(quota) / int(period)
+
+    quota = _read("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")  # cgroup v1
+    period = _read("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def cgroup_memory_limit_mb():
+    """Returns the cgroup memory limit, or the host memory when the container has none."""
+    host_mb = None
+    meminfo = _read("/proc/meminfo") or ""
+    match = re.search(r"MemTotal:\s+(\d+) kB", meminfo)
+    if match:
+        host_mb = int(match.group(1)) / 1024
+
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        limit = _read(path)
+        if limit and limit != "max":
+            limit_mb = int(limit) / (1024 * 1024)
+            # cgroup v1 reports a huge number when there is no limit
+            if host_mb is None or limit_mb < host_mb:
+                return limit_mb
+    return host_mb
+
+
+def numa_nodes(cpus):
+    """Returns the cpus of each NUMA node that this process may run on, {node id: [cpu ids]}."""
+    nodes = {}
+    for path in glob.glob("/sys/devices/system/node/node[0-9]*/cpulist"):
+        node = int(re.search(r"node(\d+)", path).group(1))
+        node_cpus = [cpu for cpu in parse_cpu_list(_read(path) or "") if cpu in cpus]
+        if node_cpus:
+            nodes[node] = node_cpus
+    return nodes or {0: list(cpus)}
+
+
+def read_topology(gpus):
+    cpus = sorted(os.sched_getaffinity(0))  # the cpuset of the container
+    return Topology(cpus, cgroup_cpu_quota(), numa_nodes(cpus), cgroup_memory_limit_mb(), gpus)
+
+
+def _split(cpus, count):
+    size = len(cpus) // count
+    return [cpus[i * size : (i + 1) * size] for i in range(count)]
+
+
+def plan(topology, model_size_mb=0, multi_model=False, max_instances=None):
+    """Derives the settings for a topology.
+
+    :param topology: Topology of the container
+    :param model_size_mb: size of the SavedModels TFS loads, 0 if unknown
+    :param multi_model: MME starts its TFS instances per model, leave their count alone
+    :param max_instances: number of TFS instances the ports can serve, None if unlimited
+    :return: TuningPlan, decisions holds a sentence for each derived value
+    """
+    decisions = []
+    cores = len(topology.cpus)
+    if topology.cpu_quota:
+        cores = max(1, min(cores, int(math.ceil(topology.cpu_quota))))
+    decisions.append(
+        "{} usable cores ({} cpus in the cpuset, cpu quota {})".format(
+            cores, len(topology.cpus), topology.cpu_quota or "unlimited"
+        )
+    )
+
+    nodes = sorted(topology.numa_nodes.items())
+    if multi_model:
+        instances = 1
+        decisions.append("1 TFS instance per model, multi-model endpoints start one per load")
+    elif topology.gpus:
+        instances = topology.gpus
+        decisions.append("{} TFS instances, one per GPU".format(instances))
+    elif len(nodes) > 1 and cores == len(topology.cpus):
+        instances = len(nodes)
+        decisions.append("{} TFS instances, one per NUMA node".format(instances))
+    else:
+        instances = 1
+        decisions.append("1 TFS instance, the cores are on a single NUMA node or quota limited")
+
+    if not multi_model and model_size_mb and topology.memory_mb:
+        fit = int(
+            topology.memory_mb * MEMORY_HEADROOM // (model_size_mb * TFS_MEMORY_PER_MODEL_MB_FACTOR)
+        )
+        if max(fit, 1) < instances:
+            instances = max(fit, 1)
+            decisions.append(
+                "reduced to {} TFS instances to fit {:.0f}MB of models in {:.0f}MB".format(
+                    instances, model_size_mb, topology.memory_mb
+                )
+            )
+
+    if max_instances is not None and instances > max_instances:
+        instances = max_instances
+        decisions.append("reduced to {} TFS instances, the ports fit no more".format(instances))
+
+    cores_per_instance = max(1, cores // instances)
+    intra_op = cores_per_instance
+    inter_op = max(1, min(4, cores_per_instance // 4))
+    decisions.append(
+        "{} intra-op and {} inter-op threads per TFS instance".format(intra_op, inter_op)
+    )
+
+    # pin only when every instance gets whole cpus of its own and no cpu quota shares them
+    cpu_sets = None
+    if not multi_model and instances > 1 and cores == len(topology.cpus):
+        if len(nodes) == instances:
+            cpu_sets = [node_cpus for _, node_cpus in nodes]
+            decisions.append("TFS instances pinned to NUMA nodes {}".format([n for n, _ in nodes]))
+        elif len(topology.cpus) >= instances:
+            cpu_sets = _split(topology.cpus, instances)
+            decisions.append("TFS instances pinned to {} cpus each".format(len(cpu_sets[0])))
+
+    workers = max(1, min(MAX_GUNICORN_WORKERS, cores // 4))
+    if topology.memory_mb:
+        memory_workers = topology.memory_mb * GUNICORN_MEMORY_SHARE // GUNICORN_WORKER_MEMORY_MB
+        workers = max(1, min(workers, int(memory_workers)))
+    decisions.append("{} gunicorn workers".format(workers))
+
+    return TuningPlan(instances, workers, intra_op, inter_op, cpu_sets, decisions)
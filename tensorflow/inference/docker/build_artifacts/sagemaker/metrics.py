@@ -0,0 +1,244 @@
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Prometheus text format metrics of python_service, aggregated across gunicorn workers.
+
+Every worker records its metrics in memory and writes them to its own file in a tmpfs directory
+at most once per flush interval, the same layout prometheus_client uses in multiprocess mode.
+/metrics merges the files of all workers. Files of workers that exited are kept so counters
+never go backwards, only their gauges are dropped. serve.py records the startup timeline in a
+file of its own.
+"""
+import glob
+import json
+import logging
+import os
+import time
+
+log = logging.getLogger(__name__)
+
+METRICS_DIR = "/dev/shm/sagemaker-metrics" if os.path.isdir("/dev/shm") else "/sagemaker/metrics"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1024, 10240, 102400, 1048576, 10485760, 104857600)
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    "sagemaker_tfs_requests_total": (COUNTER, "Invocations by model and status code.", None),
+    "sagemaker_tfs_request_duration_seconds": (
+        HISTOGRAM,
+        "Time from receiving an invocation to returning its response.",
+        LATENCY_BUCKETS,
+    ),
+    "sagemaker_tfs_handler_duration_seconds": (
+        HISTOGRAM,
+        "Time spent in the default or custom inference handlers.",
+        LATENCY_BUCKETS,
+    ),
+    "sagemaker_tfs_upstream_duration_seconds": (
+        HISTOGRAM,
+        "Time of the predict calls to TensorFlow Serving.",
+        LATENCY_BUCKETS,
+    ),
+    "sagemaker_tfs_request_size_bytes": (HISTOGRAM, "Invocation payload sizes.", SIZE_BUCKETS),
+    "sagemaker_tfs_in_flight_requests": (
+        GAUGE,
+        "Invocations being handled per TensorFlow Serving instance.",
+        None,
+    ),
+    "sagemaker_tfs_prediction_cache_requests_total": (
+        COUNTER,
+        "Prediction cache lookups by model and result, hit or miss.",
+        None,
+    ),
+    "sagemaker_tfs_prediction_cache_evictions_total": (
+        COUNTER,
+        "Cached predictions replaced by newer ones before they expired.",
+        None,
+    ),
+    "sagemaker_tfs_model_load_duration_seconds": (
+        HISTOGRAM,
+        "Time of multi-model endpoint model loads.",
+        LATENCY_BUCKETS,
+    ),
+    "sagemaker_tfs_model_warmup_duration_seconds": (
+        HISTOGRAM,
+        "Time of the synthetic predict requests that warm up a model after it is loaded.",
+        LATENCY_BUCKETS,
+    ),
+    "sagemaker_tfs_model_unload_duration_seconds": (
+        HISTOGRAM,
+        "Time of multi-model endpoint model unloads.",
+        LATENCY_BUCKETS,
+    ),
+    "sagemaker_tfs_startup_seconds": (
+        GAUGE,
+        "Seconds from the start of the container services to each startup event, e.g. when "
+        "TensorFlow Serving, gunicorn and nginx became ready.",
+        None,
+    ),
+    "sagemaker_tfs_model_evictions_total": (
+        COUNTER,
+        "Least recently used models unloaded to make room for a load, by exceeded budget.",
+        None,
+    ),
+}
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{{{}}}".format(
+        ",".join(
+            '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+            for key, value in labels
+        )
+    )
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class ServiceMetrics:
+    """Counters, gauges and histograms keyed by metric name and a tuple of (label, value) pairs.
+
+    Create it before gunicorn forks, a worker starts from empty metrics the first time it
+    records anything.
+    """
+
+    def __init__(self, directory=METRICS_DIR, flush_interval_seconds=1.0):
+        self._directory = directory
+        self._flush_interval_seconds = flush_interval_seconds
+        os.makedirs(directory, exist_ok=True)
+        # metrics of a previous run of the container or gunicorn, the startup timeline of the
+        # running serve.py is kept
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            pid = os.path.splitext(os.path.basename(path))[0]
+            if not pid.isdigit() or not _is_running(int(pid)):
+                os.remove(path)
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._path = os.path.join(self._directory, "{}.json".format(self._pid))
+        self._values = {}
+        self._last_flush = 0
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    def inc(self, name, labels=(), amount=1):
+        self._check_pid()
+        key = (name, labels)
+        self._values[key] = self._values.get(key, 0) + amount
+        self._maybe_flush()
+
+    def set(self, name, labels, value):
+        self._check_pid()
+        previous = self._values.get((name, labels))
+        self._values[(name, labels)] = value
+        if value == 0 and previous:
+            # an idle worker would otherwise report its last non zero value until its next request
+            self.flush()
+        else:
+            self._maybe_flush()
+
+    def observe(self, name, labels, value):
+        self._check_pid()
+        key = (name, labels)
+        buckets = METRICS[name][2]
+        histogram = self._values.get(key)
+        if histogram is None:
+            # cumulative bucket counts, the +Inf count, sum
+            histogram = self._values[key] = [0] * (len(buckets) + 1) + [0.0]
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[-2] += 1
+        histogram[-1] += value
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if time.time() - self._last_flush >= self._flush_interval_seconds:
+            self.flush()
+
+    def flush(self):
+        self._check_pid()
+        self._last_flush = time.time()
+        values = [[name, labels, value] for (name, labels), value in self._values.items()]
+        tmp_path = self._path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf8") as f:
+                json.dump({"pid": self._pid, "values": values}, f)
+            os.replace(tmp_path, self._path)
+        except OSError as e:
+            log.warning("failed to write metrics to {}: {}".format(self._path, e))
+
+    def _merge(self):
+        merged = {}
+        for path in glob.glob(os.path.join(self._directory, "*.json")):
+            try:
+                with open(path, encoding="utf8") as f:
+                    worker = json.load(f)
+            except (OSError, ValueError):
+                # a worker that is being replaced, its next flush is picked up by the next scrape
+                continue
+            running = _is_running(worker["pid"])
+            for name, labels, value in worker["values"]:
+                metric_type = METRICS[name][0]
+                if metric_type == GAUGE and not running:
+                    continue
+                key = (name, tuple(tuple(label) for label in labels))
+                if metric_type == HISTOGRAM:
+                    total = merged.setdefault(key, [0] * len(value))
+                    merged[key] = [a + b for a, b in zip(total, value)]
+                else:
+                    merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def render(self):
+        """Returns the metrics of all workers in the prometheus text exposition format."""
+        self.flush()
+        merged = self._merge()
+        lines = []
+        for name, (metric_type, description, buckets) in METRICS.items():
+            samples = sorted((labels, value) for (n, labels), value in merged.items() if n == name)
+            if not samples:
+                continue
+            lines.append("# HELP {} {}".format(name, description))
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            for labels, value in samples:
+                if metric_type != HISTOGRAM:
+                    lines.append("{}{} {}".format(name, _format_labels(labels), value))
+                    continue
+                for bound, count in zip(buckets + ("+Inf",), value[:-1]):
+                    bucket_labels = labels + (("le", _format_value(bound)),)
+                    lines.append(
+                        "{}_bucket{} {}".format(name, _format_labels(bucket_labels), count)
+                    )
+                lines.append("{}_sum{} {}".format(name, _format_labels(labels), value[-1]))
+                lines.append("{}_count{} {}".format(name, _format_labels(labels), value[-2]))
+        return "\n".join(lines) + "\n"
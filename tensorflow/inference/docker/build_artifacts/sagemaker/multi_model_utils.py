@@ -11,25 +11,127 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 import fcntl
+import json
+import logging
+import mmap
+import os
 import signal
+import struct
 import time
+import zlib
 from contextlib import contextmanager
 
+log = logging.getLogger(__name__)
+
 MODEL_CONFIG_FILE = "/sagemaker/model-config.cfg"
 DEFAULT_LOCK_FILE = "/sagemaker/lock-file.lock"
+# tmpfs keeps registry updates off the disk, /dev/shm is not mounted everywhere though
+MODEL_REGISTRY_FILE = (
+    "/dev/shm/sagemaker-mme-registry" if os.path.isdir("/dev/shm") else "/sagemaker/mme-registry"
+)
+MODEL_REGISTRY_SIZE = int(os.environ.get("SAGEMAKER_MME_REGISTRY_SIZE_BYTES", 4 * 1024 * 1024))
+# single-model mode: TFS instances that serve.py reports as serving, under TFS_INSTANCES_KEY
+TFS_INSTANCE_REGISTRY_FILE = (
+    "/dev/shm/sagemaker-tfs-instances"
+    if os.path.isdir("/dev/shm")
+    else "/sagemaker/tfs-instances-registry"
+)
+TFS_INSTANCE_REGISTRY_SIZE = 64 * 1024
+TFS_INSTANCES_KEY = "instances"
+MODEL_USAGE_FILE = (
+    "/dev/shm/sagemaker-mme-usage" if os.path.isdir("/dev/shm") else "/sagemaker/mme-usage"
+)
+LOCK_POLL_INTERVAL_SECONDS = 0.01
 
 
 @contextmanager
 def lock(path=DEFAULT_LOCK_FILE):
-    f = open(path, "w", encoding="utf8")
-    fd = f.fileno()
-    fcntl.lockf(fd, fcntl.LOCK_EX)
+    with open(path, "w", encoding="utf8") as f:
+        fd = f.fileno()
+        # poll instead of blocking in lockf, so that a gevent worker keeps serving other
+        # requests while it waits for another worker's load or unload to finish
+        while True:
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except (BlockingIOError, PermissionError):
+                time.sleep(LOCK_POLL_INTERVAL_SECONDS)
 
-    try:
-        yield
-    finally:
-        time.sleep(1)
-        fcntl.lockf(fd, fcntl.LOCK_UN)
+        try:
+            yield
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN)
+
+
+class ModelRegistry:
+    """Table of TFS instances per model, shared between processes through a memory mapped file.
+
+    Readers never lock and never touch the file system. The writer moves a sequence number to an
+    odd value before it changes the table and to the next even value when it is done (a seqlock).
+    Readers retry when they see an odd or changing sequence number or a checksum mismatch, and
+    only decode the table when the sequence number (the table generation) has changed since
+    their previous read. Writers, i.e. model load and unload, must hold lock(). In single-model
+    mode serve.py is the only writer and publishes the instances that are ready to serve.
+    """
+
+    _HEADER = struct.Struct("<QII")  # sequence number, table length, table crc32
+    _SEQUENCE = struct.Struct("<Q")
+    # a writer that died mid update leaves an odd sequence number until the next write
+    _MAX_READ_WAIT_SECONDS = 1
+
+    def __init__(self, path=MODEL_REGISTRY_FILE, size=MODEL_REGISTRY_SIZE):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._generation = None
+        self._models = {}
+
+    def read(self):
+        """Returns (generation, {model name: [[rest port, grpc port, pid], ...]})."""
+        deadline = time.time() + self._MAX_READ_WAIT_SECONDS
+        while True:
+            sequence, length, crc = self._HEADER.unpack_from(self._mmap, 0)
+            if sequence == self._generation:
+                return self._generation, self._models
+
+            if sequence % 2 == 0:
+                table = self._mmap[self._HEADER.size : self._HEADER.size + length]
+                if (
+                    self._SEQUENCE.unpack_from(self._mmap, 0)[0] == sequence
+                    and zlib.crc32(table) == crc
+                ):
+                    self._models = json.loads(table) if table else {}
+                    self._generation = sequence
+                    return self._generation, self._models
+
+            if time.time() > deadline:
+                log.warning("registry update in progress, using generation %s", self._generation)
+                return self._generation, self._models
+            # yields to other greenlets under gevent
+            time.sleep(0)
+
+    def write(self, models):
+        """Publishes {model name: [[rest port, grpc port, pid], ...]} and returns its generation."""
+        table = json.dumps(models).encode("utf-8")
+        if self._HEADER.size + len(table) > len(self._mmap):
+            raise ValueError(
+                "model registry needs {} bytes, set SAGEMAKER_MME_REGISTRY_SIZE_BYTES "
+                "to a larger value".format(self._HEADER.size + len(table))
+            )
+
+        sequence = self._SEQUENCE.unpack_from(self._mmap, 0)[0]
+        sequence += 1 if sequence % 2 == 0 else 2
+        self._SEQUENCE.pack_into(self._mmap, 0, sequence)
+        self._mmap[self._HEADER.size : self._HEADER.size + len(table)] = table
+        self._HEADER.pack_into(self._mmap, 0, sequence + 1, len(table), zlib.crc32(table))
+
+        self._generation = sequence + 1
+        self._models = json.loads(table)
+        return self._generation
 
 
 @contextmanager
@@ -45,6 +147,52 @@ def timeout(seconds=60):
         signal.alarm(0)
 
 
+class ModelUsageTable:
+    """Last invocation time per MME rest port and eviction counters, shared by all gunicorn workers.
+
+    An invocation only stores an 8 byte timestamp in the slot of the rest port it was routed to,
+    so the hot path needs no lock. Eviction counters are only updated by model loads, which hold
+    lock().
+    """
+
+    EVICTION_REASONS = ("ports", "memory")
+    _COUNTER = struct.Struct("<Q")
+    _TIMESTAMP = struct.Struct("<d")
+
+    def __init__(self, rest_ports, path=MODEL_USAGE_FILE):
+        self._first_port = min(rest_ports)
+        self._timestamps_offset = self._COUNTER.size * len(self.EVICTION_REASONS)
+        slots = max(rest_ports) - self._first_port + 1
+        size = self._timestamps_offset + self._TIMESTAMP.size * slots
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def _slot(self, rest_port):
+        return self._timestamps_offset + self._TIMESTAMP.size * (int(rest_port) - self._first_port)
+
+    def touch(self, rest_port):
+        self._TIMESTAMP.pack_into(self._mmap, self._slot(rest_port), time.time())
+
+    def last_used(self, rest_port):
+        return self._TIMESTAMP.unpack_from(self._mmap, self._slot(rest_port))[0]
+
+    def record_eviction(self, reason):
+        offset = self._COUNTER.size * self.EVICTION_REASONS.index(reason)
+        count = self._COUNTER.unpack_from(self._mmap, offset)[0]
+        self._COUNTER.pack_into(self._mmap, offset, count + 1)
+
+    def evictions(self):
+        return {
+            reason: self._COUNTER.unpack_from(self._mmap, self._COUNTER.size * i)[0]
+            for i, reason in enumerate(self.EVICTION_REASONS)
+        }
+
+
 class MultiModelException(Exception):
     def __init__(self, code, msg, pid):
         Exception.__init__(self, code, msg)
@@ -0,0 +1,213 @@
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+
+log = logging.getLogger(__name__)
+
+PREDICTION_CACHE_FILE = (
+    "/dev/shm/sagemaker-prediction-cache"
+    if os.path.isdir("/dev/shm")
+    else "/sagemaker/prediction-cache"
+)
+
+
+def cache_key(parts, body):
+    """Returns the sha256 digest that identifies a prediction.
+
+    :param parts: model name, version, method and the other request attributes a response
+        depends on
+    :param body: request body
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    digest.update(body)
+    return digest.digest()
+
+
+class PredictionCache:
+    """Size bounded LRU cache of prediction responses with a TTL, shared by all gunicorn workers
+    through a memory mapped file.
+
+    The file holds fixed size slots grouped in sets of WAYS slots. A key is only ever stored in
+    the set its digest maps to, so a lookup reads at most WAYS slots and a store replaces the
+    expired or least recently used slot of that set. Responses larger than a slot are not cached.
+
+    Readers never lock: a writer moves the sequence number of a slot to an odd value while it
+    changes the slot (a seqlock), and readers treat a slot that changed while they copied it as
+    a miss. Writers of the same set are serialized with a byte range lock on it. Stores that can
+    not take the lock at once are skipped instead of blocking the gevent worker.
+
+    invalidate() bumps the generation in the file header before it clears the slots of a model.
+    A response is only stored if the generation did not change since its lookup, so a prediction
+    of an unloaded model that was still in flight can not be cached after the invalidation.
+    """
+
+    WAYS = 8
+    _GENERATION = struct.Struct("<Q")
+    _SEQUENCE = struct.Struct("<Q")
+    # sequence number, key digest, crc32 of the model name, expiry time, last use time,
+    # content type length, body length
+    _SLOT = struct.Struct("<Q32sIddHI")
+    _LAST_USED_OFFSET = struct.calcsize("<Q32sId")
+    _LAST_USED = struct.Struct("<d")
+
+    def __init__(self, size_bytes, max_entry_bytes, ttl_seconds=0, path=PREDICTION_CACHE_FILE):
+        self._max_entry_bytes = max_entry_bytes
+        self._ttl_seconds = ttl_seconds
+        self._slot_size = self._SLOT.size + max_entry_bytes
+        slots = max(self.WAYS, size_bytes // self._slot_size)
+        self._sets = slots // self.WAYS
+        self._set_size = self._slot_size * self.WAYS
+        size = self._GENERATION.size + self._set_size * self._sets
+
+        # a cache left by a previous gunicorn may hold responses of models that changed since
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.ftruncate(self._fd, size)
+        self._mmap = mmap.mmap(self._fd, size)
+        log.info(
+            "prediction cache: {} sets of {} slots, {} bytes per response, ttl {}s".format(
+                self._sets, self.WAYS, max_entry_bytes, ttl_seconds or "unlimited"
+            )
+        )
+
+    def _set_offset(self, key):
+        index = int.from_bytes(key[:8], "little") % self._sets
+        return self._GENERATION.size + index * self._set_size
+
+    def _lock_set(self, set_offset, blocking=False):
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.lockf(self._fd, flags, self._set_size, set_offset)
+            return True
+        except (BlockingIOError, PermissionError):
+            return False
+
+    def _unlock_set(self, set_offset):
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, self._set_size, set_offset)
+
+    def generation(self):
+        return self._GENERATION.unpack_from(self._mmap, 0)[0]
+
+    def get(self, key):
+        """Returns (content type, body) of a cached response, None on a miss."""
+        set_offset = self._set_offset(key)
+        now = time.time()
+        for way in range(self.WAYS):
+            offset = set_offset + way * self._slot_size
+            sequence, digest, _, expires_at, _, type_length, length = self._SLOT.unpack_from(
+                self._mmap, offset
+            )
+            if digest != key or sequence % 2:
+                continue
+            if expires_at and expires_at < now:
+                return None
+            start = offset + self._SLOT.size
+            content_type = self._mmap[start : start + type_length]
+            body = self._mmap[start + type_length : start + type_length + length]
+            if self._SEQUENCE.unpack_from(self._mmap, offset)[0] != sequence:
+                # a writer replaced the slot while it was copied
+                return None
+            self._LAST_USED.pack_into(self._mmap, offset + self._LAST_USED_OFFSET, now)
+            return content_type.decode("utf-8"), body
+        return None
+
+    def put(self, key, model_name, content_type, body, generation):
+        """Stores a response, generation is the generation() read before the prediction.
+
+        :return: True if a live entry was evicted to make room for the response
+        """
+        content_type = (content_type or "").encode("utf-8")
+        if len(content_type) + len(body) > self._max_entry_bytes:
+            return False
+
+        set_offset = self._set_offset(key)
+        if not self._lock_set(set_offset):
+            return False
+        try:
+            if self.generation() != generation:
+                return False
+
+            now = time.time()
+            # the slot of the same key, else an empty or expired slot, else the least recently used
+            victim, victim_rank = None, None
+            for way in range(self.WAYS):
+                offset = set_offset + way * self._slot_size
+                _, digest, _, expires_at, last_used, _, _ = self._SLOT.unpack_from(
+                    self._mmap, offset
+                )
+                if digest == key:
+                    rank = (0, 0)
+                elif not last_used or (expires_at and expires_at < now):
+                    rank = (1, 0)
+                else:
+                    rank = (2, last_used)
+                if victim is None or rank < victim_rank:
+                    victim, victim_rank = offset, rank
+            evicted = victim_rank[0] == 2
+
+            sequence = self._SEQUENCE.unpack_from(self._mmap, victim)[0]
+            self._SEQUENCE.pack_into(self._mmap, victim, sequence + 1)
+            start = victim + self._SLOT.size
+            self._mmap[start : start + len(content_type)] = content_type
+            self._mmap[start + len(content_type) : start + len(content_type) + len(body)] = body
+            self._SLOT.pack_into(
+                self._mmap,
+                victim,
+                sequence + 2,
+                key,
+                zlib.crc32(model_name.encode("utf-8")),
+                now + self._ttl_seconds if self._ttl_seconds else 0,
+                now,
+                len(content_type),
+                len(body),
+            )
+            return evicted
+        finally:
+            self._unlock_set(set_offset)
+
+    def invalidate(self, model_name):
+        """Drops every cached response of a model when it is unloaded or reloaded, call it under
+        lock().
+
+        :return: number of entries that were dropped
+        """
+        self._GENERATION.pack_into(self._mmap, 0, self.generation() + 1)
+        model_crc = zlib.crc32(model_name.encode("utf-8"))
+        dropped = 0
+        for index in range(self._sets):
+            set_offset = self._GENERATION.size + index * self._set_size
+            self._lock_set(set_offset, blocking=True)
+            try:
+                for way in range(self.WAYS):
+                    offset = set_offset + way * self._slot_size
+                    sequence, _, crc, _, last_used, _, _ = self._SLOT.unpack_from(
+                        self._mmap, offset
+                    )
+                    if last_used and crc == model_crc:
+                        self._SLOT.pack_into(
+                            self._mmap, offset, sequence + 2, bytes(32), 0, 0, 0, 0, 0
+                        )
+                        dropped += 1
+            finally:
+                self._unlock_set(set_offset)
+        log.info("prediction cache: dropped {} responses of model {}".format(dropped, model_name))
+        return dropped
@@ -18,7 +18,10 @@ gevent.monkey.patch_all()
 
 import bisect
 import argparse
+import gc
+import hashlib
 import importlib.util
+import io
 import json
 import logging
 import os
@@ -28,14 +31,29 @@ import grpc
 import sys
 import shutil
 import copy
-import pickle
+import random
+import threading
+import time
+
+from contextlib import contextmanager
 
 import falcon
 import requests
-import random
 
-from multi_model_utils import MultiModelException, lock
+from multi_model_utils import (
+    TFS_INSTANCE_REGISTRY_FILE,
+    TFS_INSTANCE_REGISTRY_SIZE,
+    TFS_INSTANCES_KEY,
+    ModelRegistry,
+    ModelUsageTable,
+    MultiModelException,
+    lock,
+)
+import metrics
+import prediction_cache
+import tfs_grpc
 import tfs_utils
+import warmup
 
 SAGEMAKER_MULTI_MODEL_ENABLED = os.environ.get("SAGEMAKER_MULTI_MODEL", "false").lower() == "true"
 INFERENCE_SCRIPT_PATH = (
@@ -50,6 +68,64 @@ TFS_GRPC_PORTS = os.environ.get("TFS_GRPC_PORTS")
 TFS_REST_PORTS = os.environ.get("TFS_REST_PORTS")
 SAGEMAKER_TFS_PORT_RANGE = os.environ.get("SAGEMAKER_SAFE_PORT_RANGE")
 TFS_INSTANCE_COUNT = int(os.environ.get("SAGEMAKER_TFS_INSTANCE_COUNT", "1"))
+TFS_REST_POOL_SIZE = int(os.environ.get("SAGEMAKER_TFS_REST_POOL_SIZE", "10"))
+TFS_REST_KEEPALIVE = os.environ.get("SAGEMAKER_TFS_REST_KEEPALIVE", "true").lower() == "true"
+TFS_REST_KEEPALIVE_SECONDS = int(os.environ.get("SAGEMAKER_TFS_REST_KEEPALIVE_SECONDS", "60"))
+TFS_REST_STATS_LOG_INTERVAL = int(os.environ.get("SAGEMAKER_TFS_REST_STATS_LOG_INTERVAL", "1000"))
+TFS_DEFAULT_MODEL_NAME = os.environ.get("TFS_DEFAULT_MODEL_NAME", "None")
+# "rest" or "grpc", can be overridden per request with the tfs-protocol custom attribute
+TFS_PREDICT_PROTOCOL = os.environ.get("SAGEMAKER_TFS_PREDICT_PROTOCOL", "rest").lower()
+TFS_GRPC_TIMEOUT_SECONDS = int(os.environ.get("SAGEMAKER_TFS_GRPC_TIMEOUT_SECONDS", "60"))
+# evict least recently used models instead of failing loads with 507
+MME_LRU_EVICTION = os.environ.get("SAGEMAKER_MME_LRU_EVICTION", "false").lower() == "true"
+MME_MEMORY_THRESHOLD_PERCENT = float(os.environ.get("SAGEMAKER_MME_MEMORY_THRESHOLD_PERCENT", 70))
+# 0 means no limit other than the host memory threshold and the port range
+MME_TFS_MEMORY_BUDGET_MB = float(os.environ.get("SAGEMAKER_MME_TFS_MEMORY_BUDGET_MB", 0))
+MME_MAX_TFS_INSTANCES = int(os.environ.get("SAGEMAKER_MME_MAX_TFS_INSTANCES", 0))
+# serve every model from the same SAGEMAKER_TFS_INSTANCE_COUNT TFS processes and load or unload
+# models with config reloads, instead of starting TFS processes for each model
+MME_SHARED_TFS = os.environ.get("SAGEMAKER_MME_SHARED_TFS", "false").lower() == "true"
+MME_SHARED_TFS_DIR = "/sagemaker/tfs-config-shared"
+MME_SHARED_TFS_STATE_FILE = os.path.join(MME_SHARED_TFS_DIR, "state.json")
+# coalesce concurrent input_handler outputs into one TFS predict call
+TFS_COALESCE_REQUESTS = os.environ.get("SAGEMAKER_TFS_COALESCE_REQUESTS", "false").lower() == "true"
+TFS_COALESCE_WINDOW_MS = float(os.environ.get("SAGEMAKER_TFS_COALESCE_WINDOW_MS", 2))
+TFS_COALESCE_MAX_BATCH_SIZE = int(os.environ.get("SAGEMAKER_TFS_COALESCE_MAX_BATCH_SIZE", 64))
+# longest a coalesced request waits for its batch, defaults to the gunicorn request timeout
+TFS_COALESCE_TIMEOUT_SECONDS = float(
+    os.environ.get(
+        "SAGEMAKER_TFS_COALESCE_TIMEOUT_SECONDS",
+        os.environ.get("SAGEMAKER_GUNICORN_TIMEOUT_SECONDS", 30),
+    )
+)
+# forward default handler request and response bodies to and from TFS without buffering them
+TFS_STREAM_BODIES = os.environ.get("SAGEMAKER_TFS_STREAM_BODIES", "false").lower() == "true"
+# "stream" passes custom handlers the falcon request stream, "memoryview" the body read into
+# a single buffer
+TFS_HANDLER_BODY = os.environ.get("SAGEMAKER_TFS_HANDLER_BODY", "stream").lower()
+# fraction of the invocations that log their model, ports and handlers, logging every request
+# costs measurable throughput at high request rates
+REQUEST_LOG_SAMPLE_RATE = float(os.environ.get("SAGEMAKER_TFS_REQUEST_LOG_SAMPLE_RATE", 0))
+# import the universal inference.py in the gunicorn master so that workers share it copy-on-write,
+# "false" imports it in every worker on its first invocation instead
+PRELOAD_INFERENCE_SCRIPT = (
+    os.environ.get("SAGEMAKER_TFS_PRELOAD_INFERENCE_SCRIPT", "true").lower() == "true"
+)
+# cache responses of identical invocations across gunicorn workers, "true" caches every invocation
+# unless it has the tfs-cache=false custom attribute, "request" only the ones with tfs-cache=true
+TFS_PREDICTION_CACHE = os.environ.get("SAGEMAKER_TFS_PREDICTION_CACHE", "false").lower()
+TFS_PREDICTION_CACHE_SIZE_MB = int(os.environ.get("SAGEMAKER_TFS_PREDICTION_CACHE_SIZE_MB", 64))
+TFS_PREDICTION_CACHE_MAX_ENTRY_BYTES = int(
+    os.environ.get("SAGEMAKER_TFS_PREDICTION_CACHE_MAX_ENTRY_BYTES", 64 * 1024)
+)
+# 0 keeps responses until they are evicted or their model is unloaded
+TFS_PREDICTION_CACHE_TTL_SECONDS = float(
+    os.environ.get("SAGEMAKER_TFS_PREDICTION_CACHE_TTL_SECONDS", 300)
+)
+# send predict requests to a model after it is AVAILABLE and the multi-model lock is released,
+# before its load returns
+TFS_WARMUP = os.environ.get("SAGEMAKER_TFS_WARMUP", "true").lower() == "true"
+TFS_WARMUP_ITERATIONS = int(os.environ.get("SAGEMAKER_TFS_WARMUP_ITERATIONS", 3))
 
 logging.basicConfig(
     format="%(process)d %(asctime)s %(levelname)-8s %(message)s", force=True, level=logging.INFO
@@ -57,7 +133,161 @@ logging.basicConfig(
 log = logging.getLogger(__name__)
 
 CUSTOM_ATTRIBUTES_HEADER = "X-Amzn-SageMaker-Custom-Attributes"
-MME_TFS_INSTANCE_STATUS_FILE = "/sagemaker/tfs_instance.pickle"
+
+# Reused by every request of a gunicorn worker instead of opening a new TCP connection to
+# tensorflow_model_server per invocation.
+tfs_rest_sessions = tfs_utils.TfsSessionPool(
+    pool_size=TFS_REST_POOL_SIZE,
+    keepalive=TFS_REST_KEEPALIVE,
+    keepalive_seconds=TFS_REST_KEEPALIVE_SECONDS,
+    stats_log_interval=TFS_REST_STATS_LOG_INTERVAL,
+)
+
+
+# served on /metrics, merged across the gunicorn workers
+service_metrics = metrics.ServiceMetrics()
+
+# created before gunicorn forks, so that every worker maps the same file
+response_cache = (
+    prediction_cache.PredictionCache(
+        TFS_PREDICTION_CACHE_SIZE_MB * 1024 * 1024,
+        TFS_PREDICTION_CACHE_MAX_ENTRY_BYTES,
+        TFS_PREDICTION_CACHE_TTL_SECONDS,
+    )
+    if TFS_PREDICTION_CACHE in ("true", "request")
+    else None
+)
+
+request_coalescer = tfs_utils.RequestCoalescer(
+    lambda uri, data: tfs_rest_sessions.post(uri, data=data, timeout=TFS_COALESCE_TIMEOUT_SECONDS),
+    TFS_COALESCE_WINDOW_MS / 1000.0,
+    TFS_COALESCE_MAX_BATCH_SIZE,
+    TFS_COALESCE_TIMEOUT_SECONDS,
+)
+
+
+# status of the last TFS response of the request a greenlet (or thread) handles, only responses
+# TFS answered with a 200 are cached
+_upstream = threading.local()
+
+
+def _record_upstream_status(response):
+    _upstream.status_code = response.status_code
+    return response
+
+
+def _use_grpc(context):
+    attributes = tfs_utils.parse_custom_attributes_header(context.custom_attributes)
+    protocol = attributes.get("tfs-protocol", TFS_PREDICT_PROTOCOL).lower()
+    # only the gRPC API returns tensors that can be encoded in a binary content type
+    return (
+        (protocol == "grpc" or tfs_grpc.binary_content_type(context.accept_header) is not None)
+        and context.channel is not None
+        and (context.method or "predict") == "predict"
+        and context.request_content_type.split(";")[0].strip() == "application/json"
+    )
+
+
+def _use_prediction_cache(context):
+    if response_cache is None or not context.content_length:
+        return False
+    attributes = tfs_utils.parse_custom_attributes_header(context.custom_attributes)
+    enabled = attributes.get("tfs-cache", "").lower()
+    if TFS_PREDICTION_CACHE == "request":
+        return enabled == "true"
+    return enabled != "false"
+
+
+def _sample_request_log():
+    return REQUEST_LOG_SAMPLE_RATE > 0 and random.random() < REQUEST_LOG_SAMPLE_RATE
+
+
+@contextmanager
+def _observe_upstream(context):
+    start = time.time()
+    try:
+        yield
+    finally:
+        service_metrics.observe(
+            "sagemaker_tfs_upstream_duration_seconds",
+            (("model", context.model_name or TFS_DEFAULT_MODEL_NAME),),
+            time.time() - start,
+        )
+
+
+def predict(data, context):
+    """Sends a predict request to TFS, over gRPC when it is enabled for the request and the
+    payload can be converted to tensors, otherwise to the TFS rest port.
+    :param data: predict request body
+    :param context: context instance that contains tfs_rest_uri and the grpc channel
+    :return: requests.Response or tfs_utils.PredictResponse
+    """
+    with _observe_upstream(context):
+        if _use_grpc(context):
+            try:
+                return _record_upstream_status(
+                    tfs_grpc.predict(
+                        context.channel,
+                        context.model_name or TFS_DEFAULT_MODEL_NAME,
+                        context.model_version,
+                        data,
+                        TFS_GRPC_TIMEOUT_SECONDS,
+                        accept=context.accept_header,
+                    )
+                )
+            except tfs_grpc.UnsupportedRequest as e:
+                log.debug("falling back to rest predict: {}".format(e))
+        return _record_upstream_status(tfs_rest_sessions.post(context.rest_uri, data=data))
+
+
+def stream_predict(data, context):
+    """Forwards a request body to the TFS rest port as it is read from the client.
+    :param data: falcon request stream
+    :param context: context instance that contains tfs_rest_uri and the content length
+    :return: tfs_utils.ResponseStream with the un-decoded TFS response body
+    """
+    # only the time until TFS sent the response headers
+    with _observe_upstream(context):
+        response = tfs_rest_sessions.post(
+            context.rest_uri,
+            data=tfs_utils.StreamingBody(data, context.content_length),
+            stream=True,
+        )
+    return tfs_utils.ResponseStream(response)
+
+
+def binary_predict(data, context):
+    """Sends an npy, npz or serialized PredictRequest body to TFS over gRPC.
+    :param data: falcon request stream
+    :param context: context instance that contains the grpc channel and the content length
+    :return: tfs_utils.PredictResponse in the content type the Accept header asks for
+    """
+    if context.content_length:
+        body = tfs_utils.read_body(data, context.content_length)
+    else:
+        body = data.read()
+    with _observe_upstream(context):
+        return _record_upstream_status(
+            tfs_grpc.predict_binary(
+                context.channel,
+                context.model_name or TFS_DEFAULT_MODEL_NAME,
+                context.model_version,
+                body,
+                tfs_grpc.binary_content_type(context.request_content_type),
+                context.accept_header,
+                TFS_GRPC_TIMEOUT_SECONDS,
+            )
+        )
+
+
+def _response_content_type(response, context):
+    content_type = response.headers.get("Content-Type", "")
+    if tfs_grpc.binary_content_type(content_type):
+        return content_type
+    if tfs_grpc.binary_content_type(context.accept_header):
+        # the prediction fell back to the REST API, or failed
+        return "application/json"
+    return context.accept_header
 
 
 def default_handler(data, context):
@@ -67,11 +297,18 @@ def default_handler(data, context):
     :param context: context instance that contains tfs_rest_uri
     :return: inference response from TFS model server
     """
+    if tfs_grpc.binary_content_type(context.request_content_type):
+        response = binary_predict(data, context)
+        return response.content, _response_content_type(response, context)
+
+    if TFS_STREAM_BODIES and context.content_length and not _use_grpc(context):
+        return stream_predict(data, context), context.accept_header
+
     data = data.read().decode("utf-8")
     if not isinstance(data, str):
         data = json.loads(data)
-    response = requests.post(context.rest_uri, data=data)
-    return response.content, context.accept_header
+    response = predict(data, context)
+    return response.content, _response_content_type(response, context)
 
 
 class TfsInstanceStatus:
@@ -88,13 +325,23 @@ class PythonServiceResource:
     def __init__(self):
         if SAGEMAKER_MULTI_MODEL_ENABLED:
             self._mme_tfs_instances_status: dict[str, [TfsInstanceStatus]] = {}
+            # shared by all gunicorn workers, read without locking on every invocation
+            self._model_registry = ModelRegistry()
+            self._model_registry_generation = None
             self._tfs_ports = self._parse_sagemaker_port_range_mme(SAGEMAKER_TFS_PORT_RANGE)
             self._tfs_available_ports = self._parse_sagemaker_port_range_mme(
                 SAGEMAKER_TFS_PORT_RANGE
             )
+            self._model_usage = ModelUsageTable(self._tfs_ports["rest_port"])
             # If Multi-Model mode is enabled, dependencies/handlers will be imported
             # during the _handle_load_model_post()
             self.model_handlers = {}
+            # model name -> sha256 of its inference.py, None for models without one
+            self._model_script_digests = {}
+            # grpc channels are created on first use, ports are reused after unloading
+            self._channels = {}
+            if MME_SHARED_TFS and MME_LRU_EVICTION:
+                log.warning("LRU eviction is not supported with shared TFS instances, ignoring it")
         else:
             self._tfs_grpc_ports = self._parse_concat_ports(TFS_GRPC_PORTS)
             self._tfs_rest_ports = self._parse_concat_ports(TFS_REST_PORTS)
@@ -105,19 +352,36 @@ class PythonServiceResource:
                 # between each grpc port and channel
                 self._setup_channel(grpc_port)
 
+            # serve.py publishes the instances that are serving, the ports from the environment
+            # (without pids) are the fallback
+            self._tfs_instance_registry = ModelRegistry(
+                TFS_INSTANCE_REGISTRY_FILE, TFS_INSTANCE_REGISTRY_SIZE
+            )
+            self._tfs_instance_registry_generation = None
+            self._tfs_default_instances = [
+                TfsInstanceStatus(rest_port, grpc_port, None)
+                for rest_port, grpc_port in zip(self._tfs_rest_ports, self._tfs_grpc_ports)
+            ]
+            self._tfs_instances = self._tfs_default_instances
+
+        self._router = tfs_utils.LeastOutstandingRouter()
+
+        # sha256 of an inference.py -> its handlers, models that ship the same script share
+        # one imported module
+        self._handler_cache = {}
         self._default_handlers_enabled = False
         if os.path.exists(INFERENCE_SCRIPT_PATH):
             # Single-Model Mode & Multi-Model Mode both use one inference.py
-            self._handler, self._input_handler, self._output_handler = self._import_handlers()
-            self._handlers = self._make_handler(
-                self._handler, self._input_handler, self._output_handler
-            )
+            if PRELOAD_INFERENCE_SCRIPT:
+                self._import_universal_handlers()
+            else:
+                self._handlers = self._lazy_universal_handler
         else:
             self._handlers = default_handler
             self._default_handlers_enabled = True
 
         self._tfs_enable_batching = SAGEMAKER_BATCHING_ENABLED == "true"
-        self._tfs_default_model_name = os.environ.get("TFS_DEFAULT_MODEL_NAME", "None")
+        self._tfs_default_model_name = TFS_DEFAULT_MODEL_NAME
         self._tfs_inter_op_parallelism = os.environ.get("SAGEMAKER_TFS_INTER_OP_PARALLELISM", 0)
         self._tfs_intra_op_parallelism = os.environ.get("SAGEMAKER_TFS_INTRA_OP_PARALLELISM", 0)
         self._tfs_instance_count = int(os.environ.get("SAGEMAKER_TFS_INSTANCE_COUNT", 1))
@@ -127,17 +391,46 @@ class PythonServiceResource:
         )
 
     def on_post(self, req, res, model_name=None):
+        start = time.time()
         if model_name or "invocations" in req.uri:
             self._handle_invocation_post(req, res, model_name)
+            if SAGEMAKER_MULTI_MODEL_ENABLED and model_name not in self._mme_tfs_instances_status:
+                # keep requests for unknown models from creating a label value each
+                model_name = ""
+            labels = (("model", model_name or self._tfs_default_model_name),)
+            service_metrics.observe(
+                "sagemaker_tfs_request_duration_seconds", labels, time.time() - start
+            )
+            service_metrics.inc("sagemaker_tfs_requests_total", labels + self._status_label(res))
         else:
             data = json.loads(req.stream.read().decode("utf-8"))
             self._handle_load_model_post(res, data)
+            service_metrics.observe(
+                "sagemaker_tfs_model_load_duration_seconds",
+                (("model", data["model_name"]),) + self._status_label(res),
+                time.time() - start,
+            )
+
+    def _status_label(self, res):
+        return (("status", str(res.status).split(" ")[0]),)
 
     def _parse_concat_ports(self, concat_ports):
         return concat_ports.split(",")
 
-    def _pick_port(self, ports):
-        return random.choice(ports)
+    def _pick_instance(self, instances):
+        return self._router.pick(
+            instances, lambda instance: instance.pid is None or self._check_pid(instance.pid)
+        )
+
+    def _sync_tfs_instances(self):
+        generation, table = self._tfs_instance_registry.read()
+        if generation == self._tfs_instance_registry_generation:
+            return
+        # instances that are restarting are left out of the table by serve.py, if none is
+        # serving it is still better to try all of them than to fail the request
+        instances = [TfsInstanceStatus(*instance) for instance in table.get(TFS_INSTANCES_KEY, [])]
+        self._tfs_instances = instances or self._tfs_default_instances
+        self._tfs_instance_registry_generation = generation
 
     def _parse_sagemaker_port_range_mme(self, port_range):
         lower, upper = port_range.split("-")
@@ -195,9 +488,12 @@ class PythonServiceResource:
                     tfs_inter_op_parallelism=self._tfs_inter_op_parallelism,
                 )
                 log.info("MME starts tensorflow serving with command: {}".format(cmd))
+                started_at = time.time()
                 p = subprocess.Popen(cmd.split())
 
-                tfs_utils.wait_for_model(rest_port, model_name, self._tfs_wait_time_seconds, p.pid)
+                tfs_utils.wait_for_model(
+                    rest_port, model_name, self._tfs_wait_time_seconds, p.pid, started_at
+                )
 
                 log.info("started tensorflow serving (pid: %d)", p.pid)
 
@@ -213,32 +509,7 @@ class PythonServiceResource:
                     "pid": p.pid,
                 }
             except MultiModelException as multi_model_exception:
-                if multi_model_exception.code == 409:
-                    return {
-                        "status": falcon.HTTP_409,
-                        "body": multi_model_exception.msg,
-                        "pid": multi_model_exception.pid,
-                    }
-                elif multi_model_exception.code == 408:
-                    cpu_memory_usage = tfs_utils.get_cpu_memory_util()
-                    log.info(f"cpu memory usage {cpu_memory_usage}")
-                    if cpu_memory_usage > 70:
-                        return {
-                            "status": falcon.HTTP_507,
-                            "body": "Memory exhausted: not enough memory to start TFS instance",
-                            "pid": multi_model_exception.pid,
-                        }
-                    return {
-                        "status": falcon.HTTP_408,
-                        "body": multi_model_exception.msg,
-                        "pid": multi_model_exception.pid,
-                    }
-                else:
-                    return {
-                        "status": falcon.HTTP_500,
-                        "body": multi_model_exception.msg,
-                        "pid": multi_model_exception.pid,
-                    }
+                return self._load_error_response(multi_model_exception)
             except FileExistsError as e:
                 return {
                     "status": falcon.HTTP_409,
@@ -258,19 +529,200 @@ class PythonServiceResource:
                         "status": falcon.HTTP_500,
                         "body": os_error.strerror,
                     }
+        else:
+            return self._model_not_found_response(model_name, base_path)
+
+    def _warm_up(self, rest_port, model_name, base_path):
+        if not TFS_WARMUP:
+            return
+        result = warmup.warm_up(
+            rest_port, model_name, base_path, TFS_WARMUP_ITERATIONS, self._tfs_wait_time_seconds
+        )
+        service_metrics.observe(
+            "sagemaker_tfs_model_warmup_duration_seconds",
+            (("model", model_name), ("source", result.source)),
+            result.seconds,
+        )
+
+    def _load_error_response(self, multi_model_exception):
+        if multi_model_exception.code == 409:
+            return {
+                "status": falcon.HTTP_409,
+                "body": multi_model_exception.msg,
+                "pid": multi_model_exception.pid,
+            }
+        elif multi_model_exception.code == 408:
+            cpu_memory_usage = tfs_utils.get_cpu_memory_util()
+            log.info(f"cpu memory usage {cpu_memory_usage}")
+            if cpu_memory_usage > MME_MEMORY_THRESHOLD_PERCENT:
+                return {
+                    "status": falcon.HTTP_507,
+                    "body": "Memory exhausted: not enough memory to start TFS instance",
+                    "pid": multi_model_exception.pid,
+                }
+            return {
+                "status": falcon.HTTP_408,
+                "body": multi_model_exception.msg,
+                "pid": multi_model_exception.pid,
+            }
         else:
             return {
-                "status": falcon.HTTP_404,
+                "status": falcon.HTTP_500,
+                "body": multi_model_exception.msg,
+                "pid": multi_model_exception.pid,
+            }
+
+    def _model_not_found_response(self, model_name, base_path):
+        return {
+            "status": falcon.HTTP_404,
+            "body": json.dumps(
+                {
+                    "error": "Could not find valid base path {} for servable {}".format(
+                        base_path, model_name
+                    )
+                }
+            ),
+        }
+
+    def _read_shared_tfs_state(self):
+        """Returns the shared TFS instances and the models they serve, call it under lock()."""
+        try:
+            with open(MME_SHARED_TFS_STATE_FILE, encoding="utf8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"instances": [], "models": {}}
+
+    def _write_shared_tfs_state(self, state):
+        os.makedirs(MME_SHARED_TFS_DIR, exist_ok=True)
+        with open(MME_SHARED_TFS_STATE_FILE, "w", encoding="utf8") as f:
+            json.dump(state, f)
+
+    def _write_shared_tfs_config(self, index, models):
+        # a restarted instance loads the models from this file
+        tfs_config_file = os.path.join(MME_SHARED_TFS_DIR, str(index), "model-config.cfg")
+        os.makedirs(os.path.dirname(tfs_config_file), exist_ok=True)
+        with open(tfs_config_file, "w", encoding="utf8") as f:
+            f.write(tfs_utils.create_tfs_config_models(models))
+        return tfs_config_file
+
+    def _start_shared_tfs_instances(self, state):
+        """Starts the shared TFS instances that are not running, call it under lock()."""
+        instances = state["instances"]
+        for i in range(self._tfs_instance_count):
+            rest_port = self._tfs_ports["rest_port"][i]
+            grpc_port = self._tfs_ports["grpc_port"][i]
+            if i == len(instances):
+                instances.append([rest_port, grpc_port, None])
+            pid = instances[i][2]
+            if pid is None or not self._check_pid(pid):
+                tfs_config_file = self._write_shared_tfs_config(i, state["models"])
+                batching_config_file = os.path.join(
+                    MME_SHARED_TFS_DIR, str(i), "batching-config.cfg"
+                )
+                if self._tfs_enable_batching:
+                    tfs_utils.create_batching_config(batching_config_file)
+                cmd = tfs_utils.tfs_command(
+                    grpc_port,
+                    rest_port,
+                    tfs_config_file,
+                    self._tfs_enable_batching,
+                    batching_config_file,
+                    tfs_intra_op_parallelism=self._tfs_intra_op_parallelism,
+                    tfs_inter_op_parallelism=self._tfs_inter_op_parallelism,
+                )
+                log.info("MME starts shared tensorflow serving with command: {}".format(cmd))
+                pid = subprocess.Popen(cmd.split()).pid
+                instances[i] = [rest_port, grpc_port, pid]
+
+                # TFS only starts its gRPC server once the models in its config are loaded
+                self._setup_channel(grpc_port)
+                try:
+                    grpc.channel_ready_future(self._channels[grpc_port]).result(
+                        timeout=self._tfs_wait_time_seconds
+                    )
+                except grpc.FutureTimeoutError:
+                    raise MultiModelException(
+                        408, "Timed out after {} seconds".format(self._tfs_wait_time_seconds), pid
+                    )
+                log.info("started shared tensorflow serving (pid: %d)", pid)
+
+    def _reload_shared_tfs(self, state, models):
+        """Makes every shared TFS instance serve exactly the given models, call it under lock()."""
+        for i, (_, grpc_port, _) in enumerate(state["instances"]):
+            self._write_shared_tfs_config(i, models)
+            self._setup_channel(grpc_port)
+            tfs_grpc.reload_config(self._channels[grpc_port], models, self._tfs_wait_time_seconds)
+        state["models"] = models
+
+    def _load_model_shared(self, model_name, base_path):
+        """Loads a model into every shared TFS instance, call it under lock()."""
+        if not self.validate_model_dir(base_path):
+            return self._model_not_found_response(model_name, base_path)
+
+        state = self._read_shared_tfs_state()
+        loaded_models = state["models"]
+        try:
+            self._import_custom_modules(model_name)
+            self._start_shared_tfs_instances(state)
+            started_at = time.time()
+            self._reload_shared_tfs(state, dict(loaded_models, **{model_name: base_path}))
+            for rest_port, _, pid in state["instances"]:
+                tfs_utils.wait_for_model(
+                    rest_port, model_name, self._tfs_wait_time_seconds, pid, started_at
+                )
+            response = {
+                "status": falcon.HTTP_200,
                 "body": json.dumps(
                     {
-                        "error": "Could not find valid base path {} for servable {}".format(
-                            base_path, model_name
-                        )
+                        "success": "Successfully loaded model {} into {} shared TFS "
+                        "instances.".format(model_name, len(state["instances"]))
                     }
                 ),
+                "warmup_ports": [rest_port for rest_port, _, _ in state["instances"]],
             }
+        except MultiModelException as multi_model_exception:
+            response = self._load_error_response(multi_model_exception)
+        except OSError as os_error:
+            log.error(f"failed to load model with exception {os_error}")
+            if os_error.errno == 12:
+                response = {
+                    "status": falcon.HTTP_507,
+                    "body": "Memory exhausted: not enough memory to start TFS instance",
+                }
+            else:
+                response = {"status": falcon.HTTP_500, "body": os_error.strerror}
 
-    def _handle_load_model_post(self, res, data):  # noqa: C901
+        if response["status"] != falcon.HTTP_200:
+            log.info(f"Failed to load model : {model_name}, Starting to cleanup...")
+            self._forget_custom_modules(model_name)
+            try:
+                self._reload_shared_tfs(state, loaded_models)
+            except MultiModelException as e:
+                log.error("failed to restore the shared TFS config: {}".format(e.msg))
+                state["models"] = loaded_models
+        self._write_shared_tfs_state(state)
+        # instances that were restarted have new pids, every model they serve has to see them
+        for name in state["models"]:
+            self._mme_tfs_instances_status[name] = [
+                TfsInstanceStatus(*instance) for instance in state["instances"]
+            ]
+        return response
+
+    def _unload_model_shared(self, model_name):
+        state = self._read_shared_tfs_state()
+        models = {name: path for name, path in state["models"].items() if name != model_name}
+        self._reload_shared_tfs(state, models)
+        self._write_shared_tfs_state(state)
+
+    def _handle_load_model_post(self, res, data):
+        warmup_ports = self._load_model_under_lock(res, data)
+        # outside of lock(), inference on a large model would hold up every other load and unload
+        for rest_port in warmup_ports:
+            self._warm_up(rest_port, data["model_name"], data["url"])
+
+    def _load_model_under_lock(self, res, data):  # noqa: C901
+        """Loads a model and sets the response, returns the rest ports of the TFS instances to
+        warm up before the response is sent."""
         with lock():
             model_name = data["model_name"]
             base_path = data["url"]
@@ -284,10 +736,21 @@ class PythonServiceResource:
             if model_name in self._mme_tfs_instances_status:
                 res.status = falcon.HTTP_409
                 res.body = json.dumps({"error": "Model {} is already loaded.".format(model_name)})
-                return
+                return []
+
+            if MME_SHARED_TFS:
+                response = self._load_model_shared(model_name, base_path)
+                self._upload_mme_instance_status()
+                res.status = response["status"]
+                res.body = response["body"]
+                return response.get("warmup_ports", [])
+
+            if MME_LRU_EVICTION:
+                self._evict_models_for_load(base_path)
 
             is_load_successful = True
             response = {}
+            warmup_ports = []
             for i in range(self._tfs_instance_count):
                 # check if there are available ports
                 if not self._ports_available():
@@ -311,27 +774,46 @@ class PythonServiceResource:
                     log.info(f"Failed to load model : {model_name}")
                     is_load_successful = False
                     break
+                warmup_ports.append(tfs_rest_port)
 
             if not is_load_successful:
                 log.info(f"Failed to load model : {model_name}, Starting to cleanup...")
                 self._delete_model(model_name)
                 self._remove_model_config(model_name)
+                self._mme_tfs_instances_status.pop(model_name, None)
+                self._forget_custom_modules(model_name)
+                warmup_ports = []
             else:
+                for tfs_status in self._mme_tfs_instances_status[model_name]:
+                    self._model_usage.touch(tfs_status.rest_port)
                 self._upload_mme_instance_status()
 
             res.status = response["status"]
             res.body = response["body"]
+            return warmup_ports
+
+    def _import_universal_handlers(self):
+        self._handler, self._input_handler, self._output_handler = self._import_handlers()
+        self._handlers = self._make_handler(
+            self._handler, self._input_handler, self._output_handler
+        )
+
+    def _lazy_universal_handler(self, data, context):
+        self._import_universal_handlers()
+        return self._handlers(data, context)
 
     def _import_custom_modules(self, model_name):
         inference_script_path = "/opt/ml/models/{}/model/code/inference.py".format(model_name)
         python_lib_path = "/opt/ml/models/{}/model/code/lib".format(model_name)
+        self._model_script_digests[model_name] = None
         if os.path.exists(python_lib_path):
             log.info(
                 "Add Python code library for the model {} found at path {}.".format(
                     model_name, python_lib_path
                 )
             )
-            sys.path.append(python_lib_path)
+            if python_lib_path not in sys.path:
+                sys.path.append(python_lib_path)
         else:
             log.info(
                 "Python code library for the model {} not found at path {}.".format(
@@ -344,9 +826,13 @@ class PythonServiceResource:
                     model_name, inference_script_path
                 )
             )
-            handler, input_handler, output_handler = self._import_handlers(inference_script_path)
+            digest = self._script_digest(inference_script_path)
+            handler, input_handler, output_handler = self._import_handlers(
+                inference_script_path, digest
+            )
             model_handlers = self._make_handler(handler, input_handler, output_handler)
             self.model_handlers[model_name] = model_handlers
+            self._model_script_digests[model_name] = digest
         else:
             log.info(
                 "Model-specific inference script for the model {} not found at path {}.".format(
@@ -354,16 +840,22 @@ class PythonServiceResource:
                 )
             )
 
+    def _forget_custom_modules(self, model_name):
+        """Drops the handlers and the code library path of a model that is no longer loaded."""
+        self.model_handlers.pop(model_name, None)
+        digest = self._model_script_digests.pop(model_name, None)
+        if digest is not None and digest not in self._model_script_digests.values():
+            self._handler_cache.pop(digest, None)
+        python_lib_path = "/opt/ml/models/{}/model/code/lib".format(model_name)
+        if python_lib_path in sys.path:
+            sys.path.remove(python_lib_path)
+
     def _handle_invocation_post(self, req, res, model_name=None):
+        log_request = _sample_request_log()
         if SAGEMAKER_MULTI_MODEL_ENABLED:
             if model_name:
-                if self._gunicorn_workers > 1:
-                    if model_name not in self._mme_tfs_instances_status or not self._check_pid(
-                        self._mme_tfs_instances_status[model_name][0].pid
-                    ):
-                        with lock():
-                            self._sync_local_mme_instance_status()
-                        self._sync_model_handlers()
+                if self._sync_local_mme_instance_status():
+                    self._sync_model_handlers()
 
                 if model_name not in self._mme_tfs_instances_status:
                     res.status = falcon.HTTP_404
@@ -372,32 +864,31 @@ class PythonServiceResource:
                     )
                     return
                 else:
-                    log.info("model name: {}".format(model_name))
-                    rest_ports = [
-                        status.rest_port for status in self._mme_tfs_instances_status[model_name]
-                    ]
-                    rest_port = self._pick_port(rest_ports)
-                    log.info("rest port: {}".format(str(rest_port)))
-                    grpc_ports = [
-                        status.grpc_port for status in self._mme_tfs_instances_status[model_name]
-                    ]
-                    grpc_port = grpc_ports[rest_ports.index(rest_port)]
-                    log.info("grpc port: {}".format(str(grpc_port)))
+                    instance = self._pick_instance(self._mme_tfs_instances_status[model_name])
+                    rest_port, grpc_port = instance.rest_port, instance.grpc_port
+                    self._model_usage.touch(rest_port)
+                    if log_request:
+                        log.info("model name: {}".format(model_name))
+                        log.info("rest port: {}".format(str(rest_port)))
+                        log.info("grpc port: {}".format(str(grpc_port)))
+                    self._setup_channel(grpc_port)
                     data, context = tfs_utils.parse_request(
                         req,
                         rest_port,
                         grpc_port,
                         self._tfs_default_model_name,
                         model_name=model_name,
+                        channel=self._channels[grpc_port],
                     )
             else:
                 res.status = falcon.HTTP_400
                 res.body = json.dumps({"error": "Invocation request does not contain model name."})
                 return
         else:
-            # Randomly pick port used for routing incoming request.
-            grpc_port = self._pick_port(self._tfs_grpc_ports)
-            rest_port = self._pick_port(self._tfs_rest_ports)
+            # Pick the less loaded of two random instances for routing incoming request.
+            self._sync_tfs_instances()
+            instance = self._pick_instance(self._tfs_instances)
+            rest_port, grpc_port = instance.rest_port, instance.grpc_port
             data, context = tfs_utils.parse_request(
                 req,
                 rest_port,
@@ -405,39 +896,131 @@ class PythonServiceResource:
                 self._tfs_default_model_name,
                 channel=self._channels[grpc_port],
             )
+        if log_request:
+            log.info(
+                "tfs uri: {}, custom attributes: {}".format(
+                    context.rest_uri, context.custom_attributes
+                )
+            )
 
         try:
             res.status = falcon.HTTP_200
             handlers = self._handlers
             if SAGEMAKER_MULTI_MODEL_ENABLED and model_name in self.model_handlers:
-                log.info(
-                    "Model-specific inference script for the model {} exists, importing handlers.".format(
-                        model_name
+                if log_request:
+                    log.info(
+                        "Model-specific inference script for the model {} exists, importing handlers.".format(
+                            model_name
+                        )
                     )
-                )
                 handlers = self.model_handlers[model_name]
-            elif not self._default_handlers_enabled:
+            elif log_request and not self._default_handlers_enabled:
                 log.info(
                     "Universal inference script exists at path {}, importing handlers.".format(
                         INFERENCE_SCRIPT_PATH
                     )
                 )
-            else:
+            elif log_request:
                 log.info(
                     "Model-specific inference script and universal inference script both do not exist, using default handlers."
                 )
-            res.body, res.content_type = handlers(data, context)
+            labels = (("model", context.model_name or self._tfs_default_model_name),)
+            service_metrics.observe(
+                "sagemaker_tfs_request_size_bytes", labels, context.content_length or 0
+            )
+            cache_key = None
+            if _use_prediction_cache(context):
+                request_body = tfs_utils.read_body(data, context.content_length)
+                cache_key = prediction_cache.cache_key(
+                    (
+                        context.model_name or self._tfs_default_model_name,
+                        context.model_version,
+                        context.method,
+                        context.request_content_type,
+                        context.accept_header,
+                        context.custom_attributes,
+                    ),
+                    request_body,
+                )
+                cache_generation = response_cache.generation()
+                cached = response_cache.get(cache_key)
+                service_metrics.inc(
+                    "sagemaker_tfs_prediction_cache_requests_total",
+                    labels + (("result", "miss" if cached is None else "hit"),),
+                )
+                if cached is not None:
+                    res.content_type, res.body = cached
+                    return
+                if handlers is default_handler or TFS_HANDLER_BODY != "memoryview":
+                    request_body = io.BytesIO(request_body)
+                data = request_body
+            elif handlers is not default_handler and TFS_HANDLER_BODY == "memoryview":
+                data = tfs_utils.read_body(data, context.content_length)
+            in_flight_labels = (("rest_port", instance.rest_port),)
+            _upstream.status_code = None
+            handler_start = time.time()
+            try:
+                with self._router.track(instance):
+                    service_metrics.set(
+                        "sagemaker_tfs_in_flight_requests",
+                        in_flight_labels,
+                        self._router.in_flight(instance.rest_port),
+                    )
+                    body, res.content_type = handlers(data, context)
+            finally:
+                service_metrics.observe(
+                    "sagemaker_tfs_handler_duration_seconds", labels, time.time() - handler_start
+                )
+                service_metrics.set(
+                    "sagemaker_tfs_in_flight_requests",
+                    in_flight_labels,
+                    self._router.in_flight(instance.rest_port),
+                )
+            if isinstance(body, tfs_utils.ResponseStream):
+                res.set_stream(body, body.content_length)
+            else:
+                res.body = body
+                # custom handlers that call TFS themselves leave the status unknown
+                if cache_key is not None and _upstream.status_code == 200:
+                    self._cache_prediction(
+                        cache_key, context, res.content_type, body, cache_generation
+                    )
         except Exception as e:  # pylint: disable=broad-except
             log.exception("exception handling request: {}".format(e))
             res.status = falcon.HTTP_500
             res.body = json.dumps({"error": str(e)}).encode("utf-8")  # pylint: disable=E1101
 
+    def _cache_prediction(self, key, context, content_type, body, generation):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        if not isinstance(body, (bytes, bytearray)):
+            return
+        model_name = context.model_name or self._tfs_default_model_name
+        if response_cache.put(key, model_name, content_type, body, generation):
+            service_metrics.inc("sagemaker_tfs_prediction_cache_evictions_total")
+
     def _setup_channel(self, grpc_port):
         if grpc_port not in self._channels:
             log.info("Creating grpc channel for port: %s", grpc_port)
-            self._channels[grpc_port] = grpc.insecure_channel("localhost:{}".format(grpc_port))
+            # TFS accepts messages of any size, match it so large predictions are not rejected
+            self._channels[grpc_port] = grpc.insecure_channel(
+                "localhost:{}".format(grpc_port),
+                options=[
+                    ("grpc.max_send_message_length", -1),
+                    ("grpc.max_receive_message_length", -1),
+                ],
+            )
+
+    def _script_digest(self, inference_script):
+        with open(inference_script, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def _import_handlers(self, inference_script=INFERENCE_SCRIPT_PATH, digest=None):
+        digest = digest or self._script_digest(inference_script)
+        if digest in self._handler_cache:
+            log.info("Reusing handlers of an identical script for {}".format(inference_script))
+            return self._handler_cache[digest]
 
-    def _import_handlers(self, inference_script=INFERENCE_SCRIPT_PATH):
         spec = importlib.util.spec_from_file_location("inference", inference_script)
         inference = importlib.util.module_from_spec(spec)
         spec.loader.exec_module(inference)
@@ -451,7 +1034,9 @@ class PythonServiceResource:
         else:
             raise NotImplementedError("Handlers are not implemented correctly in user script.")
 
-        return _custom_handler, _custom_input_handler, _custom_output_handler
+        handlers = _custom_handler, _custom_input_handler, _custom_output_handler
+        self._handler_cache[digest] = handlers
+        return handlers
 
     def _make_handler(self, custom_handler, custom_input_handler, custom_output_handler):
         if custom_handler:
@@ -459,50 +1044,72 @@ class PythonServiceResource:
 
         def handler(data, context):
             processed_input = custom_input_handler(data, context)
-            response = requests.post(context.rest_uri, data=processed_input)
+            response = None
+            if TFS_COALESCE_REQUESTS:
+                response = self._coalesced_predict(processed_input, context)
+            if response is None:
+                response = predict(processed_input, context)
             return custom_output_handler(response, context)
 
         return handler
 
+    def _coalesced_predict(self, processed_input, context):
+        """Predicts with concurrent requests, returns None if the input can not be batched."""
+        try:
+            payload = json.loads(processed_input)
+        except (TypeError, ValueError):
+            return None
+        context = context._replace(model_name=context.model_name or self._tfs_default_model_name)
+        key = request_coalescer.batch_key(payload, context)
+        if key is None:
+            return None
+        return _record_upstream_status(request_coalescer.predict(key, payload, context))
+
     def on_get(self, req, res, model_name=None):  # pylint: disable=W0613
-        with lock():
-            self._sync_local_mme_instance_status()
-            if model_name is None:
-                models_info = {}
-                uri = "http://localhost:{}/v1/models/{}"
-                for model, tfs_instance_status in self._mme_tfs_instances_status.items():
-                    try:
-                        info = json.loads(
-                            requests.get(
-                                uri.format(tfs_instance_status[0].rest_port, model)
-                            ).content
-                        )
-                        models_info[model] = info
-                    except ValueError as e:
-                        log.exception("exception handling request: {}".format(e))
-                        res.status = falcon.HTTP_500
-                        res.body = json.dumps({"error": str(e)}).encode("utf-8")
-                res.status = falcon.HTTP_200
-                res.body = json.dumps(models_info)
+        self._sync_local_mme_instance_status()
+        if model_name is None:
+            models_info = {}
+            uri = "http://localhost:{}/v1/models/{}"
+            for model, tfs_instance_status in self._mme_tfs_instances_status.items():
+                try:
+                    info = json.loads(
+                        requests.get(uri.format(tfs_instance_status[0].rest_port, model)).content
+                    )
+                    models_info[model] = info
+                except ValueError as e:
+                    log.exception("exception handling request: {}".format(e))
+                    res.status = falcon.HTTP_500
+                    res.body = json.dumps({"error": str(e)}).encode("utf-8")
+            res.status = falcon.HTTP_200
+            res.body = json.dumps(models_info)
+        else:
+            if model_name not in self._mme_tfs_instances_status:
+                res.status = falcon.HTTP_404
+                res.body = json.dumps(
+                    {"error": "Model {} is loaded yet.".format(model_name)}
+                ).encode("utf-8")
             else:
-                if model_name not in self._mme_tfs_instances_status:
-                    res.status = falcon.HTTP_404
-                    res.body = json.dumps(
-                        {"error": "Model {} is loaded yet.".format(model_name)}
-                    ).encode("utf-8")
-                else:
-                    port = self._mme_tfs_instances_status[model_name].rest_port
-                    uri = "http://localhost:{}/v1/models/{}".format(port, model_name)
-                    try:
-                        info = requests.get(uri)
-                        res.status = falcon.HTTP_200
-                        res.body = json.dumps({"model": info}).encode("utf-8")
-                    except ValueError as e:
-                        log.exception("exception handling GET models request.")
-                        res.status = falcon.HTTP_500
-                        res.body = json.dumps({"error": str(e)}).encode("utf-8")
+                port = self._mme_tfs_instances_status[model_name].rest_port
+                uri = "http://localhost:{}/v1/models/{}".format(port, model_name)
+                try:
+                    info = requests.get(uri)
+                    res.status = falcon.HTTP_200
+                    res.body = json.dumps({"model": info}).encode("utf-8")
+                except ValueError as e:
+                    log.exception("exception handling GET models request.")
+                    res.status = falcon.HTTP_500
+                    res.body = json.dumps({"error": str(e)}).encode("utf-8")
 
     def on_delete(self, req, res, model_name):  # pylint: disable=W0613
+        start = time.time()
+        self._handle_delete(res, model_name)
+        service_metrics.observe(
+            "sagemaker_tfs_model_unload_duration_seconds",
+            (("model", model_name),) + self._status_label(res),
+            time.time() - start,
+        )
+
+    def _handle_delete(self, res, model_name):
         with lock():
             self._sync_local_mme_instance_status()
             if model_name not in self._mme_tfs_instances_status:
@@ -510,9 +1117,7 @@ class PythonServiceResource:
                 res.body = json.dumps({"error": "Model {} is not loaded yet".format(model_name)})
             else:
                 try:
-                    self._delete_model(model_name)
-                    self._remove_model_config(model_name)
-                    del self._mme_tfs_instances_status[model_name]
+                    self._unload_model(model_name)
                     self._upload_mme_instance_status()
                     res.status = falcon.HTTP_200
                     res.body = json.dumps(
@@ -521,12 +1126,103 @@ class PythonServiceResource:
                 except OSError as error:
                     res.status = falcon.HTTP_500
                     res.body = json.dumps({"error": str(error)}).encode("utf-8")
+                except MultiModelException as error:
+                    res.status = falcon.HTTP_500
+                    res.body = json.dumps({"error": error.msg}).encode("utf-8")
+
+    def _unload_model(self, model_name):
+        self._forget_custom_modules(model_name)
+        self._delete_model(model_name)
+        self._remove_model_config(model_name)
+        del self._mme_tfs_instances_status[model_name]
+
+    def _evict_models_for_load(self, base_path):
+        """Unloads least recently used models until a new model fits in the port and memory
+        budgets. Must be called under lock()."""
+        evicted = False
+        while True:
+            reason = self._load_budget_exceeded(base_path)
+            if reason is None or not self._mme_tfs_instances_status:
+                break
+
+            victim = min(
+                self._mme_tfs_instances_status,
+                key=lambda name: max(
+                    self._model_usage.last_used(tfs_status.rest_port)
+                    for tfs_status in self._mme_tfs_instances_status[name]
+                ),
+            )
+            pids = [tfs_status.pid for tfs_status in self._mme_tfs_instances_status[victim]]
+            try:
+                self._unload_model(victim)
+            except ProcessLookupError:
+                # its TFS process already died, freeing the ports is all that is left to do
+                self._remove_model_config(victim)
+                self._mme_tfs_instances_status.pop(victim, None)
+                self._forget_custom_modules(victim)
+            self._wait_for_exit(pids)
+            self._update_ports_available()
+            self._model_usage.record_eviction(reason)
+            service_metrics.inc("sagemaker_tfs_model_evictions_total", (("reason", reason),))
+            evicted = True
+            log.info(
+                "evicted least recently used model {} ({} budget exceeded), evictions: {}".format(
+                    victim, reason, self._model_usage.evictions()
+                )
+            )
+
+        if evicted:
+            self._upload_mme_instance_status()
+
+    def _load_budget_exceeded(self, base_path):
+        """Returns why a new model does not fit ("ports" or "memory"), None if it does."""
+        needed_instances = self._tfs_instance_count + sum(
+            len(status) for status in self._mme_tfs_instances_status.values()
+        )
+        if (
+            len(self._tfs_available_ports["rest_port"]) < self._tfs_instance_count
+            or len(self._tfs_available_ports["grpc_port"]) < self._tfs_instance_count
+            or (MME_MAX_TFS_INSTANCES and needed_instances > MME_MAX_TFS_INSTANCES)
+        ):
+            return "ports"
+
+        if tfs_utils.get_cpu_memory_util() > MME_MEMORY_THRESHOLD_PERCENT:
+            return "memory"
+        if MME_TFS_MEMORY_BUDGET_MB:
+            used = sum(
+                tfs_utils.get_process_rss_mb(tfs_status.pid)
+                for status in self._mme_tfs_instances_status.values()
+                for tfs_status in status
+            )
+            # the size of the model files is the best estimate before the model is loaded
+            needed = tfs_utils.get_directory_size_mb(base_path) * self._tfs_instance_count
+            if used + needed > MME_TFS_MEMORY_BUDGET_MB:
+                return "memory"
+        return None
+
+    def _wait_for_exit(self, pids, timeout_seconds=5):
+        # memory of a killed process is only released once it exited
+        deadline = time.time() + timeout_seconds
+        while time.time() < deadline and any(tfs_utils.get_process_rss_mb(pid) for pid in pids):
+            time.sleep(0.05)
 
     def _delete_model(self, model_name):
         if model_name not in self._mme_tfs_instances_status:
             return
-        for tfs_status in self._mme_tfs_instances_status[model_name]:
-            os.kill(tfs_status.pid, signal.SIGKILL)
+        if response_cache is not None:
+            # before the TFS instances go away, a model loaded again under the name may differ
+            response_cache.invalidate(model_name)
+        if MME_SHARED_TFS:
+            # the TFS instances, their connections and channels keep serving the other models
+            self._unload_model_shared(model_name)
+        else:
+            for tfs_status in self._mme_tfs_instances_status[model_name]:
+                os.kill(tfs_status.pid, signal.SIGKILL)
+                tfs_rest_sessions.close(tfs_status.rest_port)
+                channel = self._channels.pop(tfs_status.grpc_port, None)
+                if channel is not None:
+                    channel.close()
+        tfs_grpc.clear_signature_cache(model_name)
 
     def _remove_model_config(self, model_name):
         shutil.rmtree("/sagemaker/tfs-config/{}".format(model_name), ignore_errors=True)
@@ -555,29 +1251,47 @@ class PythonServiceResource:
         return False
 
     def _upload_mme_instance_status(self):
+        """Publishes the local instance status to the model registry, call it under lock()."""
+        self._model_registry_generation = self._model_registry.write(
+            {
+                model_name: [
+                    [status.rest_port, status.grpc_port, status.pid] for status in status_list
+                ]
+                for model_name, status_list in self._mme_tfs_instances_status.items()
+            }
+        )
         log.info(
-            "uploaded mme instance status file with content: {}".format(
-                self._mme_tfs_instances_status
+            "uploaded mme instance status (generation {}) with content: {}".format(
+                self._model_registry_generation, self._mme_tfs_instances_status
             )
         )
-        with open(MME_TFS_INSTANCE_STATUS_FILE, "wb") as handle:
-            pickle.dump(self._mme_tfs_instances_status, handle, protocol=pickle.HIGHEST_PROTOCOL)
 
     def _sync_local_mme_instance_status(self):
-        if not os.path.exists(MME_TFS_INSTANCE_STATUS_FILE):
-            log.info("mme instance status file does not found.")
-            return
-        with open(MME_TFS_INSTANCE_STATUS_FILE, "rb") as handle:
-            self._mme_tfs_instances_status = pickle.load(handle)
+        """Refreshes the local instance status from the model registry.
+
+        :return: True if another worker changed the registry since the last sync
+        """
+        generation, models = self._model_registry.read()
+        if generation == self._model_registry_generation:
+            return False
+        self._mme_tfs_instances_status = {
+            model_name: [TfsInstanceStatus(*instance) for instance in instances]
+            for model_name, instances in models.items()
+        }
+        self._model_registry_generation = generation
         log.info(
-            "updated local mme instance status with content: {}".format(
-                self._mme_tfs_instances_status
+            "updated local mme instance status (generation {}) with content: {}".format(
+                generation, self._mme_tfs_instances_status
             )
         )
+        return True
 
     def _sync_model_handlers(self):
-        for model_name, _ in self._mme_tfs_instances_status.items():
-            if model_name not in self.model_handlers:
+        for model_name in list(self._model_script_digests):
+            if model_name not in self._mme_tfs_instances_status:
+                self._forget_custom_modules(model_name)
+        for model_name in self._mme_tfs_instances_status:
+            if model_name not in self._model_script_digests:
                 self._import_custom_modules(model_name)
 
     def _check_pid(self, pid):
@@ -595,14 +1309,23 @@ class PingResource:
         res.status = falcon.HTTP_200
 
 
+class MetricsResource:
+    def on_get(self, req, res):  # pylint: disable=W0613
+        res.status = falcon.HTTP_200
+        res.content_type = "text/plain; version=0.0.4"
+        res.body = service_metrics.render()
+
+
 class ServiceResources:
     def __init__(self):
         self._enable_model_manager = SAGEMAKER_MULTI_MODEL_ENABLED
         self._python_service_resource = PythonServiceResource()
         self._ping_resource = PingResource()
+        self._metrics_resource = MetricsResource()
 
     def add_routes(self, application):
         application.add_route("/ping", self._ping_resource)
+        application.add_route("/metrics", self._metrics_resource)
         application.add_route("/invocations", self._python_service_resource)
 
         if self._enable_model_manager:
@@ -686,4 +1409,7 @@ if __name__ == "__main__":
         def load(self):
             return self.application
 
+    # move everything imported so far, including a preloaded inference.py, out of the collected
+    # generations, so that garbage collections in the workers do not copy the shared pages
+    gc.freeze()
     StandaloneApplication(app, options).run()
@@ -10,15 +10,28 @@
 # distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
+import autotune
 import boto3
 import logging
+import metrics
 import os
 import re
 import signal
+import socket
 import subprocess
+import threading
+import time
 import tfs_utils
+import warmup
 
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from multi_model_utils import (
+    TFS_INSTANCE_REGISTRY_FILE,
+    TFS_INSTANCE_REGISTRY_SIZE,
+    TFS_INSTANCES_KEY,
+    ModelRegistry,
+)
 
 logging.basicConfig(
     format="%(process)d %(asctime)s %(levelname)-8s %(message)s", force=True, level=logging.INFO
@@ -29,6 +42,8 @@ JS_PING = "js_content tensorflowServing.ping"
 JS_INVOCATIONS = "js_content tensorflowServing.invocations"
 GUNICORN_PING = "proxy_pass http://gunicorn_upstream/ping"
 GUNICORN_INVOCATIONS = "proxy_pass http://gunicorn_upstream/invocations"
+GUNICORN_METRICS = "proxy_pass http://gunicorn_upstream/metrics"
+NO_METRICS = """return 404 '{"error": "Not Found"}'"""
 CODE_DIR = (
     "/opt/ml/code"
     if os.environ.get("SAGEMAKER_MULTI_MODEL", "False").lower() == "true"
@@ -37,6 +52,9 @@ CODE_DIR = (
 PYTHON_LIB_PATH = os.path.join(CODE_DIR, "lib")
 REQUIREMENTS_PATH = os.path.join(CODE_DIR, "requirements.txt")
 INFERENCE_PATH = os.path.join(CODE_DIR, "inference.py")
+GUNICORN_SOCKET = "/tmp/gunicorn.sock"
+READINESS_POLL_INTERVAL_SECONDS = 0.05
+NGINX_WAIT_TIME_SECONDS = 30
 
 
 class ServiceManager(object):
@@ -52,23 +70,38 @@ class ServiceManager(object):
         self._nginx_http_port = os.environ.get("SAGEMAKER_BIND_TO_PORT", "8080")
         self._nginx_loglevel = os.environ.get("SAGEMAKER_TFS_NGINX_LOGLEVEL", "error")
         self._tfs_default_model_name = os.environ.get("SAGEMAKER_TFS_DEFAULT_MODEL_NAME", "None")
+        self._tfs_default_model_base_path = None
         self._sagemaker_port_range = os.environ.get("SAGEMAKER_SAFE_PORT_RANGE", None)
         self._gunicorn_workers = os.environ.get("SAGEMAKER_GUNICORN_WORKERS", 1)
         self._gunicorn_threads = os.environ.get("SAGEMAKER_GUNICORN_THREADS", 1)
         self._gunicorn_loglevel = os.environ.get("SAGEMAKER_GUNICORN_LOGLEVEL", "info")
         self._tfs_config_path = "/sagemaker/model-config.cfg"
         self._tfs_batching_config_path = "/sagemaker/batching-config.cfg"
+        self._num_gpus = None
+        self._tfs_instance_registry = None
+        self._tfs_instance_registry_lock = threading.Lock()
+        self._restarting_tfs = set()
+        self._restarting_tfs_lock = threading.Lock()
+        self._start_time = None
+        self._startup_timeline = []
 
         _enable_batching = os.environ.get("SAGEMAKER_TFS_ENABLE_BATCHING", "false").lower()
         _enable_multi_model_endpoint = os.environ.get("SAGEMAKER_MULTI_MODEL", "false").lower()
         # Use this to specify memory that is needed to initialize CUDA/cuDNN and other GPU libraries
         self._tfs_gpu_margin = float(os.environ.get("SAGEMAKER_TFS_FRACTIONAL_GPU_MEM_MARGIN", 0.2))
         self._tfs_instance_count = int(os.environ.get("SAGEMAKER_TFS_INSTANCE_COUNT", 1))
+        self._tfs_inter_op_parallelism = os.environ.get("SAGEMAKER_TFS_INTER_OP_PARALLELISM", 0)
+        self._tfs_intra_op_parallelism = os.environ.get("SAGEMAKER_TFS_INTRA_OP_PARALLELISM", 0)
+        self._tfs_cpu_sets = None
+        self._tfs_omp_num_threads = None
+        if os.environ.get("SAGEMAKER_TFS_AUTOTUNE", "false").lower() == "true":
+            self._autotune(_enable_multi_model_endpoint == "true")
         self._tfs_wait_time_seconds = int(
             os.environ.get("SAGEMAKER_TFS_WAIT_TIME_SECONDS", 55 // self._tfs_instance_count)
         )
-        self._tfs_inter_op_parallelism = os.environ.get("SAGEMAKER_TFS_INTER_OP_PARALLELISM", 0)
-        self._tfs_intra_op_parallelism = os.environ.get("SAGEMAKER_TFS_INTRA_OP_PARALLELISM", 0)
+        # send predict requests to the default model before an instance takes invocations
+        self._tfs_warmup = os.environ.get("SAGEMAKER_TFS_WARMUP", "true").lower() == "true"
+        self._tfs_warmup_iterations = int(os.environ.get("SAGEMAKER_TFS_WARMUP_ITERATIONS", 3))
         self._gunicorn_worker_class = os.environ.get("SAGEMAKER_GUNICORN_WORKER_CLASS", "gevent")
         self._gunicorn_timeout_seconds = int(
             os.environ.get("SAGEMAKER_GUNICORN_TIMEOUT_SECONDS", 30)
@@ -108,6 +141,10 @@ class ServiceManager(object):
         self._tfs_enable_multi_model_endpoint = _enable_multi_model_endpoint == "true"
 
         self._use_gunicorn = self._enable_python_service or self._tfs_enable_multi_model_endpoint
+        # the njs front end hands npy, npz and protobuf invocations to the python service
+        self._binary_invocations = (
+            os.environ.get("SAGEMAKER_TFS_BINARY_INVOCATIONS", "false").lower() == "true"
+        )
 
         if self._sagemaker_port_range is not None:
             parts = self._sagemaker_port_range.split("-")
@@ -140,6 +177,52 @@ class ServiceManager(object):
         os.environ["TFS_GRPC_PORTS"] = self._tfs_grpc_concat_ports
         os.environ["TFS_REST_PORTS"] = self._tfs_rest_concat_ports
 
+    def _autotune(self, multi_model):
+        """Derives the settings that are not set explicitly from the container resources."""
+        topology = autotune.read_topology(self._get_number_of_gpu_on_host())
+        model_size_mb = 0 if multi_model else tfs_utils.get_directory_size_mb("/opt/ml/model")
+        plan = autotune.plan(topology, model_size_mb, multi_model, self._max_tfs_instance_count())
+        for decision in plan.decisions:
+            log.info("autotune: {}".format(decision))
+
+        # an explicitly set environment variable always wins over the plan
+        applied = []
+        for env_var, attribute, value in (
+            ("SAGEMAKER_GUNICORN_WORKERS", "_gunicorn_workers", plan.gunicorn_workers),
+            ("SAGEMAKER_TFS_INSTANCE_COUNT", "_tfs_instance_count", plan.tfs_instance_count),
+            (
+                "SAGEMAKER_TFS_INTRA_OP_PARALLELISM",
+                "_tfs_intra_op_parallelism",
+                plan.intra_op_parallelism,
+            ),
+            (
+                "SAGEMAKER_TFS_INTER_OP_PARALLELISM",
+                "_tfs_inter_op_parallelism",
+                plan.inter_op_parallelism,
+            ),
+        ):
+            if env_var not in os.environ:
+                setattr(self, attribute, value)
+                applied.append("{}={}".format(env_var, value))
+        if "OMP_NUM_THREADS" not in os.environ and int(self._tfs_intra_op_parallelism) > 0:
+            # gunicorn keeps OMP_NUM_THREADS=1, TFS gets a thread per core of its instance, 0
+            # lets TensorFlow decide
+            self._tfs_omp_num_threads = str(self._tfs_intra_op_parallelism)
+            applied.append("OMP_NUM_THREADS={} for TFS".format(self._tfs_omp_num_threads))
+        # pinning is only valid for the instance count it was planned for
+        if plan.tfs_cpu_sets and len(plan.tfs_cpu_sets) == self._tfs_instance_count:
+            self._tfs_cpu_sets = plan.tfs_cpu_sets
+            applied.append("tensorflow serving cpu sets {}".format(self._tfs_cpu_sets))
+        log.info("autotune applied: {}".format(", ".join(applied) or "nothing, all set explicitly"))
+
+    def _max_tfs_instance_count(self):
+        """Every TFS instance needs a gRPC and a REST port, without SAGEMAKER_SAFE_PORT_RANGE only
+        the default ones exist."""
+        if self._sagemaker_port_range is None:
+            return 1
+        parts = self._sagemaker_port_range.split("-")
+        return max(1, (int(parts[1]) - int(parts[0])) // 2)
+
     def _need_python_service(self):
         if (
             os.path.exists(INFERENCE_PATH)
@@ -170,6 +253,9 @@ class ServiceManager(object):
                 log.info("using default model name: {}".format(self._tfs_default_model_name))
             else:
                 log.info("no default model detected")
+        for m in models:
+            if os.path.basename(m) == self._tfs_default_model_name:
+                self._tfs_default_model_base_path = m
 
         # config (may) include duplicate 'config' keys, so we can't just dump a dict
         config = "model_config_list: {\n"
@@ -299,7 +385,10 @@ class ServiceManager(object):
             "FORWARD_INVOCATION_REQUESTS": (
                 GUNICORN_INVOCATIONS if self._use_gunicorn else JS_INVOCATIONS
             ),
+            # python service metrics, the njs front end has none
+            "FORWARD_METRICS_REQUESTS": GUNICORN_METRICS if self._use_gunicorn else NO_METRICS,
             "PROXY_READ_TIMEOUT": str(self._nginx_proxy_read_timeout_seconds),
+            "BINARY_INVOCATIONS": str(self._binary_invocations).lower(),
         }
 
         config = pattern.sub(lambda x: template_values[x.group(1)], template)
@@ -324,12 +413,16 @@ class ServiceManager(object):
         return False
 
     def _get_number_of_gpu_on_host(self):
-        nvidia_smi_exist = os.path.exists("/usr/bin/nvidia-smi")
-        if nvidia_smi_exist:
-            return len(
-                subprocess.check_output(["nvidia-smi", "-L"]).decode("utf-8").strip().split("\n")
-            )
-        return 0
+        if self._num_gpus is None:
+            self._num_gpus = 0
+            if os.path.exists("/usr/bin/nvidia-smi"):
+                self._num_gpus = len(
+                    subprocess.check_output(["nvidia-smi", "-L"])
+                    .decode("utf-8")
+                    .strip()
+                    .split("\n")
+                )
+        return self._num_gpus
 
     def _calculate_per_process_gpu_memory_fraction(self):
         return round((1 - self._tfs_gpu_margin) / float(self._tfs_instance_count), 4)
@@ -337,9 +430,11 @@ class ServiceManager(object):
     def _start_tfs(self):
         self._log_version("tensorflow_model_server --version", "tensorflow version info:")
 
+        # spawning is non-blocking, all instances load their models concurrently
         for i in range(self._tfs_instance_count):
             p = self._start_single_tfs(i)
             self._tfs.append(p)
+            self._record_startup_event("tensorflow serving instance {} spawned".format(i))
 
     def _start_gunicorn(self):
         self._log_version("gunicorn --version", "gunicorn version info:")
@@ -349,12 +444,14 @@ class ServiceManager(object):
         p = subprocess.Popen(self._gunicorn_command.split(), env=env)
         log.info("started gunicorn (pid: %d)", p.pid)
         self._gunicorn = p
+        self._record_startup_event("gunicorn spawned")
 
     def _start_nginx(self):
         self._log_version("/usr/sbin/nginx -V", "nginx version info:")
         p = subprocess.Popen("/usr/sbin/nginx -c /sagemaker/nginx.conf".split())
         log.info("started nginx (pid: %d)", p.pid)
         self._nginx = p
+        self._record_startup_event("nginx spawned")
 
     def _log_version(self, command, message):
         try:
@@ -389,16 +486,68 @@ class ServiceManager(object):
         log.info("stopped")
 
     def _wait_for_gunicorn(self):
-        while True:
-            if os.path.exists("/tmp/gunicorn.sock"):
-                log.info("gunicorn server is ready!")
+        # the socket file can be left over from a previous gunicorn, so wait until it accepts
+        while not self._accepts_connections(socket.AF_UNIX, GUNICORN_SOCKET):
+            time.sleep(READINESS_POLL_INTERVAL_SECONDS)
+        log.info("gunicorn server is ready!")
+        self._record_startup_event("gunicorn ready")
+
+    def _wait_for_nginx(self):
+        deadline = time.time() + NGINX_WAIT_TIME_SECONDS
+        address = ("localhost", int(self._nginx_http_port))
+        while not self._accepts_connections(socket.AF_INET, address):
+            if time.time() > deadline:
+                log.warning("nginx is not accepting connections on port %s", self._nginx_http_port)
                 return
+            time.sleep(READINESS_POLL_INTERVAL_SECONDS)
+        self._record_startup_event("nginx ready")
+
+    def _accepts_connections(self, family, address):
+        try:
+            with socket.socket(family, socket.SOCK_STREAM) as s:
+                s.connect(address)
+            return True
+        except OSError:
+            return False
 
     def _wait_for_tfs(self):
-        for i in range(self._tfs_instance_count):
+        def _wait_for_instance(instance_id):
             tfs_utils.wait_for_model(
-                self._tfs_rest_ports[i], self._tfs_default_model_name, self._tfs_wait_time_seconds
+                self._tfs_rest_ports[instance_id],
+                self._tfs_default_model_name,
+                self._tfs_wait_time_seconds,
+            )
+            self._record_startup_event(
+                "tensorflow serving instance {} model AVAILABLE".format(instance_id)
             )
+            if self._warm_up(instance_id):
+                self._record_startup_event(
+                    "tensorflow serving instance {} model warmed up".format(instance_id)
+                )
+
+        with ThreadPoolExecutor(max_workers=self._tfs_instance_count) as executor:
+            # list() re-raises the first timeout of any instance
+            list(executor.map(_wait_for_instance, range(self._tfs_instance_count)))
+
+    def _record_startup_event(self, event):
+        if self._state != "starting":
+            # restarts from _monitor are not part of the startup timeline
+            return
+        elapsed = time.time() - self._start_time
+        self._startup_timeline.append((event, elapsed))
+        log.info("startup timeline: {} after {:.3f}s".format(event, elapsed))
+
+    def _log_startup_timeline(self):
+        timeline = "\n".join(
+            "{:>9.3f}s  {}".format(elapsed, event) for event, elapsed in self._startup_timeline
+        )
+        log.info("startup timeline:\n%s", timeline)
+        if self._use_gunicorn:
+            # served on /metrics by python service next to its own metrics
+            startup_metrics = metrics.ServiceMetrics()
+            for event, elapsed in self._startup_timeline:
+                startup_metrics.set("sagemaker_tfs_startup_seconds", (("event", event),), elapsed)
+            startup_metrics.flush()
 
     @contextmanager
     def _timeout(self, seconds):
@@ -428,8 +577,62 @@ class ServiceManager(object):
         instance_id = self._find_tfs_process(pid)
         if instance_id is None:
             raise ValueError("Cannot find tfs with pid: {};".format(pid))
+        # stop routing to the instance until its model is available again
+        with self._restarting_tfs_lock:
+            self._restarting_tfs.add(instance_id)
+        self._publish_tfs_instances()
         p = self._start_single_tfs(instance_id)
         self._tfs[instance_id] = p
+        threading.Thread(
+            target=self._wait_for_restarted_tfs, args=(instance_id, p.pid), daemon=True
+        ).start()
+
+    def _wait_for_restarted_tfs(self, instance_id, pid):
+        try:
+            tfs_utils.wait_for_model(
+                self._tfs_rest_ports[instance_id],
+                self._tfs_default_model_name,
+                self._tfs_wait_time_seconds,
+                pid,
+            )
+            self._warm_up(instance_id)
+        except Exception as error:  # pylint: disable=broad-except
+            log.error("restarted tensorflow serving (pid: {}) is not ready. {}".format(pid, error))
+        finally:
+            # route to the instance again even if it did not become ready, an instance left out
+            # for good would shrink the pool with every bad restart. If the process exited,
+            # _monitor restarts it and takes it out again.
+            with self._restarting_tfs_lock:
+                if self._tfs[instance_id].pid == pid:
+                    self._restarting_tfs.discard(instance_id)
+            self._publish_tfs_instances()
+
+    def _warm_up(self, instance_id):
+        """Warms up the default model of a TFS instance, returns False if warmup is disabled."""
+        if not self._tfs_warmup or self._tfs_default_model_name == "None":
+            return False
+        warmup.warm_up(
+            self._tfs_rest_ports[instance_id],
+            self._tfs_default_model_name,
+            self._tfs_default_model_base_path,
+            self._tfs_warmup_iterations,
+            self._tfs_wait_time_seconds,
+        )
+        return True
+
+    def _publish_tfs_instances(self):
+        """Tells python service which TFS instances can take requests."""
+        if self._tfs_instance_registry is None:
+            return
+        with self._restarting_tfs_lock:
+            restarting_tfs = set(self._restarting_tfs)
+        instances = [
+            [self._tfs_rest_ports[i], self._tfs_grpc_ports[i], p.pid]
+            for i, p in enumerate(self._tfs)
+            if i not in restarting_tfs
+        ]
+        with self._tfs_instance_registry_lock:
+            self._tfs_instance_registry.write({TFS_INSTANCES_KEY: instances})
 
     def _start_single_tfs(self, instance_id):
         cmd = tfs_utils.tfs_command(
@@ -445,12 +648,21 @@ class ServiceManager(object):
         )
         log.info("tensorflow serving command: {}".format(cmd))
 
+        worker_env = None
+        if self._tfs_omp_num_threads is not None:
+            worker_env = os.environ.copy()
+            worker_env["OMP_NUM_THREADS"] = self._tfs_omp_num_threads
+        preexec_fn = None
+        if self._tfs_cpu_sets is not None:
+            cpus = self._tfs_cpu_sets[instance_id]
+            preexec_fn = lambda: os.sched_setaffinity(0, cpus)  # noqa: E731
+
         num_gpus = self._get_number_of_gpu_on_host()
         if num_gpus > 1:
             # utilizing multi-gpu
-            worker_env = os.environ.copy()
+            worker_env = worker_env or os.environ.copy()
             worker_env["CUDA_VISIBLE_DEVICES"] = str(instance_id % num_gpus)
-            p = subprocess.Popen(cmd.split(), env=worker_env)
+            p = subprocess.Popen(cmd.split(), env=worker_env, preexec_fn=preexec_fn)
             log.info(
                 "started tensorflow serving (pid: {}) on GPU: {}".format(
                     p.pid, instance_id % num_gpus
@@ -458,8 +670,10 @@ class ServiceManager(object):
             )
         else:
             # cpu and single gpu
-            p = subprocess.Popen(cmd.split())
+            p = subprocess.Popen(cmd.split(), env=worker_env, preexec_fn=preexec_fn)
             log.info("started tensorflow serving (pid: {})".format(p.pid))
+        if preexec_fn is not None:
+            log.info("tensorflow serving (pid: {}) pinned to cpus {}".format(p.pid, cpus))
 
         return p
 
@@ -490,6 +704,7 @@ class ServiceManager(object):
     def start(self):
         log.info("starting services")
         self._state = "starting"
+        self._start_time = time.time()
         signal.signal(signal.SIGTERM, self._stop)
 
         if self._tfs_enable_batching:
@@ -502,10 +717,14 @@ class ServiceManager(object):
             self._create_tfs_config()
             self._start_tfs()
             self._wait_for_tfs()
+            self._tfs_instance_registry = ModelRegistry(
+                TFS_INSTANCE_REGISTRY_FILE, TFS_INSTANCE_REGISTRY_SIZE
+            )
+            self._publish_tfs_instances()
 
         self._create_nginx_config()
 
-        if self._use_gunicorn:
+        if self._use_gunicorn or self._binary_invocations:
             self._setup_gunicorn()
             self._start_gunicorn()
             # make sure gunicorn is up
@@ -513,6 +732,8 @@ class ServiceManager(object):
                 self._wait_for_gunicorn()
 
         self._start_nginx()
+        self._wait_for_nginx()
+        self._log_startup_timeline()
         self._state = "started"
         self._monitor()
         self._stop()
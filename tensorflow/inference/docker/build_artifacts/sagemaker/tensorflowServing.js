@@ -1,10 +1,15 @@
 var tfs_base_uri = '/tfs/v1/models/'
 var custom_attributes_header = 'X-Amzn-SageMaker-Custom-Attributes'
+var binary_content_types = ['application/x-npy', 'application/x-npz', 'application/x-protobuf']
 
 function invocations(r) {
     var ct = r.headersIn['Content-Type']
 
-    if ('application/json' == ct || 'application/jsonlines' == ct || 'application/jsons' == ct) {
+    if (r.variables.binary_invocations == 'true' && ct &&
+        binary_content_types.includes(ct.split(';')[0].trim().toLowerCase())) {
+        // tensors are sent to TFS over gRPC by the python service
+        r.internalRedirect('@gunicorn_invocations')
+    } else if ('application/json' == ct || 'application/jsonlines' == ct || 'application/jsons' == ct) {
         json_request(r)
     } else if ('text/csv' == ct) {
         csv_request(r)
@@ -0,0 +1,413 @@
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Sends TFS REST style JSON predict requests through PredictionService.Predict.
+
+TFS parses large numeric JSON payloads slowly. Converting "instances"/"inputs" to TensorProtos
+here and calling the gRPC API skips that parser, and the predictions are converted back to the
+JSON that the REST API would have returned. Payloads that cannot be represented faithfully
+(b64 strings, ragged lists, non predict signatures) raise UnsupportedRequest so the caller can
+fall back to REST.
+
+npy, npz and serialized PredictRequest bodies are always sent over gRPC. Their arrays are copied
+into TensorProtos straight from the request body, and the Accept header selects an npy, npz,
+PredictResponse protobuf or JSON response.
+"""
+import ast
+import io
+import json
+import logging
+import struct
+import zipfile
+
+import grpc
+
+from multi_model_utils import MultiModelException
+from tfs_utils import PredictResponse, find_model_versions
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SIGNATURE_NAME = "serving_default"
+PREDICT_METHOD_NAME = "tensorflow/serving/predict"
+# npy and npz bodies use the serving_default signature, an npy body is its single input and the
+# arrays of an npz body are named after the inputs
+NPY_CONTENT_TYPE = "application/x-npy"
+NPZ_CONTENT_TYPE = "application/x-npz"
+# serialized tensorflow.serving.PredictRequest and PredictResponse messages
+PROTOBUF_CONTENT_TYPE = "application/x-protobuf"
+BINARY_CONTENT_TYPES = (NPY_CONTENT_TYPE, NPZ_CONTENT_TYPE, PROTOBUF_CONTENT_TYPE)
+_NPY_MAGIC = b"\x93NUMPY"
+
+# same mapping TFS uses for REST responses
+_HTTP_STATUS_CODES = {
+    grpc.StatusCode.INVALID_ARGUMENT: 400,
+    grpc.StatusCode.FAILED_PRECONDITION: 400,
+    grpc.StatusCode.OUT_OF_RANGE: 400,
+    grpc.StatusCode.UNAUTHENTICATED: 401,
+    grpc.StatusCode.PERMISSION_DENIED: 403,
+    grpc.StatusCode.NOT_FOUND: 404,
+    grpc.StatusCode.ALREADY_EXISTS: 409,
+    grpc.StatusCode.ABORTED: 409,
+    grpc.StatusCode.RESOURCE_EXHAUSTED: 429,
+    grpc.StatusCode.UNIMPLEMENTED: 501,
+    grpc.StatusCode.UNAVAILABLE: 503,
+    grpc.StatusCode.DEADLINE_EXCEEDED: 504,
+}
+
+# (model name, model version, signature name) -> SignatureDef
+_signatures = {}
+
+
+class UnsupportedRequest(Exception):
+    pass
+
+
+def _apis():
+    # tensorflow_serving imports the whole of tensorflow, only pay for it when gRPC is used
+    import numpy as np
+    import tensorflow as tf
+    from tensorflow_serving.apis import get_model_metadata_pb2
+    from tensorflow_serving.apis import predict_pb2
+    from tensorflow_serving.apis import prediction_service_pb2_grpc
+
+    return np, tf, get_model_metadata_pb2, predict_pb2, prediction_service_pb2_grpc
+
+
+def binary_content_type(header):
+    """Returns the first binary content type of a Content-Type or Accept header, None if it has
+    none."""
+    for media_type in (header or "").split(","):
+        media_type = media_type.split(";")[0].strip().lower()
+        if media_type in BINARY_CONTENT_TYPES:
+            return media_type
+    return None
+
+
+def clear_signature_cache(model_name=None):
+    for key in list(_signatures):
+        if model_name is None or key[0] == model_name:
+            del _signatures[key]
+
+
+def get_signature(channel, model_name, model_version, signature_name, timeout_seconds):
+    key = (model_name, model_version, signature_name)
+    if key in _signatures:
+        return _signatures[key]
+
+    _, _, get_model_metadata_pb2, _, prediction_service_pb2_grpc = _apis()
+    request = get_model_metadata_pb2.GetModelMetadataRequest()
+    request.model_spec.name = model_name
+    if model_version:
+        request.model_spec.version.value = int(model_version)
+    request.metadata_field.append("signature_def")
+
+    stub = prediction_service_pb2_grpc.PredictionServiceStub(channel)
+    response = stub.GetModelMetadata(request, timeout_seconds)
+    signature_map = get_model_metadata_pb2.SignatureDefMap()
+    response.metadata["signature_def"].Unpack(signature_map)
+
+    if signature_name not in signature_map.signature_def:
+        raise UnsupportedRequest("signature {} not found".format(signature_name))
+    signature = signature_map.signature_def[signature_name]
+    if signature.method_name != PREDICT_METHOD_NAME:
+        raise UnsupportedRequest("signature {} is not a predict signature".format(signature_name))
+
+    _signatures[key] = signature
+    return signature
+
+
+def _input_values(payload, signature):
+    """Returns ({input name: nested list}, is_row_format) for a REST predict payload."""
+    if "instances" in payload:
+        instances = payload["instances"]
+        if not isinstance(instances, list) or not instances:
+            raise UnsupportedRequest("instances must be a non-empty list")
+        if isinstance(instances[0], dict):
+            names = instances[0].keys()
+            try:
+                return {name: [instance[name] for instance in instances] for name in names}, True
+            except (KeyError, TypeError):
+                raise UnsupportedRequest("instances do not share the same inputs")
+        if len(signature.inputs) != 1:
+            raise UnsupportedRequest("unnamed instances need a single input signature")
+        return {next(iter(signature.inputs)): instances}, True
+
+    if "inputs" in payload:
+        inputs = payload["inputs"]
+        if isinstance(inputs, dict):
+            return inputs, False
+        if len(signature.inputs) != 1:
+            raise UnsupportedRequest("unnamed inputs need a single input signature")
+        return {next(iter(signature.inputs)): inputs}, False
+
+    raise UnsupportedRequest("payload has neither instances nor inputs")
+
+
+def make_predict_request(payload, model_name, model_version, signature_name, signature):
+    np, tf, _, predict_pb2, _ = _apis()
+    request = predict_pb2.PredictRequest()
+    request.model_spec.name = model_name
+    request.model_spec.signature_name = signature_name
+    if model_version:
+        request.model_spec.version.value = int(model_version)
+
+    values, is_row_format = _input_values(payload, signature)
+    for name, value in values.items():
+        if name not in signature.inputs:
+            # let the REST API produce its usual error message
+            raise UnsupportedRequest("unknown input {}".format(name))
+        dtype = tf.dtypes.as_dtype(signature.inputs[name].dtype)
+        if not (dtype.is_floating or dtype.is_integer or dtype.is_bool):
+            raise UnsupportedRequest("input {} has non numeric type {}".format(name, dtype.name))
+        try:
+            array = np.asarray(value, dtype=dtype.as_numpy_dtype)
+        except (TypeError, ValueError):
+            raise UnsupportedRequest("input {} is not a dense tensor".format(name))
+        request.inputs[name].CopyFrom(tf.make_tensor_proto(array))
+    return request, is_row_format
+
+
+def _to_list(value):
+    # string tensors come back as numpy object arrays of bytes
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    if value.dtype == object:
+        return [_to_list(item) for item in value] if value.ndim else _to_list(value.item())
+    return value.tolist()
+
+
+def make_json_response(response, is_row_format):
+    _, tf, _, _, _ = _apis()
+    outputs = {name: tf.make_ndarray(tensor) for name, tensor in response.outputs.items()}
+
+    if is_row_format:
+        if len(outputs) == 1:
+            predictions = _to_list(next(iter(outputs.values())))
+        else:
+            batch_size = len(next(iter(outputs.values())))
+            predictions = [
+                {name: _to_list(array[i]) for name, array in outputs.items()}
+                for i in range(batch_size)
+            ]
+        return {"predictions": predictions}
+
+    if len(outputs) == 1:
+        return {"outputs": _to_list(next(iter(outputs.values())))}
+    return {"outputs": {name: _to_list(array) for name, array in outputs.items()}}
+
+
+def _error_response(status_code, message):
+    return PredictResponse(status_code, json.dumps({"error": message}).encode("utf-8"))
+
+
+def npy_tensor_proto(body):
+    """Converts an npy array to a TensorProto without decoding the array first.
+
+    :param body: bytes or memoryview of the npy file
+    :return: TensorProto
+    """
+    np, tf, _, _, _ = _apis()
+    if bytes(body[:6]) != _NPY_MAGIC:
+        raise ValueError("not an npy array")
+    # format version 1 has a 2 byte header length, later versions a 4 byte one
+    length_format = "<H" if body[6] == 1 else "<I"
+    header_offset = 8 + struct.calcsize(length_format)
+    data_offset = header_offset + struct.unpack_from(length_format, body, 8)[0]
+    header = ast.literal_eval(bytes(body[header_offset:data_offset]).decode("latin1"))
+    dtype = np.lib.format.descr_to_dtype(header["descr"])
+    if dtype.hasobject:
+        raise ValueError("npy arrays of python objects are not supported")
+
+    shape = header["shape"]
+    count = int(np.prod(shape))
+    if len(body) - data_offset < count * dtype.itemsize:
+        raise ValueError("npy array is truncated")
+    # a view of the body, make_tensor_proto copies it into the TensorProto once
+    array = np.frombuffer(body, dtype=dtype, count=count, offset=data_offset)
+    return tf.make_tensor_proto(array.reshape(shape, order="F" if header["fortran_order"] else "C"))
+
+
+def npz_tensor_protos(body):
+    """Converts the arrays of an npz file to TensorProtos.
+
+    :param body: bytes or memoryview of the npz file
+    :return: dict, array name -> TensorProto
+    """
+    tensors = {}
+    with zipfile.ZipFile(io.BytesIO(body)) as npz:
+        for name in npz.namelist():
+            input_name = name[: -len(".npy")] if name.endswith(".npy") else name
+            tensors[input_name] = npy_tensor_proto(npz.read(name))
+    return tensors
+
+
+def _npy_bytes(array):
+    np, _, _, _, _ = _apis()
+    if array.dtype == object:
+        # string tensors, as fixed size byte strings
+        array = array.astype(np.bytes_)
+    output = io.BytesIO()
+    np.lib.format.write_array(output, array, allow_pickle=False)
+    return output.getvalue()
+
+
+def make_response(response, accept, is_row_format):
+    """Encodes a PredictResponse message in the first binary content type of the Accept header,
+    as the JSON the REST API would have returned if it has none.
+
+    :return: tfs_utils.PredictResponse
+    """
+    content_type = binary_content_type(accept)
+    if content_type is None:
+        body = json.dumps(make_json_response(response, is_row_format)).encode("utf-8")
+        return PredictResponse(200, body)
+    if content_type == PROTOBUF_CONTENT_TYPE:
+        return PredictResponse(200, response.SerializeToString(), content_type)
+
+    np, tf, _, _, _ = _apis()
+    outputs = {name: tf.make_ndarray(tensor) for name, tensor in response.outputs.items()}
+    if content_type == NPY_CONTENT_TYPE:
+        if len(outputs) != 1:
+            return _error_response(
+                406,
+                "the signature has {} outputs, accept {} to receive them".format(
+                    len(outputs), NPZ_CONTENT_TYPE
+                ),
+            )
+        return PredictResponse(200, _npy_bytes(next(iter(outputs.values()))), content_type)
+
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w") as npz:
+        for name, array in outputs.items():
+            npz.writestr(name + ".npy", _npy_bytes(array))
+    return PredictResponse(200, output.getvalue(), content_type)
+
+
+def predict_binary(channel, model_name, model_version, body, content_type, accept, timeout_seconds):
+    """Runs a predict request with an npy, npz or serialized PredictRequest body over gRPC.
+
+    :param channel: grpc channel to the TFS instance
+    :param model_name: name of the model, replaces the one of a PredictRequest body
+    :param model_version: optional model version
+    :param body: bytes or memoryview of the request body
+    :param content_type: one of BINARY_CONTENT_TYPES
+    :param accept: Accept header, selects the response content type
+    :param timeout_seconds: deadline of each gRPC call
+    :return: tfs_utils.PredictResponse
+    """
+    from google.protobuf.message import DecodeError
+
+    _, _, _, predict_pb2, prediction_service_pb2_grpc = _apis()
+    try:
+        if content_type == PROTOBUF_CONTENT_TYPE:
+            request = predict_pb2.PredictRequest.FromString(bytes(body))
+            is_row_format = False
+        else:
+            request = predict_pb2.PredictRequest()
+            request.model_spec.signature_name = DEFAULT_SIGNATURE_NAME
+            if content_type == NPY_CONTENT_TYPE:
+                signature = get_signature(
+                    channel, model_name, model_version, DEFAULT_SIGNATURE_NAME, timeout_seconds
+                )
+                if len(signature.inputs) != 1:
+                    raise ValueError(
+                        "the signature has {} inputs, send them as {}".format(
+                            len(signature.inputs), NPZ_CONTENT_TYPE
+                        )
+                    )
+                request.inputs[next(iter(signature.inputs))].CopyFrom(npy_tensor_proto(body))
+                is_row_format = True
+            else:
+                for name, tensor in npz_tensor_protos(body).items():
+                    request.inputs[name].CopyFrom(tensor)
+                is_row_format = False
+        request.model_spec.name = model_name
+        if model_version:
+            request.model_spec.version.value = int(model_version)
+
+        stub = prediction_service_pb2_grpc.PredictionServiceStub(channel)
+        response = stub.Predict(request, timeout_seconds)
+    except (ValueError, SyntaxError, KeyError, zipfile.BadZipFile, DecodeError) as e:
+        return _error_response(400, "invalid {} body: {}".format(content_type, e))
+    except UnsupportedRequest as e:
+        return _error_response(400, str(e))
+    except grpc.RpcError as e:
+        return _error_response(_HTTP_STATUS_CODES.get(e.code(), 500), e.details())
+
+    return make_response(response, accept, is_row_format)
+
+
+def predict(channel, model_name, model_version, data, timeout_seconds, accept=None):
+    """Runs a REST style predict request over gRPC.
+
+    :param channel: grpc channel to the TFS instance
+    :param model_name: name of the model
+    :param model_version: optional model version
+    :param data: REST predict request body (str or bytes)
+    :param timeout_seconds: deadline of each gRPC call
+    :param accept: Accept header, a binary content type in it selects a binary response
+    :return: PredictResponse with the body the REST API would have returned
+    """
+    try:
+        payload = json.loads(data)
+    except (TypeError, ValueError):
+        raise UnsupportedRequest("payload is not valid json")
+    if not isinstance(payload, dict):
+        raise UnsupportedRequest("payload is not a json object")
+
+    signature_name = payload.get("signature_name", DEFAULT_SIGNATURE_NAME)
+    try:
+        signature = get_signature(
+            channel, model_name, model_version, signature_name, timeout_seconds
+        )
+        request, is_row_format = make_predict_request(
+            payload, model_name, model_version, signature_name, signature
+        )
+        _, _, _, _, prediction_service_pb2_grpc = _apis()
+        stub = prediction_service_pb2_grpc.PredictionServiceStub(channel)
+        response = stub.Predict(request, timeout_seconds)
+    except grpc.RpcError as e:
+        return _error_response(_HTTP_STATUS_CODES.get(e.code(), 500), e.details())
+
+    return make_response(response, accept, is_row_format)
+
+
+def reload_config(channel, models, timeout_seconds):
+    """Replaces the models a TFS instance serves with ModelService.HandleReloadConfigRequest.
+
+    TFS returns once the new models are loaded, removed models are unloaded in the background.
+
+    :param channel: grpc channel to the TFS instance
+    :param models: dict, model name -> model base path, every model the instance should serve
+    :param timeout_seconds: deadline of the reload call
+    """
+    from tensorflow_serving.apis import model_management_pb2
+    from tensorflow_serving.apis import model_service_pb2_grpc
+
+    request = model_management_pb2.ReloadConfigRequest()
+    for model_name, base_path in models.items():
+        config = request.config.model_config_list.config.add()
+        config.name = model_name
+        config.base_path = base_path
+        config.model_platform = "tensorflow"
+        config.model_version_policy.specific.versions.extend(
+            int(version) for version in find_model_versions(base_path)
+        )
+
+    stub = model_service_pb2_grpc.ModelServiceStub(channel)
+    try:
+        response = stub.HandleReloadConfigRequest(request, timeout_seconds)
+    except grpc.RpcError as e:
+        code = 408 if e.code() == grpc.StatusCode.DEADLINE_EXCEEDED else 500
+        raise MultiModelException(code, e.details(), None)
+    if response.status.error_code:
+        raise MultiModelException(500, response.status.error_message, None)
@@ -11,26 +11,39 @@
 # ANY KIND, either express or implied. See the License for the specific
 # language governing permissions and limitations under the License.
 
+import csv
+import io
 import logging
 import multiprocessing
 import os
+import random
 import re
 import requests
 import json
+import threading
 import time
 
 from multi_model_utils import timeout
-from urllib3.util.retry import Retry
-from urllib3.exceptions import NewConnectionError, MaxRetryError
-from collections import namedtuple
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from urllib.parse import urlparse
 from multi_model_utils import MultiModelException
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
 DEFAULT_CONTENT_TYPE = "application/json"
 DEFAULT_ACCEPT_HEADER = "application/json"
 CUSTOM_ATTRIBUTES_HEADER = "X-Amzn-SageMaker-Custom-Attributes"
+READINESS_INITIAL_BACKOFF_SECONDS = 0.02
+READINESS_MAX_BACKOFF_SECONDS = 1.0
+# a csv body with any of these characters holds floats (or nan/inf), otherwise integers
+_CSV_FLOAT_PATTERN = re.compile(r"[.eEiInN]")
 
 Context = namedtuple(
     "Context",
@@ -38,6 +51,10 @@ Context = namedtuple(
     "custom_attributes, request_content_type, accept_header, content_length",
 )
 
+ModelReadiness = namedtuple(
+    "ModelReadiness", "model_name, rest_port, time_to_spawn, time_to_available, polls"
+)
+
 
 def parse_request(req, rest_port, grpc_port, default_model_name, model_name=None, channel=None):
     tfs_attributes = parse_tfs_custom_attributes(req)
@@ -63,8 +80,510 @@ def parse_request(req, rest_port, grpc_port, default_model_name, model_name=None
     return data, context
 
 
+class TfsSessionPool:
+    """Keep-alive HTTP sessions to the TFS REST API, with one connection pool per REST port.
+
+    Sessions are created lazily and are tied to the process that created them, so an instance
+    built in the gunicorn master still gives every forked worker its own sockets. urllib3's
+    connection pools are greenlet-safe once gevent has monkey patched the process.
+    """
+
+    def __init__(self, pool_size=10, keepalive=True, keepalive_seconds=60, stats_log_interval=0):
+        self._pool_size = pool_size
+        self._keepalive = keepalive
+        self._keepalive_seconds = keepalive_seconds
+        self._stats_log_interval = stats_log_interval
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._sessions = {}
+        self._last_used = {}
+        # counters of pools that were already closed, so stats survive idle expiry and unloads
+        self._retired = {}
+        self._request_count = 0
+
+    def _session(self, port):
+        if self._pid != os.getpid():
+            # inherited from the parent process across fork, never share its sockets
+            self._reset()
+
+        session = self._sessions.get(port)
+        now = time.time()
+        if session is not None and now - self._last_used[port] > self._keepalive_seconds:
+            # TFS may already have closed connections that sat idle for this long
+            self.close(port)
+            session = None
+
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=self._pool_size
+            )
+            session.mount("http://", adapter)
+            if not self._keepalive:
+                session.headers["Connection"] = "close"
+            self._sessions[port] = session
+        self._last_used[port] = now
+        return session
+
+    def request(self, method, uri, **kwargs):
+        port = urlparse(uri).port
+        response = self._session(port).request(method, uri, **kwargs)
+
+        self._request_count += 1
+        if self._stats_log_interval and self._request_count % self._stats_log_interval == 0:
+            log.info("tfs rest connection stats: {}".format(self.stats()))
+        return response
+
+    def post(self, uri, data=None, **kwargs):
+        return self.request("POST", uri, data=data, **kwargs)
+
+    def get(self, uri, **kwargs):
+        return self.request("GET", uri, **kwargs)
+
+    def close(self, port):
+        session = self._sessions.pop(port, None)
+        self._last_used.pop(port, None)
+        if session is None:
+            return
+        self._retired[port] = self._port_stats(port, session)
+        session.close()
+
+    def stats(self):
+        """Returns new versus reused connection counts per TFS REST port for this process."""
+        ports = set(self._retired) | set(self._sessions)
+        return {port: self._port_stats(port, self._sessions.get(port)) for port in ports}
+
+    def _port_stats(self, port, session):
+        retired = self._retired.get(port, {})
+        new_connections = retired.get("new_connections", 0)
+        total_requests = retired.get("requests", 0)
+        if session is not None:
+            pools = session.get_adapter("http://").poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                new_connections += pool.num_connections
+                total_requests += pool.num_requests
+        return {
+            "new_connections": new_connections,
+            "reused_connections": max(total_requests - new_connections, 0),
+            "requests": total_requests,
+        }
+
+
+class PredictResponse:
+    """The parts of requests.Response that output_handler implementations rely on, for
+    predictions that did not come straight from a TFS REST call."""
+
+    def __init__(self, status_code, content, content_type="application/json"):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {"Content-Type": content_type}
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class StreamingBody:
+    """A request body that is forwarded in chunks as it is read from the client.
+
+    requests sends objects that have a length and can be iterated with that Content-Length
+    instead of chunked encoding, so TFS sees the same request as a buffered one.
+    """
+
+    def __init__(self, stream, content_length, chunk_size=1024 * 1024):
+        self._stream = stream
+        self._remaining = content_length
+        self._content_length = content_length
+        self._chunk_size = chunk_size
+
+    def __len__(self):
+        return self._content_length
+
+    def __iter__(self):
+        while self._remaining > 0:
+            chunk = self._stream.read(min(self._chunk_size, self._remaining))
+            if not chunk:
+                raise IOError(
+                    "client closed the connection with {} bytes of the body unread".format(
+                        self._remaining
+                    )
+                )
+            self._remaining -= len(chunk)
+            yield chunk
+
+
+class ResponseStream:
+    """The body of a streamed TFS REST response, handed to falcon without decoding it.
+
+    The connection goes back to the session pool once the body has been sent, or is closed
+    by the WSGI server if the client goes away first.
+    """
+
+    def __init__(self, response, chunk_size=1024 * 1024):
+        self._response = response
+        self._chunk_size = chunk_size
+        content_length = response.headers.get("Content-Length")
+        self.content_length = int(content_length) if content_length else None
+        self.status_code = response.status_code
+
+    def __iter__(self):
+        try:
+            for chunk in self._response.iter_content(self._chunk_size):
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        self._response.close()
+
+
+def read_body(stream, content_length, chunk_size=1024 * 1024):
+    """Reads a request body into a single preallocated buffer.
+
+    :param stream: falcon request stream
+    :param content_length: int, length of the body
+    :param chunk_size: int, number of bytes to read at a time
+    :return: memoryview of the body
+    """
+    buffer = bytearray(content_length or 0)
+    view = memoryview(buffer)
+    offset = 0
+    while offset < len(buffer):
+        chunk = stream.read(min(chunk_size, len(buffer) - offset))
+        if not chunk:
+            raise IOError("client closed the connection after {} bytes".format(offset))
+        view[offset : offset + len(chunk)] = chunk
+        offset += len(chunk)
+    return view
+
+
+def json_dumps(obj):
+    """Encodes obj, which may contain numpy arrays, as compact JSON bytes with orjson when it
+    is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    if hasattr(obj, "tolist"):
+        obj = obj.tolist()
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def json_loads(data):
+    """Decodes JSON from str, bytes or a memoryview with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def _text(data):
+    if isinstance(data, str):
+        return data
+    if hasattr(data, "read"):
+        data = data.read()
+    return bytes(data).decode("utf-8")
+
+
+def _numpy():
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+    return np
+
+
+def _csv_value(field):
+    for number in (int, float):
+        try:
+            return number(field)
+        except ValueError:
+            pass
+    return field
+
+
+def _csv_numeric_instances(text):
+    """Parses a rectangular csv of numbers in one numpy call, None if the csv is not one."""
+    np = _numpy()
+    if np is None or "\n\n" in text or '"' in text:
+        return None
+    lines = text.split("\n")
+    commas = lines[0].count(",")
+    if any(line.count(",") != commas for line in lines):
+        # ragged rows are left to the csv module
+        return None
+    dtype = np.float64 if _CSV_FLOAT_PATTERN.search(text) else np.int64
+    try:
+        values = np.array(text.replace("\n", ",").split(","), dtype=dtype)
+    except (OverflowError, ValueError):
+        return None
+    return values.reshape(len(lines), commas + 1) if commas else values
+
+
+def csv_to_instances(data):
+    """Converts a CSV request body to a TFS {"instances": [...]} request body.
+
+    Like the njs front end, a row with several columns becomes a list and a single column a
+    scalar. Numeric bodies are parsed with numpy, other bodies with the csv module, where every
+    field that is not a number becomes a string.
+
+    :param data: str, bytes, memoryview or a file-like object with the CSV body
+    :return: bytes of the JSON request body
+    """
+    text = _text(data).strip().replace("\r\n", "\n")
+    instances = _csv_numeric_instances(text)
+    if instances is None:
+        instances = []
+        for row in csv.reader(line for line in text.split("\n") if line.strip()):
+            values = [_csv_value(field.strip()) for field in row]
+            instances.append(values if len(values) > 1 else values[0])
+    return b'{"instances":' + json_dumps(instances) + b"}"
+
+
+def jsonlines_to_instances(data):
+    """Converts a JSON lines request body to a TFS {"instances": [...]} request body, one
+    instance per non-empty line.
+
+    The lines are copied without decoding them, a file-like body is read one line at a time.
+
+    :param data: str, bytes, memoryview or a file-like object with the JSON lines body
+    :return: bytes of the JSON request body
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    lines = iter(data.readline, b"") if hasattr(data, "readline") else bytes(data).splitlines()
+    body = bytearray(b'{"instances":[')
+    for line in lines:
+        line = line.strip()
+        if line:
+            body += line
+            body += b","
+    if body[-1:] == b",":
+        body[-1:] = b"]}"
+    else:
+        body += b"]}"
+    return bytes(body)
+
+
+def _predictions(data):
+    if hasattr(data, "content"):
+        data = data.content
+    response = data if isinstance(data, dict) else json_loads(data)
+    if "predictions" not in response:
+        raise ValueError("TFS response has no predictions: {}".format(response))
+    return response["predictions"]
+
+
+def predictions_to_csv(data):
+    """Converts a TFS predict response to CSV, one row per prediction.
+
+    :param data: TFS response, its body or the decoded body
+    :return: str of the CSV body
+    """
+    predictions = _predictions(data)
+    np = _numpy()
+    array = None
+    if np is not None and predictions:
+        try:
+            array = np.asarray(predictions)
+        except ValueError:
+            # ragged predictions
+            pass
+    if array is not None and array.dtype.kind in "iuf" and array.ndim <= 2:
+        # the JSON encoding of a numeric matrix is its CSV once the row brackets are replaced
+        body = json_dumps(array)
+        if array.ndim == 1:
+            return body[1:-1].replace(b",", b"\n").decode("utf-8") + "\n"
+        return body[2:-2].replace(b"],[", b"\n").decode("utf-8") + "\n"
+
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    for prediction in predictions:
+        writer.writerow(prediction if isinstance(prediction, list) else [prediction])
+    return output.getvalue()
+
+
+def predictions_to_jsonlines(data):
+    """Converts a TFS predict response to JSON lines, one line per prediction.
+
+    :param data: TFS response, its body or the decoded body
+    :return: bytes of the JSON lines body
+    """
+    return b"".join(json_dumps(prediction) + b"\n" for prediction in _predictions(data))
+
+
+class _Batch:
+    def __init__(self, uri, payload):
+        self.uri = uri
+        self.payload = payload
+        self.instances = []
+        self.closed = threading.Event()
+        self.is_sent = False
+        self.done = threading.Event()
+        self.response = None
+        self.predictions = None
+        self.error = None
+
+
+class RequestCoalescer:
+    """Combines the "instances" of concurrent predict requests for the same model, version and
+    signature into a single TFS REST call and splits the predictions back to each caller.
+
+    The first request of a batch waits up to window_seconds for others to join, a batch that
+    reaches max_batch_size instances is sent right away. A request that does not fit into the
+    pending batch sends it and starts the next one. Only useful with concurrent workers
+    (gevent or gthread), requests are never held longer than the window.
+
+    A request waits at most timeout_seconds for the predictions of its batch. If the call of the
+    request that sends the batch hangs, or that request dies before sending it, the others get a
+    504 response instead of hanging with it.
+    """
+
+    def __init__(self, post, window_seconds, max_batch_size, timeout_seconds=None):
+        self._post = post
+        self._window_seconds = window_seconds
+        self._max_batch_size = max_batch_size
+        self._timeout_seconds = timeout_seconds
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def batch_key(self, payload, context):
+        """Returns the key requests are grouped by, None if the payload can not be batched."""
+        if not isinstance(payload, dict) or not set(payload) <= {"instances", "signature_name"}:
+            return None
+        instances = payload.get("instances")
+        if not isinstance(instances, list) or not 0 < len(instances) < self._max_batch_size:
+            return None
+        if (context.method or "predict") != "predict":
+            return None
+        return context.model_name, context.model_version, payload.get("signature_name")
+
+    def predict(self, key, payload, context):
+        instances = payload["instances"]
+        with self._lock:
+            batch = self._pending.get(key)
+            if batch is not None and len(batch.instances) + len(instances) > self._max_batch_size:
+                # its leader sends the pending batch once it is closed
+                del self._pending[key]
+                batch.closed.set()
+                batch = None
+            is_leader = batch is None
+            if is_leader:
+                batch = _Batch(context.rest_uri, payload)
+                self._pending[key] = batch
+            offset = len(batch.instances)
+            batch.instances.extend(instances)
+            is_full = len(batch.instances) >= self._max_batch_size
+            if is_full:
+                del self._pending[key]
+                batch.is_sent = True
+
+        if is_full:
+            self._flush(batch)
+        elif is_leader:
+            batch.closed.wait(self._window_seconds)
+            with self._lock:
+                if self._pending.get(key) is batch:
+                    del self._pending[key]
+                is_sender = not batch.is_sent
+                batch.is_sent = True
+            if is_sender:
+                self._flush(batch)
+
+        if not batch.done.wait(self._timeout_seconds):
+            with self._lock:
+                # a batch whose sender died would otherwise keep taking new requests
+                if self._pending.get(key) is batch:
+                    del self._pending[key]
+            log.warning(
+                "coalesced predict request timed out after {} seconds".format(self._timeout_seconds)
+            )
+            return PredictResponse(
+                504,
+                json.dumps(
+                    {"error": "Timed out after {} seconds".format(self._timeout_seconds)}
+                ).encode("utf-8"),
+            )
+        if batch.error is not None:
+            raise batch.error
+        if batch.predictions is None:
+            # errors apply to every request of the batch
+            return batch.response
+        predictions = batch.predictions[offset : offset + len(instances)]
+        return PredictResponse(200, json.dumps({"predictions": predictions}).encode("utf-8"))
+
+    def _flush(self, batch):
+        batch.closed.set()
+        body = dict(batch.payload, instances=batch.instances)
+        try:
+            batch.response = self._post(batch.uri, json.dumps(body))
+            if batch.response.status_code == 200:
+                predictions = batch.response.json().get("predictions")
+                if isinstance(predictions, list) and len(predictions) == len(batch.instances):
+                    batch.predictions = predictions
+                else:
+                    # the response holds the predictions of the other requests of the batch
+                    log.error(
+                        "coalesced predict request of {} instances got an unexpected "
+                        "response".format(len(batch.instances))
+                    )
+                    batch.response = PredictResponse(
+                        500,
+                        json.dumps(
+                            {"error": "Predictions do not match the instances of the request"}
+                        ).encode("utf-8"),
+                    )
+        except Exception as e:  # pylint: disable=broad-except
+            batch.error = e
+        finally:
+            batch.done.set()
+
+
+class LeastOutstandingRouter:
+    """Picks a TFS instance with power-of-two-choices on the number of requests in flight.
+
+    Counts are kept per gunicorn worker, every worker balances its own requests. Instances are
+    objects with rest_port, grpc_port and pid attributes so the REST and gRPC ports of one
+    request always belong to the same instance.
+    """
+
+    def __init__(self):
+        self._in_flight = Counter()
+
+    def pick(self, instances, is_alive=None):
+        candidates = random.sample(instances, min(2, len(instances)))
+        if is_alive is not None:
+            alive = [instance for instance in candidates if is_alive(instance)]
+            if not alive:
+                # both choices are down, fall back to any live instance
+                alive = [instance for instance in instances if is_alive(instance)]
+            candidates = alive or candidates
+        return min(candidates, key=lambda instance: self._in_flight[instance.rest_port])
+
+    def in_flight(self, rest_port):
+        return self._in_flight[rest_port]
+
+    @contextmanager
+    def track(self, instance):
+        self._in_flight[instance.rest_port] += 1
+        try:
+            yield
+        finally:
+            self._in_flight[instance.rest_port] -= 1
+
+
 def make_tfs_uri(port, attributes, default_model_name, model_name=None):
-    log.info("sagemaker tfs attributes: \n{}".format(attributes))
+    # runs for every request, sampled request logs include the uri and custom attributes
+    log.debug("sagemaker tfs attributes: \n%s", attributes)
 
     tfs_model_name = model_name or attributes.get("tfs-model-name", default_model_name)
     tfs_model_version = attributes.get("tfs-model-version")
@@ -78,8 +597,11 @@ def make_tfs_uri(port, attributes, default_model_name, model_name=None):
 
 
 def parse_tfs_custom_attributes(req):
+    return parse_custom_attributes_header(req.get_header(CUSTOM_ATTRIBUTES_HEADER))
+
+
+def parse_custom_attributes_header(header):
     attributes = {}
-    header = req.get_header(CUSTOM_ATTRIBUTES_HEADER)
     if header:
         matches = re.findall(r"(tfs-[a-z\-]+=[^,]+)", header)
         attributes = dict(attribute.split("=") for attribute in matches)
@@ -87,20 +609,30 @@ def parse_tfs_custom_attributes(req):
 
 
 def create_tfs_config_individual_model(model_name, base_path):
+    return create_tfs_config_models({model_name: base_path})
+
+
+def create_tfs_config_models(models):
+    """Creates a TFS model config for several models served by one TFS instance.
+
+    :param models: dict, model name -> model base path
+    :return: model config file content
+    """
     config = "model_config_list: {\n"
-    config += "  config: {\n"
-    config += "    name: '{}'\n".format(model_name)
-    config += "    base_path: '{}'\n".format(base_path)
-    config += "    model_platform: 'tensorflow'\n"
-
-    config += "    model_version_policy: {\n"
-    config += "      specific: {\n"
-    for version in find_model_versions(base_path):
-        config += "        versions: {}\n".format(version)
-    config += "      }\n"
-    config += "    }\n"
-
-    config += "  }\n"
+    for model_name, base_path in models.items():
+        config += "  config: {\n"
+        config += "    name: '{}'\n".format(model_name)
+        config += "    base_path: '{}'\n".format(base_path)
+        config += "    model_platform: 'tensorflow'\n"
+
+        config += "    model_version_policy: {\n"
+        config += "      specific: {\n"
+        for version in find_model_versions(base_path):
+            config += "        versions: {}\n".format(version)
+        config += "      }\n"
+        config += "    }\n"
+
+        config += "  }\n"
     config += "}\n"
     return config
 
@@ -255,45 +787,62 @@ def create_batching_config(batching_config_file):
         f.write(config)
 
 
-def wait_for_model(rest_port, model_name, timeout_seconds, pid=None):
-    """
-    Notice:
-    The calculation for retry count based on timeout_seconds might introduce a small delta (0.1s) for each retry
-    which might cause total timeout longer than timeout_seconds
+def wait_for_model(rest_port, model_name, timeout_seconds, pid=None, started_at=None):
+    """Polls TFS until every version of a model is AVAILABLE.
+
+    The wait between polls starts at READINESS_INITIAL_BACKOFF_SECONDS and doubles up to
+    READINESS_MAX_BACKOFF_SECONDS, with jitter so that concurrent loads do not poll in lockstep.
+    time.sleep yields to the other greenlets of a gevent worker while it waits.
+
+    :param rest_port: TFS rest port
+    :param model_name: name of the model
+    :param timeout_seconds: wall clock time to wait for, from started_at
+    :param pid: pid of the TFS process, stop waiting as soon as it exits
+    :param started_at: time.time() when the TFS process was started or the load was requested,
+        defaults to now
+    :return: ModelReadiness, the seconds from started_at until TFS answered (time_to_spawn)
+        and until the model was AVAILABLE (time_to_available)
     """
     tfs_url = "http://localhost:{}/v1/models/{}".format(rest_port, model_name)
-    start = time.time()
-    try:
-        session = requests.Session()
-        backoff_factor = 0.1
-        # sleep = {backoff factor} * (2 ^ ({number of retries so far} - 1))
-        retry_count = retry_from_timeout(timeout_seconds, backoff_factor)
-        retries = Retry(total=retry_count, backoff_factor=backoff_factor)
-        session.mount("http://", requests.adapters.HTTPAdapter(max_retries=retries))
-        log.info(
-            "Trying to connect with model server: {} with timeout : {} and retry : {}".format(
-                tfs_url, timeout_seconds, retry_count
-            )
-        )
-        response = session.get(tfs_url, timeout=0.1)
-        log.info(
-            f"tfs response status_code: {response.status_code} with content : {json.loads(response.content)}"
-        )
-        end = time.time()
-        if response.status_code == 200:
-            if is_model_ready(response):
-                return
-            elif wait_for_model_ready(tfs_url, timeout_seconds - int(end - start)):
-                return
-
-        raise MultiModelException(408, "Timed out after {} seconds".format(timeout_seconds), pid)
-    except (
-        ConnectionRefusedError,
-        NewConnectionError,
-        MaxRetryError,
-        requests.exceptions.ConnectionError,
-    ):
-        raise MultiModelException(408, "Timed out after {} seconds".format(timeout_seconds), pid)
+    started_at = started_at or time.time()
+    deadline = started_at + timeout_seconds
+    backoff = READINESS_INITIAL_BACKOFF_SECONDS
+    time_to_spawn = None
+    polls = 0
+    log.info("waiting for model server: {} with timeout : {}".format(tfs_url, timeout_seconds))
+    with requests.Session() as session:
+        while True:
+            polls += 1
+            try:
+                response = session.get(tfs_url, timeout=min(max(deadline - time.time(), 0.01), 1))
+            except requests.exceptions.RequestException:
+                response = None
+            now = time.time()
+
+            if response is not None:
+                if time_to_spawn is None:
+                    time_to_spawn = now - started_at
+                if response.status_code == 200:
+                    error = model_load_error(response)
+                    if error:
+                        raise MultiModelException(500, error, pid)
+                    if is_model_ready(response):
+                        readiness = ModelReadiness(
+                            model_name, rest_port, time_to_spawn, now - started_at, polls
+                        )
+                        log.info("model ready: {}".format(dict(readiness._asdict())))
+                        return readiness
+
+            if pid is not None and not is_process_running(pid):
+                raise MultiModelException(
+                    408, "tensorflow serving (pid: {}) exited while loading".format(pid), pid
+                )
+            if now >= deadline:
+                raise MultiModelException(
+                    408, "Timed out after {} seconds".format(timeout_seconds), pid
+                )
+            time.sleep(min(backoff / 2 + random.uniform(0, backoff / 2), deadline - now))
+            backoff = min(backoff * 2, READINESS_MAX_BACKOFF_SECONDS)
 
 
 def is_model_ready(response):
@@ -303,31 +852,43 @@ def is_model_ready(response):
     return False
 
 
-def wait_for_model_ready(url, timeout_seconds):
+def model_load_error(response):
+    """Returns the error message of a model version that failed to load, None if there is none."""
+    for version in json.loads(response.content)["model_version_status"]:
+        status = version.get("status", {})
+        if version["state"] == "END" and status.get("error_code", "OK") != "OK":
+            return status.get("error_message") or status["error_code"]
+    return None
+
+
+def is_process_running(pid):
     try:
-        while timeout_seconds > 0:
-            response = requests.get(url, timeout=0.1)
-            log.info(
-                f"wait_for_model_ready response status_code : {response.status_code} "
-                f"response : {json.loads(response.content)} timeout in : {timeout_seconds}s"
-            )
-            if response.status_code != 200:
-                return False
-            if is_model_ready(response):
-                return True
-            timeout_seconds -= 1
-        return False
-    except requests.exceptions.RequestException:
+        with open("/proc/{}/stat".format(pid), encoding="utf8") as f:
+            # the state follows the parenthesized command name, Z is an unreaped zombie
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except (OSError, IndexError):
         return False
 
 
-def retry_from_timeout(timeout_seconds, backoff_factor):
-    retry_count = 1
-    retry_time = 0
-    while retry_time < timeout_seconds:
-        retry_count += 1
-        retry_time += backoff_factor * (2 ** (retry_count + 1))
-    return retry_count
+def get_process_rss_mb(pid):
+    """Resident memory of a process in MB, 0 if it is gone."""
+    try:
+        with open("/proc/{}/statm".format(pid), "r", encoding="utf8") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return 0
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def get_directory_size_mb(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size / (1024 * 1024)
 
 
 def get_cpu_memory_util():
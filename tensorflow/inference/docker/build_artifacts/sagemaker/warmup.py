@@ -0,0 +1,163 @@
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Warms up models that TFS reports AVAILABLE before they take invocations.
+
+The first predictions of a freshly loaded model pay for graph optimization, kernel autotuning and
+memory allocation. TFS replays assets.extra/tf_serving_warmup_requests itself while it loads a
+model version (--enable_model_warmup, on by default), before the version turns AVAILABLE, so
+those models need nothing more. The other models get synthetic predict requests, built from the
+signatures in their metadata.
+"""
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+
+import requests
+
+log = logging.getLogger(__name__)
+
+WARMUP_REQUESTS_FILE = os.path.join("assets.extra", "tf_serving_warmup_requests")
+PREDICT_METHOD = "tensorflow/serving/predict"
+DEFAULT_SIGNATURE = "serving_default"
+# larger inputs are not generated, warming up must not cost more than the spike it avoids
+MAX_SYNTHETIC_ELEMENTS = 1024 * 1024
+
+WarmupResult = namedtuple(
+    "WarmupResult", "model_name, source, requests, seconds, first_request_ms, warm_request_ms"
+)
+
+_ZEROS = {
+    "DT_FLOAT": 0.0,
+    "DT_DOUBLE": 0.0,
+    "DT_HALF": 0.0,
+    "DT_BFLOAT16": 0.0,
+    "DT_BOOL": False,
+    "DT_STRING": "",
+}
+
+
+def has_warmup_requests(base_path):
+    """Returns True if every version of the model under base_path ships TFS warmup requests."""
+    try:
+        versions = [os.path.join(base_path, v) for v in os.listdir(base_path) if v.isdigit()]
+    except OSError:
+        return False
+    return bool(versions) and all(
+        os.path.isfile(os.path.join(version, WARMUP_REQUESTS_FILE)) for version in versions
+    )
+
+
+def synthetic_inputs(signature):
+    """Returns the inputs of a REST predict request with zeros in the shapes of a signature,
+    unknown dimensions are 1.
+
+    :param signature: signature_def of the model metadata
+    :return: dict of input name to nested lists, None if an input has an unknown rank or is
+        larger than MAX_SYNTHETIC_ELEMENTS
+    """
+    inputs = {}
+    for name, tensor in signature.get("inputs", {}).items():
+        shape = tensor.get("tensor_shape", {})
+        if shape.get("unknown_rank"):
+            return None
+        dims = [max(int(dim.get("size", -1)), 1) for dim in shape.get("dim", [])]
+        elements = 1
+        for size in dims:
+            elements *= size
+        if elements > MAX_SYNTHETIC_ELEMENTS:
+            return None
+
+        value = _ZEROS.get(tensor.get("dtype"), 0)
+        for size in reversed(dims):
+            value = [value] * size
+        inputs[name] = value
+    return inputs
+
+
+def warm_up(rest_port, model_name, base_path=None, iterations=3, timeout_seconds=60):
+    """Sends synthetic predict requests to every predict signature of a model. Failures are
+    logged, a model that can not be warmed up still serves.
+
+    :param rest_port: TFS rest port
+    :param model_name: name of the model
+    :param base_path: model directory, models with TFS warmup requests are skipped
+    :param iterations: requests per signature
+    :param timeout_seconds: timeout of each request
+    :return: WarmupResult, with the latency of the first request and of the last request of the
+        first signature
+    """
+    start = time.time()
+    if base_path and has_warmup_requests(base_path):
+        log.info("model {} was warmed up by TFS with {}".format(model_name, WARMUP_REQUESTS_FILE))
+        return WarmupResult(model_name, WARMUP_REQUESTS_FILE, 0, 0.0, None, None)
+
+    url = "http://localhost:{}/v1/models/{}".format(rest_port, model_name)
+    latencies = []
+    sent = 0
+    with requests.Session() as session:
+        try:
+            response = session.get(url + "/metadata", timeout=timeout_seconds)
+            signatures = response.json()["metadata"]["signature_def"]["signature_def"]
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            log.warning("failed to read the signatures of model {}: {}".format(model_name, e))
+            signatures = {}
+
+        # the default signature first, it is the one invocations use unless they pick another
+        for signature_name in sorted(signatures, key=lambda name: name != DEFAULT_SIGNATURE):
+            signature = signatures[signature_name]
+            if signature.get("method_name") != PREDICT_METHOD:
+                continue
+            inputs = synthetic_inputs(signature)
+            if inputs is None:
+                log.info(
+                    "skipping warmup of signature {} of model {}, an input has an unknown rank "
+                    "or more than {} elements".format(
+                        signature_name, model_name, MAX_SYNTHETIC_ELEMENTS
+                    )
+                )
+                continue
+
+            body = json.dumps({"signature_name": signature_name, "inputs": inputs})
+            signature_latencies = []
+            for _ in range(iterations):
+                request_start = time.time()
+                try:
+                    response = session.post(url + ":predict", data=body, timeout=timeout_seconds)
+                except requests.exceptions.RequestException as e:
+                    response = None
+                    error = str(e)
+                else:
+                    error = response.text
+                sent += 1
+                if response is None or response.status_code != 200:
+                    log.warning(
+                        "warmup request to signature {} of model {} failed: {}".format(
+                            signature_name, model_name, error
+                        )
+                    )
+                    break
+                signature_latencies.append((time.time() - request_start) * 1000)
+            latencies = latencies or signature_latencies
+
+    result = WarmupResult(
+        model_name,
+        "synthetic",
+        sent,
+        time.time() - start,
+        latencies[0] if latencies else None,
+        latencies[-1] if latencies else None,
+    )
+    log.info("model warmup: {}".format(dict(result._asdict())))
+    return result
@@ -1,5 +1,6 @@
 import os
 import numpy as np
+import subprocess
 import time
 import argparse
 
@@ -73,8 +74,49 @@ def perf_test(exec_cmd):
         print("DLC Telemetry performance test Passed")
 
 
+def _sitecustomize_import_us(env):
+    """
+    Return the time python spends in the sitecustomize.py hook in microseconds, as reported by
+    -X importtime
+    """
+    output = subprocess.run(
+        ["python", "-X", "importtime", "-c", "pass"], env=env, capture_output=True, text=True
+    ).stderr
+    for line in output.splitlines():
+        _, cumulative_us, package = line.split("|")
+        if package.strip() == "sitecustomize":
+            return int(cumulative_us)
+    raise AssertionError(f"sitecustomize not found in the import times:\n{output}")
+
+
+def startup_test():
+    os.environ["TEST_MODE"] = "0"
+    NUM_ITERATIONS = 20
+    MAX_HOOK_US = 10000
+
+    for opt_out_value in ["False", "true"]:
+        env = dict(os.environ, OPT_OUT_TRACKING=opt_out_value)
+        # the first interpreter of the container reports, the ones after it only see the marker
+        subprocess.run(["python", "-c", "pass"], env=env)
+
+        startup_times = []
+        for _ in range(NUM_ITERATIONS):
+            start = time.time()
+            subprocess.run(["python", "-c", "pass"], env=env)
+            startup_times.append(time.time() - start)
+        hook_us = _sitecustomize_import_us(env)
+        print(
+            f"OPT_OUT_TRACKING={opt_out_value}: interpreter startup "
+            f"{np.median(startup_times) * 1000:.1f} ms, sitecustomize {hook_us} us"
+        )
+        assert hook_us < MAX_HOOK_US, f"sitecustomize takes {hook_us} us at interpreter startup"
+
+    print("DLC Telemetry startup test Passed")
+
+
 def run_tests(test_cmd):
     print(f"Running tests with command: {test_cmd}")
+    startup_test()
     perf_test(test_cmd)
     opt_in_opt_out_test(test_cmd)
     print("All DLC telemetry test passed")
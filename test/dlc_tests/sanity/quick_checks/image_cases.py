@@ -0,0 +1,34 @@
+from src.image import DockerImage
+
+REPOSITORY = "123456789012.dkr.ecr.us-west-2.amazonaws.com/pr-pytorch-training"
+
+
+class UnusedDockerClient:
+    """
+    Stands in for docker.APIClient in tests that must not call the Docker daemon
+    """
+
+    def __getattr__(self, name):
+        raise AssertionError(f"Unexpected Docker API call {name}")
+
+
+def docker_image(client=None, info=None, **kwargs):
+    """
+    :param client: fake that stands in for docker.APIClient, UnusedDockerClient if None
+    :param info: <dict> info of the image, added to a default name and image size baseline
+    :param kwargs: arguments of DockerImage that replace the defaults of a pre_push image
+    :return: <DockerImage> image that does not connect to the Docker daemon
+    """
+    arguments = {
+        "dockerfile": "Dockerfile",
+        "repository": REPOSITORY,
+        "tag": "1.0-cpu",
+        "to_build": True,
+        "stage": "pre_push",
+    }
+    arguments.update(kwargs)
+    return DockerImage(
+        info={"name": "image", "image_size_baseline": 10, **(info or {})},
+        client=client or UnusedDockerClient(),
+        **arguments,
+    )
@@ -0,0 +1,160 @@
+import io
+
+import pytest
+
+from src import build_backend
+from test.dlc_tests.sanity.quick_checks import image_cases
+
+BUILDX_OUTPUT = b"""#1 [internal] load build definition from Dockerfile
+#1 DONE 0.1s
+#2 [base 1/2] FROM docker.io/library/ubuntu:22.04
+#2 CACHED
+#3 [base 2/2] RUN apt-get update
+#3 CACHED
+#4 [final 1/1] RUN pip install torch
+#4 DONE 42.5s
+#5 exporting to image
+#5 DONE 3.0s
+"""
+
+FAILED_BUILDX_OUTPUT = b"""#1 [internal] load build definition from Dockerfile
+#1 DONE 0.1s
+#4 [final 1/1] RUN pip install torch
+#4 ERROR: process "/bin/sh -c pip install torch" did not complete successfully: exit code: 1
+"""
+
+
+class FakeProcess:
+    """
+    Stands in for the docker buildx process, prints output and keeps the context it read
+    """
+
+    def __init__(self, command, output, returncode):
+        self.command = command
+        self.stdin = io.BytesIO()
+        self.stdin.close = lambda: None
+        self.stdout = io.BytesIO(output)
+        self.returncode = returncode
+
+    def wait(self):
+        return self.returncode
+
+
+@pytest.fixture
+def buildx(monkeypatch):
+    processes = []
+
+    def run(output=BUILDX_OUTPUT, returncode=0):
+        def popen(command, **kwargs):
+            processes.append(FakeProcess(command, output, returncode))
+            return processes[-1]
+
+        monkeypatch.setattr(build_backend.subprocess, "Popen", popen)
+        monkeypatch.setattr(build_backend.BuildxBackend, "_builder_ready", True)
+        return processes
+
+    return run
+
+
+def _image(build_args=None):
+    image = image_cases.docker_image(
+        info={
+            "extra_build_args": build_args or {},
+            "labels": {"com.amazonaws.ml.engines.sagemaker.dlc.job.training": "true"},
+        },
+        target="final",
+    )
+    # As before a build
+    image.update_pre_build_configuration()
+    return image
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_backend")
+def test_buildx_command_imports_and_exports_cache():
+    image = _image()
+    local = build_backend.BuildxBackend(cache_dir="/tmp/buildx-cache").command(image)
+    registry = build_backend.BuildxBackend(cache_ref=image.repository).command(image)
+
+    assert local[:5] == ["docker", "buildx", "build", "--builder", "dlc-builder"]
+    assert ["--tag", image.ecr_url] == local[local.index("--tag") : local.index("--tag") + 2]
+    assert "--load" in local and local[-1] == "-"
+    assert "com.amazonaws.ml.engines.sagemaker.dlc.job.training=true" in local
+    assert ["--target", "final"] == local[local.index("--target") : local.index("--target") + 2]
+    assert "type=local,src=/tmp/buildx-cache/image-pre_push" in local
+    assert "type=local,dest=/tmp/buildx-cache/image-pre_push,mode=max" in local
+    assert f"type=registry,ref={image.repository}:buildcache-image-pre_push" in registry
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_backend")
+def test_images_built_on_local_images_use_default_builder():
+    image = _image(build_args={"PRE_PUSH_IMAGE": "local/image:pre-push"})
+    command = build_backend.BuildxBackend(cache_dir="/tmp/buildx-cache").command(image)
+
+    assert command[command.index("--builder") + 1] == "default"
+    assert "PRE_PUSH_IMAGE=local/image:pre-push" in command
+    assert "--cache-from" in command
+    assert "--cache-to" not in command
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_backend")
+def test_buildx_progress_maps_onto_build_status_and_summary(buildx):
+    processes = buildx()
+    image = _image()
+    image.build_backend = build_backend.BuildxBackend(cache_dir="/tmp/buildx-cache")
+
+    assert image.docker_build(fileobj=io.BytesIO(b"context"), custom_context=True) == 0
+
+    assert processes[0].stdin.getvalue() == b"context"
+    assert "#4 DONE 42.5s\n" in image.log[-1]
+    assert image.summary["build_backend"] == "buildx"
+    assert image.summary["build_steps"] == 3
+    assert image.summary["cached_steps"] == 2
+    assert image.summary["slowest_steps"][0] == "[final 1/1] RUN pip install torch 42.5s"
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_backend")
+def test_failed_buildx_step_fails_build(buildx):
+    buildx(output=FAILED_BUILDX_OUTPUT, returncode=1)
+    image = _image()
+    image.build_backend = build_backend.BuildxBackend()
+
+    assert image.docker_build(fileobj=io.BytesIO(b"context"), custom_context=True) == 1
+    assert image.summary["status"] == "Failed"
+    assert "[final 1/1] RUN pip install torch process" in image.log[-1][-1]
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_backend")
+def test_images_are_built_by_the_docker_api_by_default():
+    builds = []
+
+    class DockerClient:
+        def build(self, **kwargs):
+            builds.append(kwargs)
+            yield {"stream": "Successfully built"}
+
+    image = image_cases.docker_image(DockerClient())
+
+    assert image.docker_build(fileobj=io.BytesIO(b"FROM scratch")) == 0
+    assert image.docker_build(fileobj=io.BytesIO(b"context"), custom_context=True) == 0
+    assert [build["custom_context"] for build in builds] == [False, True]
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_backend")
+def test_create_build_backend():
+    assert isinstance(build_backend.create_build_backend(None), build_backend.DockerApiBackend)
+    assert isinstance(build_backend.create_build_backend("docker"), build_backend.DockerApiBackend)
+    assert isinstance(build_backend.create_build_backend("buildx"), build_backend.BuildxBackend)
+    with pytest.raises(ValueError):
+        build_backend.create_build_backend("kaniko")
@@ -0,0 +1,171 @@
+import io
+import threading
+import time
+
+import pytest
+
+from src import build_scheduler
+from test.dlc_tests.sanity.quick_checks import image_cases
+
+
+class FakeDockerClient:
+    """
+    Stands in for docker.APIClient, records the order of the builds and pushes of every image
+    """
+
+    def __init__(self, events, build_seconds=0.0, fail_build=False):
+        self.events = events
+        self.build_seconds = build_seconds
+        self.fail_build = fail_build
+
+    def build(self, tag, **kwargs):
+        time.sleep(self.build_seconds)
+        self.events.append(("build", tag))
+        if self.fail_build:
+            yield {"error": f"failed to build {tag}"}
+            return
+        yield {"stream": f"Successfully built {tag}"}
+
+    def inspect_image(self, image):
+        return {"Size": 1024 * 1024}
+
+    def push(self, repository, tag, **kwargs):
+        self.events.append(("push", f"{repository}:{tag}"))
+        yield {"status": "Pushed"}
+
+    def tag(self, image, repository, tag):
+        return True
+
+
+class FakeContext:
+    digest = "0" * 64
+    stats = {}
+
+    def open(self):
+        return io.BytesIO()
+
+    def remove(self):
+        pass
+
+
+def _image(name, client, base_image=None):
+    return image_cases.docker_image(
+        client,
+        info={"name": name, "base_image_uri": base_image.ecr_url if base_image else None},
+        repository=f"123456789012.dkr.ecr.us-west-2.amazonaws.com/{name}",
+        context=FakeContext(),
+        additional_tags=["1.0"],
+    )
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_scheduler")
+def test_push_does_not_wait_for_unrelated_builds():
+    events = []
+    slow = _image("slow", FakeDockerClient(events, build_seconds=1))
+    fast = _image("fast", FakeDockerClient(events))
+    scheduler = build_scheduler.DagScheduler(build_workers=2, push_workers=1)
+
+    pushed = build_scheduler.schedule_images(scheduler, [slow, fast])
+
+    assert scheduler.run()
+    assert pushed == [slow, fast]
+    assert events.index(("push", fast.ecr_url)) < events.index(("build", slow.ecr_url))
+    assert [task.name for task in scheduler.critical_path()] == [
+        "slow-pre_push-build",
+        "slow-pre_push-push",
+        "slow-pre_push-retag",
+    ]
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_scheduler")
+def test_child_build_waits_for_its_parent_only():
+    events = []
+    parent = _image("parent", FakeDockerClient(events, build_seconds=0.5))
+    child = _image("child", FakeDockerClient(events), base_image=parent)
+    other = _image("other", FakeDockerClient(events, build_seconds=1))
+    scheduler = build_scheduler.DagScheduler(build_workers=3, push_workers=3)
+
+    build_scheduler.schedule_images(scheduler, [child, parent, other])
+
+    assert scheduler.run()
+    assert events.index(("build", parent.ecr_url)) < events.index(("build", child.ecr_url))
+    assert events.index(("build", child.ecr_url)) < events.index(("build", other.ecr_url))
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_scheduler")
+def test_failure_skips_only_dependents():
+    events = []
+    parent = _image("parent", FakeDockerClient(events, fail_build=True))
+    child = _image("child", FakeDockerClient(events), base_image=parent)
+    other = _image("other", FakeDockerClient(events))
+    scheduler = build_scheduler.DagScheduler()
+
+    build_scheduler.schedule_images(scheduler, [parent, child, other])
+
+    assert not scheduler.run()
+    tasks = scheduler.tasks
+    assert tasks["parent-pre_push-build"].state == build_scheduler.FAILED
+    assert tasks["parent-pre_push-push"].state == build_scheduler.SKIPPED
+    assert tasks["child-pre_push-build"].state == build_scheduler.SKIPPED
+    assert tasks["child-pre_push-retag"].state == build_scheduler.SKIPPED
+    assert tasks["other-pre_push-retag"].state == build_scheduler.SUCCEEDED
+    assert ("build", child.ecr_url) not in events
+    assert child.build_status == build_scheduler.constants.FAIL
+    assert other.build_status == build_scheduler.constants.SUCCESS
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_scheduler")
+def test_push_concurrency_limit():
+    lock = threading.Lock()
+    running = []
+    max_running = []
+
+    def push():
+        with lock:
+            running.append(1)
+            max_running.append(len(running))
+        time.sleep(0.1)
+        with lock:
+            running.pop()
+        return build_scheduler.constants.SUCCESS
+
+    scheduler = build_scheduler.DagScheduler(build_workers=4, push_workers=2)
+    for i in range(6):
+        scheduler.add_task(f"push-{i}", build_scheduler.PUSH, push)
+
+    assert scheduler.run()
+    assert max(max_running) == 2
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_scheduler")
+def test_exception_fails_task():
+    failures = []
+
+    def broken():
+        raise RuntimeError("docker daemon is gone")
+
+    scheduler = build_scheduler.DagScheduler()
+    build = scheduler.add_task("build", build_scheduler.BUILD, broken, on_failure=failures.append)
+    scheduler.add_task(
+        "push",
+        build_scheduler.PUSH,
+        lambda: build_scheduler.constants.SUCCESS,
+        [build],
+        on_failure=failures.append,
+    )
+
+    assert not scheduler.run()
+    assert failures == [
+        "build raised RuntimeError: docker daemon is gone",
+        "Skipped because build did not succeed",
+    ]
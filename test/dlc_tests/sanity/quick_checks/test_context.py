@@ -0,0 +1,125 @@
+import gzip
+import io
+import os
+import tarfile
+
+import pytest
+
+from src import context as context_module
+from src.context import Context
+
+
+def _artifacts(root):
+    (root / "scripts").mkdir(mode=0o755)
+    (root / "scripts" / "b.sh").write_text("echo b")
+    (root / "scripts" / "a.sh").write_text("echo a")
+    (root / "Dockerfile").write_text("FROM scratch")
+    for path, mode in (("scripts", 0o755), ("scripts/a.sh", 0o755), ("scripts/b.sh", 0o644)):
+        os.chmod(root / path, mode)
+    os.chmod(root / "Dockerfile", 0o644)
+    return {
+        "dockerfile": {"source": "Dockerfile", "target": "Dockerfile"},
+        "scripts": {"source": "scripts", "target": "scripts"},
+    }
+
+
+def _members(context):
+    with context.open() as f, tarfile.open(fileobj=f, mode="r:*") as tar:
+        return [(member.name, member.mode, member.mtime) for member in tar.getmembers()]
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_context")
+def test_context_is_deterministic(tmp_path):
+    context = Context(_artifacts(tmp_path), str(tmp_path / "a.tar"), str(tmp_path))
+
+    assert _members(context) == [
+        ("Dockerfile", 0o644, 0),
+        ("scripts", 0o755, 0),
+        ("scripts/a.sh", 0o755, 0),
+        ("scripts/b.sh", 0o644, 0),
+    ]
+    assert context.stats["context_size"] == len(context.open().read())
+
+    # Touching the files changes their mtime but not the context
+    os.utime(tmp_path / "Dockerfile", (1, 1))
+    other = Context(
+        {"dockerfile": {"source": "Dockerfile", "target": "Dockerfile"}},
+        str(tmp_path / "b.tar"),
+        str(tmp_path),
+    )
+    other.add({"scripts": {"source": "scripts", "target": "scripts"}})
+    assert other.digest == context.digest
+    assert not other.stats["context_reused"]
+    assert not os.path.exists(tmp_path / "a.tar")
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_context")
+def test_identical_contexts_are_reused(tmp_path):
+    artifacts = _artifacts(tmp_path)
+    first = Context(artifacts, str(tmp_path / "first.tar"), str(tmp_path))
+    second = Context(artifacts, str(tmp_path / "second.tar"), str(tmp_path))
+
+    assert not first.stats["context_reused"]
+    assert second.stats["context_reused"]
+    assert second.digest == first.digest
+
+    first.remove()
+    assert second.open().read()
+    second.remove()
+    third = Context(artifacts, str(tmp_path / "third.tar"), str(tmp_path))
+    assert not third.stats["context_reused"]
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_context")
+def test_changed_artifact_is_not_reused(tmp_path):
+    artifacts = _artifacts(tmp_path)
+    first = Context(artifacts, str(tmp_path / "first.tar"), str(tmp_path))
+    (tmp_path / "Dockerfile").write_text("FROM ubuntu")
+    second = Context(artifacts, str(tmp_path / "second.tar"), str(tmp_path))
+
+    assert not second.stats["context_reused"]
+    assert second.digest != first.digest
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_context")
+def test_gzip_context(tmp_path):
+    context = Context(
+        _artifacts(tmp_path), str(tmp_path / "a.tar.gz"), str(tmp_path), compression="gz"
+    )
+
+    with context.open() as f:
+        data = f.read()
+    with tarfile.open(fileobj=io.BytesIO(gzip.decompress(data)), mode="r:") as tar:
+        assert tar.extractfile("Dockerfile").read() == b"FROM scratch"
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("build_context")
+def test_contexts_share_the_in_memory_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(context_module, "_in_memory_bytes", 0)
+    artifacts = _artifacts(tmp_path)
+    first = Context(artifacts, str(tmp_path / "first.tar"), str(tmp_path))
+    monkeypatch.setattr(
+        context_module, "MAX_IN_MEMORY_CONTEXT_BYTES", first.stats["context_size"] * 3 // 2
+    )
+
+    (tmp_path / "Dockerfile").write_text("FROM ubuntu")
+    second = Context(artifacts, str(tmp_path / "second.tar"), str(tmp_path))
+    assert os.path.exists(tmp_path / "second.tar")
+
+    first.remove()
+    second.remove()
+    assert context_module._in_memory_bytes == 0
+    (tmp_path / "Dockerfile").write_text("FROM debian")
+    third = Context(artifacts, str(tmp_path / "third.tar"), str(tmp_path))
+    assert not os.path.exists(tmp_path / "third.tar")
+    third.remove()
@@ -29,6 +29,8 @@ def test_developer_configuration():
     assert config.parse_dlc_developer_configs("build", "build_training") is True
     assert config.parse_dlc_developer_configs("build", "build_inference") is True
     assert config.parse_dlc_developer_configs("build", "do_build") is True
+    assert config.parse_dlc_developer_configs("build", "reuse_unchanged_images") is True
+    assert config.parse_dlc_developer_configs("build", "build_backend") == "docker"
 
     # Check test settings
     assert config.parse_dlc_developer_configs("test", "sanity_tests") is True
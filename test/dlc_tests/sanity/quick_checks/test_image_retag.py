@@ -0,0 +1,129 @@
+import threading
+import time
+
+import pytest
+
+from botocore.exceptions import ClientError
+
+from src import image_reuse
+from test.dlc_tests.sanity.quick_checks import image_cases
+from test.dlc_tests.sanity.quick_checks.image_cases import REPOSITORY
+
+
+class LocalRegistry:
+    """
+    Stands in for the ECR client, keeps manifests in memory and rejects the tags in reject_tags
+    """
+
+    def __init__(self, reject_tags=(), put_seconds=0.0):
+        self.manifests = {}
+        self.reject_tags = set(reject_tags)
+        self.put_seconds = put_seconds
+        self.lock = threading.Lock()
+        self.running_puts = 0
+        self.max_running_puts = 0
+
+    def push(self, repository_name, tag, manifest):
+        self.manifests[(repository_name, tag)] = manifest
+
+    def batch_get_image(self, registryId, repositoryName, imageIds, acceptedMediaTypes):
+        tag = imageIds[0]["imageTag"]
+        if (repositoryName, tag) not in self.manifests:
+            return {"images": [], "failures": [{"failureCode": "ImageNotFound"}]}
+        return {
+            "images": [
+                {
+                    "imageManifest": self.manifests[(repositoryName, tag)],
+                    "imageManifestMediaType": acceptedMediaTypes[0],
+                }
+            ],
+            "failures": [],
+        }
+
+    def put_image(
+        self, registryId, repositoryName, imageManifest, imageManifestMediaType, imageTag
+    ):
+        with self.lock:
+            self.running_puts += 1
+            self.max_running_puts = max(self.max_running_puts, self.running_puts)
+        time.sleep(self.put_seconds)
+        with self.lock:
+            self.running_puts -= 1
+        if imageTag in self.reject_tags:
+            raise ClientError({"Error": {"Code": "LimitExceededException"}}, "PutImage")
+        if self.manifests.get((repositoryName, imageTag)) == imageManifest:
+            raise ClientError({"Error": {"Code": "ImageAlreadyExistsException"}}, "PutImage")
+        self.manifests[(repositoryName, imageTag)] = imageManifest
+        return {}
+
+
+class FakeDockerClient:
+    def __init__(self, registry):
+        self.registry = registry
+        self.pushed_tags = []
+
+    def tag(self, image, repository, tag):
+        return True
+
+    def push(self, repository, tag, **kwargs):
+        self.pushed_tags.append(tag)
+        self.registry.push(repository.split("/", 1)[1], tag, '{"layers": []}')
+        yield {"status": "Pushed"}
+
+
+def _image(local_registry, additional_tags):
+    image = image_cases.docker_image(
+        FakeDockerClient(local_registry),
+        tag="1.0-cpu-pre-push",
+        additional_tags=additional_tags,
+    )
+    image.registry = image_reuse.EcrImageRegistry("us-west-2", ecr_client=local_registry)
+    # As after a successful build
+    image.build_status = 0
+    return image
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("image_retag")
+def test_additional_tags_are_attached_in_registry():
+    local_registry = LocalRegistry(put_seconds=0.2)
+    tags = ["1.0-cpu", "1.0-cpu-2024-01-01", "1.0-cpu-2024-01-01-00-00-00", "input-abc"]
+    image = _image(local_registry, tags)
+
+    assert image.push_image() == 0
+    assert image.push_image_with_additional_tags() == 0
+
+    assert image.client.pushed_tags == ["1.0-cpu-pre-push"]
+    manifest = local_registry.manifests[("pr-pytorch-training", "1.0-cpu-pre-push")]
+    for tag in tags:
+        assert local_registry.manifests[("pr-pytorch-training", tag)] == manifest
+        assert f"{REPOSITORY}:{tag}" in image.summary["pushed_uris"]
+    assert local_registry.max_running_puts == len(tags)
+    assert image.summary["retag_time"] < 0.2 * len(tags)
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("image_retag")
+def test_existing_tag_is_not_an_error():
+    local_registry = LocalRegistry()
+    registry = image_reuse.EcrImageRegistry("us-west-2", ecr_client=local_registry)
+    local_registry.push("pr-pytorch-training", "1.0-cpu-pre-push", "manifest")
+    local_registry.push("pr-pytorch-training", "1.0-cpu", "manifest")
+
+    assert registry.add_tags(REPOSITORY, "1.0-cpu-pre-push", ["1.0-cpu", "latest"]) == []
+    assert registry.add_tags(REPOSITORY, "missing", ["1.0-cpu"]) == ["1.0-cpu"]
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("image_retag")
+def test_rejected_tags_fall_back_to_docker_push():
+    local_registry = LocalRegistry(reject_tags=["1.0-cpu-2024-01-01"])
+    image = _image(local_registry, ["1.0-cpu", "1.0-cpu-2024-01-01"])
+    image.push_image()
+
+    assert image.push_image_with_additional_tags() == 0
+    assert image.client.pushed_tags == ["1.0-cpu-pre-push", "1.0-cpu-2024-01-01"]
+    assert ("pr-pytorch-training", "1.0-cpu") in local_registry.manifests
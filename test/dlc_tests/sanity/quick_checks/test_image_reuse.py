@@ -0,0 +1,202 @@
+import io
+
+import pytest
+
+from src import image as image_module
+from src import image_reuse
+from test.dlc_tests.sanity.quick_checks import image_cases
+
+
+class FakeDockerClient:
+    """
+    Stands in for docker.APIClient with a set of local images and their labels
+    """
+
+    def __init__(self, local_images=None):
+        self.local_images = local_images or {}
+        self.registry_digests = {}
+        self.built = []
+        self.pulled = []
+        self.tagged = []
+
+    def build(self, tag, labels, **kwargs):
+        self.built.append(tag)
+        self.local_images[tag] = labels
+        yield {"stream": f"Successfully built {tag}"}
+
+    def images(self, filters):
+        key, value = filters["label"].split("=")
+        return [
+            {"Id": image_id}
+            for image_id, labels in self.local_images.items()
+            if labels.get(key) == value
+        ]
+
+    def pull(self, repository, **kwargs):
+        self.pulled.append(repository)
+        self.local_images[repository] = {"com.amazonaws.ml.dlc.build-seconds": "1800"}
+        yield {"status": "Downloaded"}
+
+    def tag(self, image, repository, tag):
+        self.tagged.append((image, f"{repository}:{tag}"))
+        self.local_images[f"{repository}:{tag}"] = self.local_images[image]
+        return True
+
+    def inspect_image(self, image):
+        return {"Size": 1024 * 1024, "Config": {"Labels": self.local_images[image]}}
+
+    def inspect_distribution(self, image):
+        return {"Descriptor": {"digest": self.registry_digests[image]}}
+
+
+class FakeRegistry:
+    def __init__(self, tags=()):
+        self.tags = set(tags)
+        self.lookups = []
+
+    def find(self, repository, tag):
+        self.lookups.append(tag)
+        return f"{repository}:{tag}" if tag in self.tags else None
+
+
+class FakeContext:
+    stats = {}
+
+    def __init__(self, digest):
+        self.digest = digest
+
+    def open(self):
+        return io.BytesIO()
+
+    def remove(self):
+        pass
+
+
+def _image(client, digest="a" * 64, build_args=None, tag="1.0-cpu", dockerfile="Dockerfile"):
+    image = image_cases.docker_image(
+        client,
+        info={
+            "extra_build_args": build_args or {},
+            "labels": {"com.amazonaws.ml.engines.sagemaker.dlc.job.training": "true"},
+        },
+        dockerfile=dockerfile,
+        tag=tag,
+        context=FakeContext(digest),
+        additional_tags=[tag],
+    )
+    image.reuse_existing_images = True
+    return image
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("image_reuse")
+def test_fingerprint_depends_only_on_inputs():
+    client = FakeDockerClient()
+    fingerprint = _image(client).input_fingerprint()
+
+    assert _image(client, tag="1.0-cpu-pr-2").input_fingerprint() == fingerprint
+    assert _image(client, digest="b" * 64).input_fingerprint() != fingerprint
+    assert _image(client, build_args={"PYTHON": "3.11"}).input_fingerprint() != fingerprint
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("image_reuse")
+def test_built_image_is_labeled_and_reused_locally():
+    client = FakeDockerClient()
+    first = _image(client, tag="1.0-cpu-pr-1")
+    first.build()
+    fingerprint = first.summary["input_fingerprint"]
+
+    assert client.built == [first.ecr_url]
+    assert client.local_images[first.ecr_url]["com.amazonaws.ml.dlc.input-fingerprint"] == (
+        fingerprint
+    )
+    assert first.additional_tags[0] == image_reuse.fingerprint_tag(fingerprint)
+
+    second = _image(client, tag="1.0-cpu-pr-2")
+    second.registry = FakeRegistry()
+
+    assert second.build() == 0
+    assert client.built == [first.ecr_url]
+    assert (first.ecr_url, second.ecr_url) in client.tagged
+    assert second.summary["reused_image"] == first.ecr_url
+    assert second.registry.lookups == []
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("image_reuse")
+def test_image_is_reused_from_registry():
+    client = FakeDockerClient()
+    image = _image(client, digest="c" * 64)
+    fingerprint = image.input_fingerprint()
+    image.registry = FakeRegistry(tags=[image_reuse.fingerprint_tag(fingerprint)])
+
+    assert image.build() == 0
+    assert client.built == []
+    assert client.pulled == [f"{image.repository}:{image_reuse.fingerprint_tag(fingerprint)}"]
+    assert image.summary["build_time_saved"] == 1800
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("image_reuse")
+def test_changed_inputs_are_built():
+    client = FakeDockerClient()
+    _image(client, digest="d" * 64).build()
+    image = _image(client, digest="e" * 64)
+    image.registry = FakeRegistry()
+
+    image.build()
+
+    assert client.built == [
+        f"{image.repository}:{image.tag}",
+        f"{image.repository}:{image.tag}",
+    ]
+    assert "reused_image" not in image.summary
+    assert image.registry.lookups == [image_reuse.fingerprint_tag(image.input_fingerprint())]
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("image_reuse")
+def test_fingerprint_tag_is_pushed_only_if_images_are_reused():
+    image = _image(FakeDockerClient())
+    image.reuse_existing_images = False
+
+    image.build()
+
+    assert image.additional_tags == ["1.0-cpu"]
+
+
+@pytest.mark.quick_checks
+@pytest.mark.model("N/A")
+@pytest.mark.integration("image_reuse")
+def test_republished_base_image_changes_fingerprint(tmp_path, monkeypatch):
+    # Digests are resolved once per run
+    monkeypatch.setattr(image_module.image_reuse, "_BASE_IMAGE_DIGESTS", {})
+    dockerfile = tmp_path / "Dockerfile"
+    dockerfile.write_text(
+        "ARG PYTHON=3.10\n"
+        "ARG BASE=nvidia/cuda:12.1.1-base\n"
+        "FROM --platform=linux/amd64 ${BASE} AS base\n"
+        "FROM python:${PYTHON}-slim AS python\n"
+        "FROM base\n"
+        "COPY --from=python /usr/local /usr/local\n"
+    )
+    client = FakeDockerClient()
+    client.registry_digests = {
+        "nvidia/cuda:12.1.1-base": "sha256:1",
+        "python:3.11-slim": "sha256:2",
+    }
+    image = _image(client, build_args={"PYTHON": "3.11"}, dockerfile=str(dockerfile))
+
+    assert image.base_image_digests() == client.registry_digests
+    fingerprint = image.input_fingerprint()
+
+    monkeypatch.setattr(image_module.image_reuse, "_BASE_IMAGE_DIGESTS", {})
+    client.registry_digests["nvidia/cuda:12.1.1-base"] = "sha256:3"
+
+    assert image.input_fingerprint() != fingerprint
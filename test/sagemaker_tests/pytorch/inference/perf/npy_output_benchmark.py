@@ -0,0 +1,79 @@
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Compares the NPY encoding of default_output_fn of DefaultPytorchInferenceHandler with the
+previous round trip through python lists, for predictions of several sizes, e.g.
+
+    python perf/npy_output_benchmark.py --rows 1 64 1024
+
+Run it where the handler can be imported, i.e. in the EIA inference image.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import torch
+from sagemaker_inference import content_types, encoder
+
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(__file__),
+            *[os.pardir] * 5,
+            "pytorch",
+            "inference",
+            "docker",
+            "build_artifacts",
+        )
+    ),
+)
+
+from default_inference_handler import DefaultPytorchInferenceHandler  # noqa: E402
+
+
+def measure(fn, count):
+    fn()
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main(args):
+    torch.manual_seed(0)
+    handler = DefaultPytorchInferenceHandler()
+    print("predictions of {} features".format(args.features))
+
+    row_format = "{:<12} {:>16} {:>16}"
+    print(row_format.format("rows", "tolist npy ms", "npy ms"))
+    for rows in args.rows:
+        prediction = torch.rand(rows, args.features)
+        tolist_npy = measure(
+            lambda: encoder.encode(prediction.detach().cpu().numpy().tolist(), content_types.NPY),
+            args.count,
+        )
+        npy = measure(lambda: handler.default_output_fn(prediction, content_types.NPY), args.count)
+        print(row_format.format(rows, round(tolist_npy, 2), round(npy, 2)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[1, 64, 1024])
+    parser.add_argument("--features", type=int, default=256)
+    parser.add_argument("--count", type=int, default=50, help="calls per measurement")
+    main(parser.parse_args())
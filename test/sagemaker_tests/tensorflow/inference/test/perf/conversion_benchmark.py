@@ -0,0 +1,189 @@
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Compares the tfs_utils CSV and JSON lines converters with the njs front end and with a
+plain python conversion, e.g.
+
+    python test/perf/conversion_benchmark.py --rows 10000 --columns 20
+
+The njs numbers need the njs command line tool (part of nginx-module-njs) or node on the PATH,
+they run the conversion functions of tensorflowServing.js with a stub nginx request.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SAGEMAKER_ARTIFACTS = os.path.abspath(
+    os.path.join(
+        os.path.dirname(__file__),
+        *[os.pardir] * 6,
+        "tensorflow",
+        "inference",
+        "docker",
+        "build_artifacts",
+        "sagemaker",
+    )
+)
+sys.path.insert(0, SAGEMAKER_ARTIFACTS)
+
+import tfs_utils  # noqa: E402
+
+NJS_HARNESS = """
+import fs from 'fs';
+import ts from '%(module)s';
+
+function bench(name, convert, data) {
+    var body;
+    var r = {
+        headersIn: {},
+        uri: '/models/model/invoke',
+        variables: {default_tfs_model: 'model'},
+        requestText: data,
+        subrequest: function(uri, options, callback) { body = options.body; },
+    };
+    convert(r);
+    var times = [];
+    for (var i = 0; i < %(count)d; i++) {
+        var start = Date.now();
+        convert(r);
+        times.push(Date.now() - start);
+    }
+    times.sort(function(a, b) { return a - b; });
+    console.log(JSON.stringify({name: name, ms: times[Math.floor(times.length / 2)]}));
+}
+
+bench('csv', ts.csv_request, fs.readFileSync('%(csv)s').toString());
+bench('jsonlines', function(r) { ts.json_lines_request(r, r.requestText); },
+    fs.readFileSync('%(jsonlines)s').toString());
+"""
+
+
+def make_inputs(rows, columns):
+    random.seed(0)
+    matrix = [[round(random.random(), 6) for _ in range(columns)] for _ in range(rows)]
+    csv_body = "\n".join(",".join(str(value) for value in row) for row in matrix).encode("utf-8")
+    jsonlines_body = "\n".join(json.dumps(row) for row in matrix).encode("utf-8")
+    predictions = json.dumps({"predictions": matrix}).encode("utf-8")
+    return csv_body, jsonlines_body, predictions
+
+
+def plain_csv(body):
+    # what an inference.py input_handler typically does
+    lines = body.decode("utf-8").strip().split("\n")
+    return json.dumps({"instances": [[float(x) for x in line.split(",")] for line in lines]})
+
+
+def plain_jsonlines(body):
+    lines = body.decode("utf-8").strip().split("\n")
+    return json.dumps({"instances": [json.loads(line) for line in lines]})
+
+
+def plain_predictions_to_csv(body):
+    predictions = json.loads(body)["predictions"]
+    return "\n".join(",".join(str(value) for value in row) for row in predictions)
+
+
+def plain_predictions_to_jsonlines(body):
+    predictions = json.loads(body)["predictions"]
+    return "\n".join(json.dumps(row) for row in predictions)
+
+
+def measure(fn, count):
+    fn()
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def run_njs(runtime, csv_body, jsonlines_body, count):
+    with tempfile.TemporaryDirectory() as tmp:
+        # node only loads ES modules with an .mjs extension
+        extension = ".mjs" if os.path.basename(runtime) == "node" else ".js"
+        module = os.path.join(tmp, "tensorflowServing" + extension)
+        shutil.copy(os.path.join(SAGEMAKER_ARTIFACTS, "tensorflowServing.js"), module)
+        inputs = {"csv": csv_body, "jsonlines": jsonlines_body}
+        paths = {}
+        for name, body in inputs.items():
+            paths[name] = os.path.join(tmp, name)
+            with open(paths[name], "wb") as f:
+                f.write(body)
+        harness = os.path.join(tmp, "harness" + extension)
+        with open(harness, "w", encoding="utf8") as f:
+            f.write(NJS_HARNESS % dict(paths, module=module, count=count))
+        output = subprocess.check_output([runtime, harness]).decode("utf-8")
+    return {result["name"]: result["ms"] for result in map(json.loads, output.splitlines())}
+
+
+def main(args):
+    csv_body, jsonlines_body, predictions = make_inputs(args.rows, args.columns)
+    print(
+        "{} rows x {} columns, orjson: {}".format(
+            args.rows, args.columns, tfs_utils.orjson is not None
+        )
+    )
+
+    results = [
+        ("csv -> instances", "tfs_utils", lambda: tfs_utils.csv_to_instances(csv_body)),
+        ("csv -> instances", "plain python", lambda: plain_csv(csv_body)),
+        (
+            "jsonlines -> instances",
+            "tfs_utils",
+            lambda: tfs_utils.jsonlines_to_instances(io.BytesIO(jsonlines_body)),
+        ),
+        ("jsonlines -> instances", "plain python", lambda: plain_jsonlines(jsonlines_body)),
+        ("predictions -> csv", "tfs_utils", lambda: tfs_utils.predictions_to_csv(predictions)),
+        ("predictions -> csv", "plain python", lambda: plain_predictions_to_csv(predictions)),
+        (
+            "predictions -> jsonlines",
+            "tfs_utils",
+            lambda: tfs_utils.predictions_to_jsonlines(predictions),
+        ),
+        (
+            "predictions -> jsonlines",
+            "plain python",
+            lambda: plain_predictions_to_jsonlines(predictions),
+        ),
+    ]
+    row_format = "{:<26} {:<14} {:>10}"
+    print(row_format.format("conversion", "implementation", "p50 ms"))
+    for conversion, implementation, fn in results:
+        print(row_format.format(conversion, implementation, round(measure(fn, args.count), 2)))
+
+    runtime = args.njs or shutil.which("njs") or shutil.which("node")
+    if not runtime:
+        print("njs and node not found, skipping the njs front end")
+        return
+    njs_results = run_njs(runtime, csv_body, jsonlines_body, args.count)
+    implementation = os.path.basename(runtime)
+    print(row_format.format("csv -> instances", implementation, njs_results["csv"]))
+    print(row_format.format("jsonlines -> instances", implementation, njs_results["jsonlines"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--columns", type=int, default=20)
+    parser.add_argument("--count", type=int, default=20, help="conversions per measurement")
+    parser.add_argument("--njs", help="path of the njs or node binary, found on the PATH if unset")
+    main(parser.parse_args())
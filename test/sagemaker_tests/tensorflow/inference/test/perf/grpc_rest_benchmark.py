@@ -0,0 +1,172 @@
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Compares the python_service REST and gRPC predict paths against a stub model server.
+
+The stub serves the same single input model over REST (json parsing in python) and over
+PredictionService (TensorProto parsing), so the numbers show the client side conversion cost
+plus the payload parsing cost of each protocol. Run it inside the TFS inference image, e.g.
+
+    python test/perf/grpc_rest_benchmark.py --rows 1 100 1000 --columns 1000
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+from concurrent import futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import grpc
+import numpy as np
+import tensorflow as tf
+
+from tensorflow.core.protobuf import meta_graph_pb2
+from tensorflow_serving.apis import get_model_metadata_pb2
+from tensorflow_serving.apis import predict_pb2
+from tensorflow_serving.apis import prediction_service_pb2_grpc
+
+SAGEMAKER_ARTIFACTS = os.path.join(
+    os.path.dirname(__file__),
+    *[os.pardir] * 6,
+    "tensorflow",
+    "inference",
+    "docker",
+    "build_artifacts",
+    "sagemaker",
+)
+sys.path.insert(0, os.path.abspath(SAGEMAKER_ARTIFACTS))
+
+import tfs_grpc  # noqa: E402
+import tfs_utils  # noqa: E402
+
+MODEL_NAME = "stub"
+
+
+def _predict(instances):
+    # a cheap stand-in for a model: row sums
+    return np.asarray(instances, dtype=np.float32).sum(axis=-1, keepdims=True)
+
+
+class StubRestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        body = json.dumps({"predictions": _predict(payload["instances"]).tolist()}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubPredictionService(prediction_service_pb2_grpc.PredictionServiceServicer):
+    def GetModelMetadata(self, request, context):
+        signature = meta_graph_pb2.SignatureDef(method_name=tfs_grpc.PREDICT_METHOD_NAME)
+        signature.inputs["x"].dtype = tf.float32.as_datatype_enum
+        signature.outputs["y"].dtype = tf.float32.as_datatype_enum
+        signature_map = get_model_metadata_pb2.SignatureDefMap()
+        signature_map.signature_def[tfs_grpc.DEFAULT_SIGNATURE_NAME].CopyFrom(signature)
+
+        response = get_model_metadata_pb2.GetModelMetadataResponse()
+        response.model_spec.name = request.model_spec.name
+        response.metadata["signature_def"].Pack(signature_map)
+        return response
+
+    def Predict(self, request, context):
+        response = predict_pb2.PredictResponse()
+        outputs = _predict(tf.make_ndarray(request.inputs["x"]))
+        response.outputs["y"].CopyFrom(tf.make_tensor_proto(outputs))
+        return response
+
+
+def start_stub_servers(rest_port, grpc_port):
+    rest_server = ThreadingHTTPServer(("localhost", rest_port), StubRestHandler)
+    threading.Thread(target=rest_server.serve_forever, daemon=True).start()
+
+    options = [("grpc.max_receive_message_length", -1), ("grpc.max_send_message_length", -1)]
+    grpc_server = grpc.server(futures.ThreadPoolExecutor(max_workers=4), options=options)
+    prediction_service_pb2_grpc.add_PredictionServiceServicer_to_server(
+        StubPredictionService(), grpc_server
+    )
+    grpc_server.add_insecure_port("localhost:{}".format(grpc_port))
+    grpc_server.start()
+    return rest_server, grpc_server
+
+
+def measure(fn, count):
+    latencies = []
+    cpu_start = time.process_time()
+    for _ in range(count):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    cpu_ms = (time.process_time() - cpu_start) * 1000 / count
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "cpu_ms": cpu_ms,
+    }
+
+
+def main(args):
+    rest_server, grpc_server = start_stub_servers(args.rest_port, args.grpc_port)
+    sessions = tfs_utils.TfsSessionPool()
+    rest_uri = "http://localhost:{}/v1/models/{}:predict".format(args.rest_port, MODEL_NAME)
+    options = [("grpc.max_receive_message_length", -1), ("grpc.max_send_message_length", -1)]
+    channel = grpc.insecure_channel("localhost:{}".format(args.grpc_port), options=options)
+
+    row_format = "{:>8} {:>10} {:>6} {:>10} {:>10} {:>10}"
+    print(row_format.format("rows", "payload KB", "proto", "p50 ms", "p99 ms", "cpu ms"))
+    for rows in args.rows:
+        data = json.dumps(
+            {"instances": np.random.rand(rows, args.columns).astype(np.float32).tolist()}
+        )
+        results = {
+            "rest": measure(lambda: sessions.post(rest_uri, data=data).content, args.count),
+            "grpc": measure(
+                lambda: tfs_grpc.predict(channel, MODEL_NAME, None, data, 60).content, args.count
+            ),
+        }
+        for protocol, result in results.items():
+            print(
+                row_format.format(
+                    rows,
+                    round(len(data) / 1024.0, 1),
+                    protocol,
+                    round(result["p50_ms"], 2),
+                    round(result["p99_ms"], 2),
+                    round(result["cpu_ms"], 2),
+                )
+            )
+
+    rest_server.shutdown()
+    grpc_server.stop(0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--columns", type=int, default=1000)
+    parser.add_argument("--count", type=int, default=50, help="requests per payload size")
+    parser.add_argument("--rest-port", type=int, default=18501)
+    parser.add_argument("--grpc-port", type=int, default=19000)
+    main(parser.parse_args())
@@ -0,0 +1,133 @@
+# Copyright 2024 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+"""Compares the buffered and streaming (SAGEMAKER_TFS_STREAM_BODIES) default handler bodies.
+
+A stub TFS REST server in a separate process echoes every request body back, which is the
+worst case for large embedding responses. For each payload size the script reports the
+latency of the body round trip and the peak python memory allocated while handling one
+request, e.g.
+
+    python test/perf/streaming_benchmark.py --sizes-mb 1 10 50
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAGEMAKER_ARTIFACTS = os.path.join(
+    os.path.dirname(__file__),
+    *[os.pardir] * 6,
+    "tensorflow",
+    "inference",
+    "docker",
+    "build_artifacts",
+    "sagemaker",
+)
+sys.path.insert(0, os.path.abspath(SAGEMAKER_ARTIFACTS))
+
+import tfs_utils  # noqa: E402
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        remaining = int(self.headers["Content-Length"])
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(remaining))
+        self.end_headers()
+        while remaining:
+            chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+            self.wfile.write(chunk)
+            remaining -= len(chunk)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port):
+    ThreadingHTTPServer(("localhost", port), EchoHandler).serve_forever()
+
+
+def make_payload(size_mb):
+    row = [0.5] * 1000
+    row_size = len(json.dumps(row)) + 1
+    rows = max(1, size_mb * 1024 * 1024 // row_size)
+    return json.dumps({"instances": [row] * rows}).encode("utf-8")
+
+
+def buffered(sessions, uri, payload):
+    # what default_handler does without streaming
+    data = io.BytesIO(payload).read().decode("utf-8")
+    body = sessions.post(uri, data=data).content
+    return len(body)
+
+
+def streaming(sessions, uri, payload):
+    stream = io.BytesIO(payload)
+    response = sessions.post(uri, data=tfs_utils.StreamingBody(stream, len(payload)), stream=True)
+    # stands in for the WSGI server writing the chunks to the client
+    return sum(len(chunk) for chunk in tfs_utils.ResponseStream(response))
+
+
+def measure(fn, sessions, uri, payload, count):
+    fn(sessions, uri, payload)
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        fn(sessions, uri, payload)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    fn(sessions, uri, payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(latencies), peak / (1024.0 * 1024.0)
+
+
+def main(args):
+    server = multiprocessing.Process(target=serve, args=(args.port,), daemon=True)
+    server.start()
+    time.sleep(0.5)
+
+    sessions = tfs_utils.TfsSessionPool()
+    uri = "http://localhost:{}/v1/models/stub:predict".format(args.port)
+
+    row_format = "{:>8} {:>10} {:>10} {:>14}"
+    print(row_format.format("size MB", "mode", "p50 ms", "peak alloc MB"))
+    for size_mb in args.sizes_mb:
+        payload = make_payload(size_mb)
+        for mode, fn in (("buffered", buffered), ("streaming", streaming)):
+            latency, peak = measure(fn, sessions, uri, payload, args.count)
+            print(row_format.format(size_mb, mode, round(latency, 2), round(peak, 2)))
+
+    server.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes-mb", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--count", type=int, default=10, help="requests per payload size")
+    parser.add_argument("--port", type=int, default=18502)
+    main(parser.parse_args())
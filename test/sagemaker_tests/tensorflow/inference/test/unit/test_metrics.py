@@ -0,0 +1,37 @@
+# Copyright 2019-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import json
+import os
+
+import metrics
+
+
+def _write_metrics_file(directory, pid, values):
+    with open(os.path.join(directory, "{}.json".format(pid)), "w", encoding="utf8") as f:
+        json.dump({"pid": pid, "values": values}, f)
+
+
+def test_startup_timeline_survives_python_service_start(tmp_path):
+    # serve.py is still running, the worker of a previous gunicorn exited
+    startup_event = ["sagemaker_tfs_startup_seconds", [["event", "nginx ready"]], 2.5]
+    _write_metrics_file(tmp_path, os.getppid(), [startup_event])
+    _write_metrics_file(tmp_path, 999999999, [["sagemaker_tfs_requests_total", [], 7]])
+
+    service_metrics = metrics.ServiceMetrics(str(tmp_path))
+    service_metrics.inc("sagemaker_tfs_model_evictions_total", (("reason", "memory"),))
+    rendered = service_metrics.render()
+
+    assert 'sagemaker_tfs_startup_seconds{event="nginx ready"} 2.5' in rendered
+    assert 'sagemaker_tfs_model_evictions_total{reason="memory"} 1' in rendered
+    assert "sagemaker_tfs_requests_total" not in rendered
@@ -0,0 +1,143 @@
+# Copyright 2019-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import pytest
+
+import autotune
+import serve
+
+from multi_model_utils import TFS_INSTANCES_KEY, MultiModelException
+
+
+class FakeProcess:
+    def __init__(self, pid):
+        self.pid = pid
+
+
+class FakeRegistry:
+    """Keeps every table the service manager publishes"""
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, table):
+        self.writes.append(table[TFS_INSTANCES_KEY])
+
+
+class SynchronousThread:
+    def __init__(self, target, args=(), daemon=None):
+        self._target = target
+        self._args = args
+
+    def start(self):
+        self._target(*self._args)
+
+
+@pytest.fixture
+def service_manager(monkeypatch):
+    monkeypatch.setenv("SAGEMAKER_SAFE_PORT_RANGE", "9000-9100")
+    monkeypatch.setenv("SAGEMAKER_TFS_INSTANCE_COUNT", "2")
+    monkeypatch.setenv("SAGEMAKER_TFS_WAIT_TIME_SECONDS", "1")
+    monkeypatch.setenv("SAGEMAKER_TFS_DEFAULT_MODEL_NAME", "half_plus_three")
+    monkeypatch.setenv("SAGEMAKER_TFS_WARMUP", "false")
+    # the service manager exports the ports for the python service
+    monkeypatch.setenv("TFS_GRPC_PORTS", "")
+    monkeypatch.setenv("TFS_REST_PORTS", "")
+    monkeypatch.setattr(serve.threading, "Thread", SynchronousThread)
+
+    manager = serve.ServiceManager()
+    manager._tfs = [FakeProcess(101), FakeProcess(102)]
+    manager._tfs_instance_registry = FakeRegistry()
+    manager._start_single_tfs = lambda instance_id: FakeProcess(201)
+    return manager
+
+
+def test_restarted_tfs_that_never_becomes_ready_is_routed_to_again(service_manager, monkeypatch):
+    published_while_waiting = []
+
+    def wait_for_model(rest_port, model_name, timeout_seconds, pid=None, started_at=None):
+        published_while_waiting.append(service_manager._tfs_instance_registry.writes[-1])
+        raise MultiModelException(408, "Timed out after 1 seconds", pid)
+
+    monkeypatch.setattr(serve.tfs_utils, "wait_for_model", wait_for_model)
+
+    service_manager._restart_single_tfs(102)
+
+    assert published_while_waiting == [[["9001", "9000", 101]]]
+    assert service_manager._restarting_tfs == set()
+    assert service_manager._tfs_instance_registry.writes[-1] == [
+        ["9001", "9000", 101],
+        ["9003", "9002", 201],
+    ]
+
+
+def test_outdated_restart_does_not_route_to_the_instance(service_manager, monkeypatch):
+    def wait_for_model(rest_port, model_name, timeout_seconds, pid=None, started_at=None):
+        # the instance exits and _monitor restarts it again while the first restart waits
+        service_manager._tfs[1] = FakeProcess(301)
+        raise MultiModelException(408, "exited while loading", pid)
+
+    monkeypatch.setattr(serve.tfs_utils, "wait_for_model", wait_for_model)
+
+    service_manager._restart_single_tfs(102)
+
+    assert service_manager._restarting_tfs == {1}
+    assert service_manager._tfs_instance_registry.writes[-1] == [["9001", "9000", 101]]
+
+
+@pytest.fixture
+def autotuned_service_manager(monkeypatch):
+    for env_var in (
+        "SAGEMAKER_SAFE_PORT_RANGE",
+        "SAGEMAKER_TFS_INSTANCE_COUNT",
+        "SAGEMAKER_TFS_INTRA_OP_PARALLELISM",
+        "OMP_NUM_THREADS",
+    ):
+        monkeypatch.delenv(env_var, raising=False)
+    monkeypatch.setenv("SAGEMAKER_TFS_AUTOTUNE", "true")
+    monkeypatch.setenv("TFS_GRPC_PORTS", "")
+    monkeypatch.setenv("TFS_REST_PORTS", "")
+    # 4 GPUs on 16 cpus, autotune plans one TFS instance per GPU
+    topology = autotune.Topology(list(range(16)), None, {0: list(range(16))}, None, 4)
+    monkeypatch.setattr(serve.autotune, "read_topology", lambda gpus: topology)
+    monkeypatch.setattr(serve.tfs_utils, "get_directory_size_mb", lambda path: 0)
+    monkeypatch.setattr(serve.ServiceManager, "_get_number_of_gpu_on_host", lambda self: 4)
+
+    def create(**env):
+        for env_var, value in env.items():
+            monkeypatch.setenv(env_var, value)
+        return serve.ServiceManager()
+
+    return create
+
+
+def test_autotune_without_port_range_starts_one_instance(autotuned_service_manager):
+    manager = autotuned_service_manager()
+
+    assert manager._tfs_instance_count == 1
+    assert manager._tfs_rest_ports == ["8501"]
+    assert manager._tfs_omp_num_threads == "16"
+
+
+def test_autotune_fits_instances_into_port_range(autotuned_service_manager):
+    manager = autotuned_service_manager(SAGEMAKER_SAFE_PORT_RANGE="9000-9005")
+
+    assert manager._tfs_instance_count == 2
+    assert manager._tfs_rest_ports == ["9001", "9003"]
+    assert manager._tfs_omp_num_threads == "8"
+
+
+def test_autotune_leaves_omp_threads_to_tensorflow(autotuned_service_manager):
+    manager = autotuned_service_manager(SAGEMAKER_TFS_INTRA_OP_PARALLELISM="0")
+
+    assert manager._tfs_omp_num_threads is None
@@ -0,0 +1,137 @@
+# Copyright 2019-2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"). You
+# may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+#     http://aws.amazon.com/apache2.0/
+#
+# or in the "license" file accompanying this file. This file is
+# distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF
+# ANY KIND, either express or implied. See the License for the specific
+# language governing permissions and limitations under the License.
+
+import json
+import threading
+import time
+
+from collections import namedtuple
+
+import tfs_utils
+
+Context = namedtuple("Context", "rest_uri, model_name, model_version, method")
+CONTEXT = Context("http://localhost:8501/v1/models/half_plus_three:predict", "m", None, "predict")
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, predictions):
+        self._predictions = predictions
+
+    def json(self):
+        return {"predictions": self._predictions}
+
+
+def _start_concurrent_requests(coalescer, payloads):
+    results = [None] * len(payloads)
+
+    def predict(i):
+        key = coalescer.batch_key(payloads[i], CONTEXT)
+        results[i] = coalescer.predict(key, payloads[i], CONTEXT)
+
+    threads = [threading.Thread(target=predict, args=(i,)) for i in range(len(payloads))]
+    for thread in threads:
+        thread.start()
+        # the first request leads the batch
+        time.sleep(0.01)
+    return threads, results
+
+
+def test_coalesced_requests_share_one_call():
+    posts = []
+
+    def post(uri, data):
+        posts.append(json.loads(data))
+        return FakeResponse([instance * 2 for instance in posts[-1]["instances"]])
+
+    coalescer = tfs_utils.RequestCoalescer(post, 0.2, 64, timeout_seconds=5)
+    threads, results = _start_concurrent_requests(
+        coalescer, [{"instances": [1]}, {"instances": [2, 3]}]
+    )
+    for thread in threads:
+        thread.join(5)
+
+    assert posts == [{"instances": [1, 2, 3]}]
+    assert [json.loads(result.content) for result in results] == [
+        {"predictions": [2]},
+        {"predictions": [4, 6]},
+    ]
+
+
+def test_coalesced_requests_time_out_when_the_batch_call_hangs():
+    release = threading.Event()
+
+    def post(uri, data):
+        release.wait(5)
+        return FakeResponse([])
+
+    coalescer = tfs_utils.RequestCoalescer(post, 0.05, 2, timeout_seconds=0.3)
+    # the second request fills the batch and sends it, the first one waits for it
+    threads, results = _start_concurrent_requests(
+        coalescer, [{"instances": [1]}, {"instances": [2]}]
+    )
+    threads[0].join(2)
+
+    assert not threads[0].is_alive()
+    assert results[0].status_code == 504
+    assert coalescer._pending == {}
+    release.set()
+    threads[1].join(5)
+
+
+def test_request_that_does_not_fit_starts_the_next_batch():
+    posts = []
+
+    def post(uri, data):
+        posts.append(json.loads(data))
+        return FakeResponse([instance * 2 for instance in posts[-1]["instances"]])
+
+    coalescer = tfs_utils.RequestCoalescer(post, 0.2, 4, timeout_seconds=5)
+    threads, results = _start_concurrent_requests(
+        coalescer, [{"instances": [1, 2, 3]}, {"instances": [4, 5, 6]}]
+    )
+    for thread in threads:
+        thread.join(5)
+
+    assert posts == [{"instances": [1, 2, 3]}, {"instances": [4, 5, 6]}]
+    assert [json.loads(result.content) for result in results] == [
+        {"predictions": [2, 4, 6]},
+        {"predictions": [8, 10, 12]},
+    ]
+
+
+def test_predictions_that_do_not_match_the_instances_are_an_error():
+    coalescer = tfs_utils.RequestCoalescer(
+        lambda uri, data: FakeResponse([0] * 6), 0.2, 64, timeout_seconds=5
+    )
+    threads, results = _start_concurrent_requests(
+        coalescer, [{"instances": [1]}, {"instances": [2, 3]}]
+    )
+    for thread in threads:
+        thread.join(5)
+
+    assert [result.status_code for result in results] == [500, 500]
+    assert all(b"predictions" not in result.content for result in results)
+
+
+def test_ragged_csv_is_not_reshaped():
+    assert json.loads(tfs_utils.csv_to_instances("1,2\n3\n4,5,6")) == {
+        "instances": [[1, 2], 3, [4, 5, 6]]
+    }
+    assert json.loads(tfs_utils.csv_to_instances("1,2\n3,4,5\n6")) == {
+        "instances": [[1, 2], [3, 4, 5], 6]
+    }
+    assert json.loads(tfs_utils.csv_to_instances("1, 2.5\n3,4\n")) == {
+        "instances": [[1.0, 2.5], [3.0, 4.0]]
+    }